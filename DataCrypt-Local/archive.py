@@ -0,0 +1,340 @@
+"""Encrypted multi-file archives with an encrypted member index.
+
+A directory tree is packed into a single container (see container.py, flagged
+FLAG_ARCHIVE) whose plaintext is:
+
+    ARCHIVE_MAGIC, index length    16 bytes, see _PREFIX
+    index                          JSON list of members (name, offset, size, mode, mtime_ns)
+    member data                    every member's bytes, back to back
+
+The index is encrypted like the rest of the archive, so member names stay
+private. Because container chunks decrypt independently, listing an archive
+decrypts only the chunks holding the index, and extracting one member only
+the chunks overlapping its bytes (see reader.py). Extracting everything
+streams the whole archive through the parallel decryptor once.
+"""
+import io
+import json
+import os
+import struct
+
+import compression
+import container
+import engines
+import metrics
+from progress import Reporter
+
+ARCHIVE_MAGIC = b"DCRYARC1"
+# ARCHIVE_MAGIC, length of the JSON index that follows
+_PREFIX = struct.Struct(">8sQ")
+COPY_SIZE = 1024 * 1024
+
+
+def _scan(source_dir, exclude=None):
+    """Return (name, path, stat) for every regular file under source_dir, in a stable order."""
+    entries = []
+    for root, dirs, files in os.walk(source_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            if os.path.islink(path) or (exclude and os.path.abspath(path) == exclude):
+                continue
+            st = os.stat(path)
+            name = os.path.relpath(path, source_dir).replace(os.sep, "/")
+            entries.append((name, path, st))
+    return entries
+
+
+class _ArchiveStream(io.RawIOBase):
+    """Read-only stream of an archive's plaintext: the prefix and index, then every member in turn."""
+
+    def __init__(self, head, files):
+        super().__init__()
+        self._head = memoryview(head)
+        self._files = iter(files)  # (path, size) per member
+        self._current = None
+        self._remaining = 0
+
+    def readable(self):
+        return True
+
+    def _next_file(self):
+        """Open the next member; returns False once every member has been read."""
+        entry = next(self._files, None)
+        if entry is None:
+            return False
+        path, size = entry
+        self._current = (open(path, "rb"), path)
+        self._remaining = size
+        return True
+
+    def _finish_file(self):
+        f, path = self._current
+        try:
+            if f.read(1):
+                raise ValueError(f"{path} changed size while it was archived.")
+        finally:
+            f.close()
+        self._current = None
+
+    def readinto(self, b):
+        view = memoryview(b).cast("B")
+        filled = 0
+        if self._head:
+            filled = min(len(view), len(self._head))
+            view[:filled] = self._head[:filled]
+            self._head = self._head[filled:]
+        while filled < len(view):
+            if self._current is None and not self._next_file():
+                break
+            f, path = self._current
+            want = min(len(view) - filled, self._remaining)
+            n = f.readinto(view[filled:filled + want]) if want else 0
+            if want and not n:
+                raise ValueError(f"{path} changed size while it was archived.")
+            filled += n
+            self._remaining -= n
+            if not self._remaining:
+                self._finish_file()
+        return filled
+
+    def close(self):
+        if self._current is not None:
+            self._current[0].close()
+            self._current = None
+        super().close()
+
+
+def create_archive(source_dir, public_key_str, out_path=None, chunk_size=container.DEFAULT_CHUNK_SIZE, workers=None,
+                   compress=None, compress_level=None, verbose=True, progress=None, cancel_event=None, cipher=None, fsync=None):
+    """Pack every regular file under source_dir into one encrypted archive (default <dir>.enc).
+
+    public_key_str is a recipient key or list of keys, and cipher a chunk
+    engine name and fsync an output policy, as for encrypt_file.
+    Symbolic links are skipped. Returns the list of archived member names.
+    """
+    import encryptor
+
+    if chunk_size <= 0 or chunk_size % 16:
+        raise ValueError("chunk_size must be a positive multiple of 16 bytes.")
+    if not os.path.isdir(source_dir):
+        raise ValueError(f"Not a directory: {source_dir}")
+    codec = compression.codec_id(compress)
+    cipher_id = engines.engine_id(cipher)
+    recipients = public_key_str if isinstance(public_key_str, (list, tuple)) else [public_key_str]
+    if not recipients:
+        raise ValueError("At least one recipient public key is required.")
+    with metrics.span("create_archive", "load_key"):
+        public_keys = [encryptor.load_public_key(key) if isinstance(key, str) else key for key in recipients]
+    out_path = out_path or os.path.normpath(source_dir) + ".enc"
+
+    # Member sizes are known up front, so the index can go first and the total size into the header
+    entries = _scan(source_dir, exclude=os.path.abspath(out_path))
+    members = []
+    offset = 0
+    for name, _, st in entries:
+        members.append({"name": name, "offset": offset, "size": st.st_size,
+                        "mode": st.st_mode & 0o777, "mtime_ns": st.st_mtime_ns})
+        offset += st.st_size
+    index = json.dumps(members, separators=(",", ":")).encode()
+    head = _PREFIX.pack(ARCHIVE_MAGIC, len(index)) + index
+    plaintext_size = len(head) + offset
+
+    reporter = Reporter(plaintext_size, progress, cancel_event)
+    # A failed or cancelled run leaves no partial archive: write_container only renames a complete one into place
+    with metrics.span("create_archive", "total", plaintext_size):
+        with _ArchiveStream(head, [(path, st.st_size) for _, path, st in entries]) as src:
+            encryptor.write_container(src, plaintext_size, out_path, public_keys, chunk_size, workers, reporter,
+                                      codec=codec, level=compress_level, flags=container.FLAG_ARCHIVE,
+                                      operation="create_archive", cipher_id=cipher_id, fsync=fsync)
+
+    if verbose:
+        print(f"Archive created! {len(members)} files saved in {out_path}")
+    return [member["name"] for member in members]
+
+
+def _member_path(dest_dir, name):
+    """Return where member name is extracted under dest_dir, refusing names that would escape it."""
+    parts = name.split("/")
+    if not name or name.startswith("/") or any(part in ("", ".", "..") for part in parts) or "\\" in name:
+        raise ValueError(f"Unsafe member name in archive: {name!r}")
+    return os.path.join(dest_dir, *parts)
+
+
+def _finish_member(path, member):
+    os.chmod(path, member["mode"])
+    os.utime(path, ns=(member["mtime_ns"], member["mtime_ns"]))
+
+
+class EncryptedArchive:
+    """Read access to an encrypted archive: its member list and single members.
+
+    Opening the archive decrypts only the index; read() and extract() decrypt
+    only the chunks holding the requested member.
+    """
+
+    def __init__(self, archive_path, private_key_path=None, keyring=None):
+        from reader import EncryptedFileReader
+
+        self._path = archive_path
+        self._reader = EncryptedFileReader(archive_path, private_key_path, keyring)
+        try:
+            if not self._reader.header.is_archive:
+                raise ValueError("Not an encrypted archive.")
+            with metrics.span("list_archive", "index"):
+                prefix = self._reader.read(_PREFIX.size)
+                if len(prefix) != _PREFIX.size:
+                    raise ValueError("Archive index is corrupt.")
+                magic, index_len = _PREFIX.unpack(prefix)
+                if magic != ARCHIVE_MAGIC or _PREFIX.size + index_len > self._reader.size:
+                    raise ValueError("Archive index is corrupt.")
+                self.members = json.loads(self._reader.read(index_len))
+        except Exception:
+            self._reader.close()
+            raise
+        self._data_start = _PREFIX.size + index_len
+        self._by_name = {member["name"]: member for member in self.members}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self):
+        self._reader.close()
+
+    def names(self):
+        return [member["name"] for member in self.members]
+
+    def member(self, name):
+        try:
+            return self._by_name[name]
+        except KeyError:
+            raise ValueError(f"No such member in archive: {name}")
+
+    def iter_member(self, name, size=COPY_SIZE):
+        """Yield the content of member name in pieces of up to size bytes."""
+        member = self.member(name)
+        self._reader.seek(self._data_start + member["offset"])
+        remaining = member["size"]
+        while remaining:
+            data = self._reader.read(min(size, remaining))
+            if not data:
+                raise ValueError("Encrypted file is truncated. Decryption failed.")
+            remaining -= len(data)
+            yield data
+
+    def read(self, name):
+        """Return the content of member name."""
+        return b"".join(self.iter_member(name))
+
+    def extract(self, name, dest_dir, reporter=None):
+        """Write member name under dest_dir (keeping its relative path); returns the path written."""
+        member = self.member(name)
+        path = _member_path(dest_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            with open(path, "wb") as dst:
+                for data in self.iter_member(name):
+                    dst.write(data)
+                    if reporter is not None:
+                        reporter.advance(len(data))
+        except BaseException:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        _finish_member(path, member)
+        return path
+
+    def extract_all(self, dest_dir, workers=None, reporter=None):
+        """Extract every member under dest_dir, streaming the archive through the parallel decryptor once."""
+        import decryptor
+
+        for member in self.members:
+            _member_path(dest_dir, member["name"])
+        pending = iter(sorted(self.members, key=lambda member: member["offset"]))
+        member = next(pending, None)
+        dst = path = None
+        pos = 0  # plaintext offset of the current chunk
+        header = self._reader.header
+        try:
+            with open(self._path, "rb") as src:
+                src.seek(header.size)
+                for plaintext in decryptor._iter_plaintext(src, header, self._reader._cipher, workers,
+                                                           operation="extract_archive"):
+                    at = 0
+                    while member is not None and at < len(plaintext):
+                        start = self._data_start + member["offset"]
+                        end = start + member["size"]
+                        if pos + at < start:
+                            at = start - pos
+                            continue
+                        if dst is None:
+                            path = _member_path(dest_dir, member["name"])
+                            os.makedirs(os.path.dirname(path), exist_ok=True)
+                            dst = open(path, "wb")
+                        n = min(len(plaintext) - at, end - pos - at)
+                        dst.write(plaintext[at:at + n])
+                        if reporter is not None:
+                            reporter.advance(n)
+                        at += n
+                        if pos + at == end:
+                            dst.close()
+                            dst = None
+                            _finish_member(path, member)
+                            member = next(pending, None)
+                    pos += len(plaintext)
+            # Empty members at the very end of the archive are never reached by a chunk
+            while member is not None:
+                if member["size"]:
+                    raise ValueError("Encrypted file is truncated. Decryption failed.")
+                path = _member_path(dest_dir, member["name"])
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                open(path, "wb").close()
+                _finish_member(path, member)
+                member = next(pending, None)
+        finally:
+            if dst is not None:
+                dst.close()
+                os.remove(path)
+
+
+def open_archive(archive_path, private_key_path=None, keyring=None):
+    """Open an encrypted archive for listing and single-member extraction.
+
+    Example:
+        with open_archive("project.enc", "keys/private_key.pem") as archive:
+            config = archive.read("conf/settings.json")
+    """
+    return EncryptedArchive(archive_path, private_key_path, keyring)
+
+
+def list_archive(archive_path, private_key_path=None, keyring=None):
+    """Return the member list (dicts with name, offset, size, mode, mtime_ns) of an archive."""
+    with open_archive(archive_path, private_key_path, keyring) as archive:
+        return archive.members
+
+
+def extract_archive(archive_path, dest_dir=".", names=None, private_key_path=None, keyring=None, workers=None,
+                    verbose=True, progress=None, cancel_event=None):
+    """Extract the members called names (default: all) of an archive under dest_dir.
+
+    Selected members are read through random access, so only their chunks are
+    decrypted; a full extraction decrypts the archive once, on `workers`
+    threads. Returns the list of extracted member names.
+    """
+    with open_archive(archive_path, private_key_path, keyring) as archive:
+        selected = archive.members if names is None else [archive.member(name) for name in names]
+        reporter = Reporter(sum(member["size"] for member in selected), progress, cancel_event)
+        with metrics.span("extract_archive", "total", reporter.total):
+            if names is None:
+                archive.extract_all(dest_dir, workers, reporter)
+            else:
+                for member in selected:
+                    archive.extract(member["name"], dest_dir, reporter)
+
+    if verbose:
+        print(f"Extraction successful! {len(selected)} files saved under {dest_dir}")
+    return [member["name"] for member in selected]
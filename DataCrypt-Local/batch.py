@@ -0,0 +1,188 @@
+"""Headless batch encryption of many files for one or more recipients.
+
+Usage:
+    python batch.py -r RECIPIENT [-r RECIPIENT ...] [-j JOBS] [--pool process|thread] [--session] [--max-memory SIZE]
+                    [--fsync batch|file|never] PATH [PATH ...]
+
+PATH may be a file, a glob pattern (quote it; ** is supported) or a directory,
+which is walked recursively. RECIPIENT is either the base64 public key shown by
+the GUI, the path of a PEM public key file or @name for a key ring contact; repeat -r to encrypt every file
+once for several recipients.
+
+With --session, each worker draws one ephemeral key and does one ECDH exchange
+per recipient for all the files it encrypts, instead of one per file (see
+session.py); for many small files this is most of the work.
+
+Outputs are written atomically (see output.py). By default (--fsync batch)
+they are flushed to disk and renamed into place in groups, with one flush per
+group instead of one per file; --fsync file flushes every file on its own.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from encryptor import encrypt_file, load_public_key, open_session
+from key_ring import read_recipient
+import container
+import engines
+import output
+import pipeline
+import session
+
+# Parsed recipient keys (or their encryption session) of the current worker process (or of the thread pool)
+_recipient_keys = None
+
+
+def expand_paths(paths):
+    """Yield every file named by paths (files, globs or directory trees), skipping outputs and temp files."""
+    seen = set()
+    for path in paths:
+        if os.path.isdir(path):
+            candidates = (
+                os.path.join(root, name)
+                for root, _, names in os.walk(path)
+                for name in sorted(names)
+            )
+        elif glob.has_magic(path):
+            candidates = sorted(glob.glob(path, recursive=True))
+        else:
+            candidates = [path]
+
+        for candidate in candidates:
+            if candidate.endswith((".enc", ".key")) or not os.path.isfile(candidate):
+                continue
+            # Hidden ".<name>.<random>.tmp" files are outputs still being written (see output.py)
+            if os.path.basename(candidate).startswith(".") and candidate.endswith(".tmp"):
+                continue
+            if candidate not in seen:
+                seen.add(candidate)
+                yield candidate
+
+
+def _init_worker(public_key_strs, use_session=False, max_memory=None):
+    global _recipient_keys
+    if max_memory:
+        pipeline.set_max_memory(max_memory)
+    if use_session:
+        _recipient_keys = open_session(public_key_strs)
+    else:
+        _recipient_keys = [load_public_key(key) for key in public_key_strs]
+
+
+def _end_job():
+    """Drop this process's recipient keys, with any session's ephemeral private key, and cached secrets."""
+    global _recipient_keys
+    _recipient_keys = None
+    session.clear_shared_secrets()
+
+
+def _encrypt_one(file_path, chunk_size, compress=None, cipher=None, fsync="batch"):
+    """Encrypt one file with the worker's recipient keys; never raises.
+
+    With fsync "batch" the output is left in its temp file, and the pending
+    rename is returned for run_batch to flush with others.
+    """
+    start = time.perf_counter()
+    pending = output.FsyncBatch() if fsync == "batch" else None
+    try:
+        size = os.path.getsize(file_path)
+        encrypt_file(file_path, _recipient_keys, chunk_size=chunk_size, workers=1, verbose=False, compress=compress,
+                     cipher=cipher, fsync=pending or fsync)
+        return file_path, size, time.perf_counter() - start, None, pending.take() if pending else []
+    except Exception as e:
+        return file_path, 0, time.perf_counter() - start, str(e), []
+
+
+def run_batch(paths, public_key_strs, jobs=None, pool="process", chunk_size=container.DEFAULT_CHUNK_SIZE, out=sys.stdout,
+              compress=None, use_session=False, cipher=None, max_memory=None, fsync="batch"):
+    """Encrypt every file under paths for the given recipients and report per-file results.
+
+    The recipient keys are parsed once per worker process (once in total for a
+    thread pool); with use_session, so is the ephemeral key and its ECDH
+    exchanges. cipher is a chunk engine name (see engines.py). max_memory caps
+    the chunk buffers of the whole batch (see pipeline.py); a process pool
+    splits it evenly between its workers. fsync is "batch" (default: outputs
+    are flushed and renamed into place output.BATCH_FILES at a time), "file"
+    or "never" (see output.py). Returns the number of files that failed.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    if fsync not in output.FSYNC_POLICIES:
+        raise ValueError(f"Unknown fsync policy: {fsync} (choose from {', '.join(output.FSYNC_POLICIES)})")
+    if cipher == engines.AUTO:
+        # Benchmark (or read the cached choice) once, not in every worker
+        cipher = engines.select_engine()
+    files = list(expand_paths(paths))
+    if pool == "process":
+        executor = ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                       initargs=(public_key_strs, use_session, max_memory and max_memory // jobs))
+    elif pool == "thread":
+        _init_worker(public_key_strs, use_session, max_memory)
+        executor = ThreadPoolExecutor(max_workers=jobs)
+    else:
+        raise ValueError(f"Unknown pool type: {pool}")
+
+    total_bytes = 0
+    failures = 0
+    start = time.perf_counter()
+    try:
+        with executor, output.FsyncBatch() as group:
+            results = executor.map(_encrypt_one, files, [chunk_size] * len(files), [compress] * len(files),
+                                   [cipher] * len(files), [fsync] * len(files),
+                                   chunksize=16 if pool == "process" else 1)
+            for file_path, size, elapsed, error, pending in results:
+                group.adopt(pending)
+                if error:
+                    failures += 1
+                    print(f"FAILED {file_path}: {error}", file=out)
+                else:
+                    total_bytes += size
+                    print(f"OK     {file_path} ({size} bytes, {elapsed * 1000:.1f} ms)", file=out)
+    finally:
+        _end_job()
+    elapsed = time.perf_counter() - start
+
+    rate = total_bytes / (1024 * 1024) / elapsed if elapsed > 0 else 0.0
+    print(
+        f"{len(files) - failures}/{len(files)} files encrypted, "
+        f"{total_bytes / (1024 * 1024):.1f} MB in {elapsed:.2f} s ({rate:.1f} MB/s)",
+        file=out,
+    )
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Encrypt many files for one or more recipients.")
+    parser.add_argument("paths", nargs="+", help="files, glob patterns or directories")
+    parser.add_argument("-r", "--recipient", required=True, action="append", help="base64 public key, PEM public key file or @contact (repeatable)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of workers (default: CPU count)")
+    parser.add_argument("--pool", choices=("process", "thread"), default="process", help="worker pool type")
+    parser.add_argument("--chunk-size", type=int, default=container.DEFAULT_CHUNK_SIZE, help="container chunk size in bytes")
+    parser.add_argument("-z", "--compress", choices=("zlib", "lzma"), help="compress each chunk before encrypting it")
+    parser.add_argument("--cipher", choices=list(engines.ENGINES) + [engines.AUTO],
+                        help="chunk cipher (default: aes-256-gcm; auto: fastest on this machine)")
+    parser.add_argument("--session", action="store_true",
+                        help="one ephemeral key and ECDH exchange per worker instead of per file")
+    parser.add_argument("--max-memory", type=pipeline.parse_size, metavar="SIZE",
+                        help="cap chunk buffers of the whole batch, e.g. 256M (default: no cap)")
+    parser.add_argument("--fsync", choices=output.FSYNC_POLICIES, default="batch",
+                        help="flush outputs to disk in groups (batch, the default), one by one (file) or not at all")
+    args = parser.parse_args(argv)
+
+    try:
+        public_key_strs = [read_recipient(recipient) for recipient in args.recipient]
+        for public_key_str in public_key_strs:
+            load_public_key(public_key_str)
+    except Exception as e:
+        parser.error(f"Invalid recipient public key: {e}")
+
+    failures = run_batch(args.paths, public_key_strs, jobs=args.jobs, pool=args.pool, chunk_size=args.chunk_size,
+                         compress=args.compress, use_session=args.session, cipher=args.cipher,
+                         max_memory=args.max_memory, fsync=args.fsync)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
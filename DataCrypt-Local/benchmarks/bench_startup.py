@@ -0,0 +1,70 @@
+"""Cold-start benchmark for the headless CLI.
+
+Runs `datacrypt.py encrypt` on a small file in fresh interpreters and reports
+the median wall time next to that of a bare `python -c pass`. Exits non-zero
+when the median exceeds --max-ms, so CI can use it as a guard:
+
+    python benchmarks/bench_startup.py --max-ms 100
+
+The untimed warm-up run also writes the modules' bytecode caches (even under
+PYTHONDONTWRITEBYTECODE), as an installed copy has them; otherwise every run
+would time compiling the sources rather than starting up.
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CLI = os.path.join(os.path.dirname(HERE), "datacrypt.py")
+
+
+def _median_ms(cmd, runs, cwd, env=None):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=cwd, env=env, check=True, stdout=subprocess.DEVNULL)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure CLI cold-start time for a small encrypt.")
+    parser.add_argument("--runs", type=int, default=15)
+    parser.add_argument("--max-ms", type=float, default=100.0, help="fail if the median encrypt exceeds this")
+    parser.add_argument("--size", type=int, default=4096, help="size of the file to encrypt in bytes")
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    workdir = tempfile.mkdtemp(prefix="datacrypt-bench-")
+    try:
+        key_dir = os.path.join(workdir, "keys")
+        subprocess.run([sys.executable, CLI, "keygen", "--key-dir", key_dir], check=True, stdout=subprocess.DEVNULL)
+        with open(os.path.join(workdir, "small.bin"), "wb") as f:
+            f.write(os.urandom(args.size))
+
+        # Warm the OS file cache and the bytecode caches before timing anything
+        encrypt_cmd = [sys.executable, CLI, "encrypt", "small.bin", "-r", os.path.join(key_dir, "public_key.pem")]
+        subprocess.run(encrypt_cmd, cwd=workdir, env=env, check=True, stdout=subprocess.DEVNULL)
+
+        baseline = _median_ms([sys.executable, "-c", "pass"], args.runs, workdir, env)
+        encrypt = _median_ms(encrypt_cmd, args.runs, workdir, env)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"python -c pass:        {baseline:7.1f} ms (median of {args.runs})")
+    print(f"datacrypt encrypt:     {encrypt:7.1f} ms (median of {args.runs})")
+    print(f"overhead over python:  {encrypt - baseline:7.1f} ms")
+    if encrypt > args.max_ms:
+        print(f"FAIL: cold-start encrypt exceeds {args.max_ms:.0f} ms", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
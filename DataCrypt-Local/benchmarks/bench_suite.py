@@ -0,0 +1,327 @@
+"""Throughput, latency and memory benchmarks for DataCrypt.
+
+    python benchmarks/bench_suite.py run --out results.json
+    python benchmarks/bench_suite.py run --sizes 1K,1M,256M,4G --repeat 5 --out results.json
+    python benchmarks/bench_suite.py compare baseline.json results.json --threshold 10
+
+`run` measures, each on its own:
+
+    keygen      generating a SECP384R1 key pair
+    ecdh_hkdf   one ECDH exchange plus the HKDF that wraps a content key
+    aes_gcm     sealing / opening a single container chunk
+    encrypt     encrypt_file on synthetic files of every --sizes entry
+    decrypt     decrypt_file on the files written by encrypt
+    batch       batch.run_batch over many small files
+
+Every result has a per-call latency (median, p95, min), a throughput in MB/s
+where bytes are involved, and for file-level cases the peak RSS growth of the
+process that ran them. File cases run in a fresh interpreter each, so their
+memory numbers do not pollute each other. Synthetic files are derived from a
+fixed seed, so two runs measure the same bytes.
+
+`compare` prints every case whose throughput, latency or peak RSS got worse
+than the baseline by more than --threshold percent and exits 1 if there is any.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+# Sizes are written the way --max-memory takes them
+from pipeline import SIZE_UNITS, parse_size
+
+MB = 1024 * 1024
+DEFAULT_SIZES = "1K,64K,1M,16M,256M"
+# Peak RSS moves by a few hundred KiB between identical runs; smaller changes are not flagged
+RSS_NOISE_KB = 1024
+
+
+def format_size(size):
+    for unit in ("G", "M", "K"):
+        if size >= SIZE_UNITS[unit] and size % SIZE_UNITS[unit] == 0:
+            return f"{size // SIZE_UNITS[unit]}{unit}"
+    return str(size)
+
+
+def peak_rss_kb():
+    """Peak resident set size of this process in KiB, or None where unsupported."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux KiB
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def write_synthetic(path, size, seed=0):
+    """Write size reproducible, incompressible bytes to path, one MiB at a time."""
+    with open(path, "wb") as f:
+        block = 0
+        while size > 0:
+            n = min(size, MB)
+            f.write(random.Random(seed * 1000003 + block).getrandbits(8 * n).to_bytes(n, "little"))
+            size -= n
+            block += 1
+
+
+def summarize(name, samples, nbytes=None, **extra):
+    """Build a result record from per-call wall times in seconds."""
+    samples = sorted(samples)
+    median = statistics.median(samples)
+    result = {
+        "name": name,
+        "calls": len(samples),
+        "latency_ms": {
+            "median": median * 1000,
+            "p95": samples[min(len(samples) - 1, int(0.95 * len(samples)))] * 1000,
+            "min": samples[0] * 1000,
+        },
+    }
+    if nbytes is not None:
+        result["bytes"] = nbytes
+        result["mb_per_s"] = nbytes / MB / median if median > 0 else None
+    result.update(extra)
+    return result
+
+
+def _time_calls(func, calls):
+    samples = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_primitives(calls, chunk_size):
+    """Time keygen, ECDH+HKDF and one AES-GCM chunk in isolation."""
+    from cryptography.hazmat.primitives.asymmetric import ec
+    import container
+
+    recipient = ec.generate_private_key(container.CURVE).public_key()
+    ephemeral = ec.generate_private_key(container.CURVE)
+    salt = container.new_salt()
+    content_key = container.new_content_key()
+
+    def ecdh_hkdf():
+        container.wrap_content_key(content_key, ephemeral.exchange(ec.ECDH(), recipient), salt, recipient)
+
+    header = container.ContainerHeader(chunk_size, chunk_size, salt, container.compress_public_key(recipient))
+    chunk_cipher = container.ChunkCipher(content_key, header)
+    chunk = os.urandom(chunk_size)
+    sealed = chunk_cipher.seal(0, chunk)
+
+    return [
+        summarize("keygen", _time_calls(lambda: ec.generate_private_key(container.CURVE), calls)),
+        summarize("ecdh_hkdf", _time_calls(ecdh_hkdf, calls)),
+        summarize(f"aes_gcm/seal/{format_size(chunk_size)}", _time_calls(lambda: chunk_cipher.seal(0, chunk), calls), chunk_size),
+        summarize(f"aes_gcm/open/{format_size(chunk_size)}", _time_calls(lambda: chunk_cipher.open(0, sealed), calls), chunk_size),
+    ]
+
+
+def run_case(mode, path, key_dir, repeat, workers, io_backend):
+    """Run one encrypt or decrypt case in this process and return its result record."""
+    import decryptor
+    import encryptor
+    import key_ring
+
+    size = os.path.getsize(path)
+    rss_before = peak_rss_kb()
+    if mode == "encrypt":
+        public_key = encryptor.load_public_key(key_ring.read_recipient(os.path.join(key_dir, "public_key.pem")))
+        call = lambda: encryptor.encrypt_file(path, public_key, workers=workers, verbose=False, io_backend=io_backend)
+    else:
+        private_key_path = os.path.join(key_dir, "private_key.pem")
+        call = lambda: decryptor.decrypt_file(path + ".enc", None, private_key_path, workers=workers, io_backend=io_backend,
+                                              verbose=False)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        samples = _time_calls(call, repeat)
+    rss_after = peak_rss_kb()
+    rss_growth = rss_after - rss_before if rss_after is not None else None
+    return summarize(f"{mode}/{format_size(size)}", samples, size, peak_rss_kb=rss_after, peak_rss_growth_kb=rss_growth)
+
+
+def bench_files(sizes, workdir, key_dir, repeat, workers, io_backend):
+    """Encrypt then decrypt a synthetic file of every size, each case in a fresh interpreter."""
+    results = []
+    for size in sizes:
+        path = os.path.join(workdir, f"data-{format_size(size)}.bin")
+        write_synthetic(path, size)
+        for mode in ("encrypt", "decrypt"):
+            cmd = [sys.executable, os.path.abspath(__file__), "case", mode, path, key_dir, "--repeat", str(repeat)]
+            if workers is not None:
+                cmd += ["--workers", str(workers)]
+            if io_backend is not None:
+                cmd += ["--io", io_backend]
+            out = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, text=True).stdout
+            results.append(json.loads(out))
+        os.remove(path)
+        os.remove(path + ".enc")
+        name, ext = os.path.splitext(path)
+        os.remove(f"{name}-decrypted{ext}")
+    return results
+
+
+def bench_batch(workdir, key_dir, files, size, jobs, pool):
+    """Encrypt many small files with batch.run_batch."""
+    import batch
+    import key_ring
+
+    batch_dir = os.path.join(workdir, "batch")
+    os.makedirs(batch_dir)
+    for i in range(files):
+        write_synthetic(os.path.join(batch_dir, f"f{i:05d}.bin"), size, seed=i + 1)
+    public_key_str = key_ring.read_recipient(os.path.join(key_dir, "public_key.pem"))
+
+    start = time.perf_counter()
+    failures = batch.run_batch([batch_dir], [public_key_str], jobs=jobs, pool=pool, out=io.StringIO())
+    elapsed = time.perf_counter() - start
+    shutil.rmtree(batch_dir)
+    if failures:
+        raise RuntimeError(f"{failures} batch files failed")
+    result = summarize(f"batch/{pool}/{files}x{format_size(size)}", [elapsed], files * size)
+    result["files_per_s"] = files / elapsed if elapsed > 0 else None
+    return result
+
+
+def metadata():
+    import cryptography
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "cryptography": cryptography.__version__,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def run(args):
+    import datacrypt
+
+    sizes = [parse_size(size) for size in args.sizes.split(",")]
+    workdir = tempfile.mkdtemp(prefix="datacrypt-bench-", dir=args.tmp_dir)
+    results = []
+    try:
+        key_dir = os.path.join(workdir, "keys")
+        with contextlib.redirect_stdout(io.StringIO()):
+            datacrypt.keygen(key_dir)
+        results += bench_primitives(args.calls, parse_size(args.chunk_size))
+        results += bench_files(sizes, workdir, key_dir, args.repeat, args.workers, args.io)
+        if args.batch_files:
+            results.append(bench_batch(workdir, key_dir, args.batch_files, parse_size(args.batch_size), args.jobs, args.pool))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {"meta": metadata(), "results": results}
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    for result in results:
+        rate = f"{result['mb_per_s']:10.1f} MB/s" if result.get("mb_per_s") else " " * 15
+        print(f"{result['name']:<28} {result['latency_ms']['median']:10.3f} ms {rate}", file=sys.stderr)
+    return 0
+
+
+def compare(args):
+    """Flag cases that regressed by more than args.threshold percent against the baseline."""
+    with open(args.baseline) as f:
+        baseline = {r["name"]: r for r in json.load(f)["results"]}
+    with open(args.current) as f:
+        current = {r["name"]: r for r in json.load(f)["results"]}
+
+    limit = args.threshold / 100
+    regressions = 0
+    for name, new in current.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        # (metric, old value, new value, True if higher is better)
+        checks = [("latency", old["latency_ms"]["median"], new["latency_ms"]["median"], False)]
+        if old.get("mb_per_s") and new.get("mb_per_s"):
+            checks.append(("throughput", old["mb_per_s"], new["mb_per_s"], True))
+        if old.get("peak_rss_growth_kb") and new.get("peak_rss_growth_kb") is not None:
+            checks.append(("peak RSS", old["peak_rss_growth_kb"], new["peak_rss_growth_kb"], False))
+        for metric, before, after, higher_is_better in checks:
+            change = (after - before) / before if before else 0.0
+            worse = -change if higher_is_better else change
+            if metric == "peak RSS" and after - before < RSS_NOISE_KB:
+                worse = min(worse, 0.0)
+            status = "REGRESSION" if worse > limit else "ok"
+            if worse > limit:
+                regressions += 1
+            if status != "ok" or args.verbose:
+                print(f"{status:<10} {name:<28} {metric:<10} {before:12.2f} -> {after:12.2f} ({change:+.1%})")
+
+    missing = sorted(set(baseline) - set(current))
+    for name in missing:
+        print(f"missing    {name}")
+    print(f"{regressions} regression(s) over {args.threshold:.0f}% in {len(current)} case(s)")
+    return 1 if regressions else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="DataCrypt throughput, latency and memory benchmarks.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("run", help="run the benchmarks and write JSON results")
+    p.add_argument("--sizes", default=DEFAULT_SIZES, help=f"comma-separated file sizes (default: {DEFAULT_SIZES})")
+    p.add_argument("--repeat", type=int, default=3, help="calls per file size")
+    p.add_argument("--calls", type=int, default=50, help="calls per primitive")
+    p.add_argument("--chunk-size", default="1M", help="chunk size for the aes_gcm case")
+    p.add_argument("-w", "--workers", type=int, help="threads per file (default: CPU count)")
+    p.add_argument("--io", choices=("readinto", "mmap", "read"), help="container I/O backend")
+    p.add_argument("--batch-files", type=int, default=200, help="files in the batch case (0 to skip)")
+    p.add_argument("--batch-size", default="4K", help="size of each batch file")
+    p.add_argument("-j", "--jobs", type=int, help="batch workers (default: CPU count)")
+    p.add_argument("--pool", choices=("process", "thread"), default="process", help="batch worker pool type")
+    p.add_argument("--tmp-dir", help="where to write the synthetic files (default: system temp)")
+    p.add_argument("--out", help="write JSON here instead of stdout")
+
+    p = commands.add_parser("compare", help="compare results against a baseline")
+    p.add_argument("baseline")
+    p.add_argument("current")
+    p.add_argument("--threshold", type=float, default=10.0, help="allowed slowdown in percent")
+    p.add_argument("-v", "--verbose", action="store_true", help="also list cases that did not regress")
+
+    # Internal: one file-level case in a fresh interpreter, printed as JSON
+    p = commands.add_parser("case")
+    p.add_argument("mode", choices=("encrypt", "decrypt"))
+    p.add_argument("path")
+    p.add_argument("key_dir")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--workers", type=int)
+    p.add_argument("--io")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "run":
+        return run(args)
+    if args.command == "compare":
+        return compare(args)
+    print(json.dumps(run_case(args.mode, args.path, args.key_dir, args.repeat, args.workers, args.io)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
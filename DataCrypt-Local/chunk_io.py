@@ -0,0 +1,142 @@
+"""Chunk input with a selectable I/O backend.
+
+Container code reads a chunk, hands it to AES-GCM and writes the result. How the
+chunk bytes are obtained is chosen by the backend:
+
+    readinto  readinto() a small ring of preallocated buffers (default)
+    mmap      memory-map the input and hand out views of the mapping
+    read      one f.read() per chunk, i.e. a new bytes object every time
+
+The first two allocate nothing per chunk. Together with ChunkCipher.seal_into
+and open_into, which encrypt into reusable output buffers, a chunk's bytes are
+copied only by the kernel on the way in and out. "read" is kept so the backends
+can be compared (see benchmarks/).
+
+Views handed out by a ring are reused after `slots` further chunks, so callers
+must be done with a chunk by then; pipeline.buffer_slots() counts how many
+chunks a pipeline can have queued and in flight, which is what rings are
+sized from.
+"""
+import mmap
+import os
+
+BACKENDS = ("readinto", "mmap", "read")
+DEFAULT_BACKEND = "readinto"
+
+
+def check_backend(backend):
+    """Return backend, or DEFAULT_BACKEND for None; raise ValueError for unknown names."""
+    if backend is None:
+        return DEFAULT_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown I/O backend: {backend} (choose from {', '.join(BACKENDS)})")
+    return backend
+
+
+class BufferRing:
+    """Fixed set of reusable buffers, handed out round-robin by chunk index."""
+
+    def __init__(self, slots, size):
+        self._views = [memoryview(bytearray(size)) for _ in range(slots)]
+
+    def get(self, index, length):
+        return self._views[index % len(self._views)][:length]
+
+
+def read_full(f, buffer):
+    """readinto() buffer until it is full or f ends; returns the number of bytes read.
+
+    Files fill the buffer in one call, but pipes and sockets return whatever
+    has arrived so far.
+    """
+    view = memoryview(buffer)
+    filled = 0
+    while filled < len(view):
+        n = f.readinto(view[filled:])
+        if not n:
+            break
+        filled += n
+    return filled
+
+
+def _map_file(f):
+    """Memory-map f read-only, or return None if it cannot be mapped (pipes, empty files)."""
+    try:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def iter_chunks(f, lengths, backend=None, slots=1):
+    """Yield a buffer holding the next len bytes of f for every len in lengths.
+
+    A buffer shorter than requested means f ended early; the caller decides what
+    that means. Reading starts at f's current position, and f is left just after
+    the last byte yielded, whatever the backend. The mmap backend maps the whole
+    file, so the file must not shrink while it is read; it falls back to
+    readinto for files that cannot be mapped.
+    """
+    backend = check_backend(backend)
+    lengths = list(lengths)
+
+    if backend == "read":
+        for length in lengths:
+            yield f.read(length)
+        return
+
+    mapping = _map_file(f) if backend == "mmap" else None
+    if mapping is None:
+        ring = BufferRing(slots, max(lengths, default=0))
+        for index, length in enumerate(lengths):
+            view = ring.get(index, length)
+            n = read_full(f, view)
+            yield view[:n]
+        return
+
+    pos = f.tell()
+    view = memoryview(mapping)
+    chunk = None
+    try:
+        for length in lengths:
+            chunk = view[pos:pos + length]
+            pos += len(chunk)
+            yield chunk
+    finally:
+        # Keep the file position in step, so callers can check for trailing data
+        if not f.closed:
+            f.seek(pos, os.SEEK_SET)
+        del view, chunk
+        try:
+            mapping.close()
+        except BufferError:
+            # A caller still holds a chunk view; the mapping closes when that view is freed
+            pass
+
+
+def copy_range(src_fd, dst_fd, offset, length):
+    """Append length bytes of src_fd, starting at offset, to dst_fd at its current position.
+
+    os.copy_file_range lets the kernel copy (or, on reflink file systems such as
+    btrfs and XFS, share) the data without it passing through Python; elsewhere
+    the bytes are copied with read/write.
+    """
+    copy_file_range = getattr(os, "copy_file_range", None)
+    while length > 0 and copy_file_range is not None:
+        try:
+            n = copy_file_range(src_fd, dst_fd, length, offset)
+        except OSError:
+            break
+        if n == 0:
+            raise ValueError("Source file is shorter than expected.")
+        offset += n
+        length -= n
+    while length > 0:
+        os.lseek(src_fd, offset, os.SEEK_SET)
+        data = os.read(src_fd, min(length, 1024 * 1024))
+        if not data:
+            raise ValueError("Source file is shorter than expected.")
+        view = memoryview(data)
+        while view:
+            view = view[os.write(dst_fd, view):]
+        offset += len(data)
+        length -= len(data)
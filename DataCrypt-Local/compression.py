@@ -0,0 +1,74 @@
+"""Optional per-chunk compression for containers.
+
+Each chunk is compressed on its own before it is encrypted, so chunks stay
+independently decryptable (parallel decryption and random access keep working).
+A chunk that does not get smaller is stored as is; the chunk table tells the
+two apart, since only a compressed chunk is shorter than its plaintext.
+
+The codec of a container is recorded in its header. zlib and lzma come with
+Python, so every build of DataCrypt can read every container.
+"""
+import zlib
+
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_LZMA = 2
+
+CODECS = {"none": CODEC_NONE, "zlib": CODEC_ZLIB, "lzma": CODEC_LZMA}
+# zlib's own default, and a fast lzma preset (higher presets are many times slower per chunk)
+DEFAULT_LEVELS = {CODEC_ZLIB: 6, CODEC_LZMA: 1}
+
+
+def _lzma():
+    # Imported on first use: most containers are not lzma-compressed
+    import lzma
+
+    return lzma
+
+
+def codec_id(name):
+    """Return the header id of a codec name, or raise ValueError for unknown names."""
+    if name is None:
+        return CODEC_NONE
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f"Unknown compression codec: {name} (choose from {', '.join(CODECS)})")
+
+
+def compress_chunk(codec, data, level=None):
+    """Return the compressed chunk, or data itself if compression would not shrink it."""
+    if codec == CODEC_NONE or not data:
+        return data
+    if level is None:
+        level = DEFAULT_LEVELS[codec]
+    if codec == CODEC_ZLIB:
+        packed = zlib.compress(data, level)
+    elif codec == CODEC_LZMA:
+        lzma = _lzma()
+        packed = lzma.compress(data, format=lzma.FORMAT_XZ, check=lzma.CHECK_NONE, preset=level)
+    else:
+        raise ValueError(f"Unsupported compression codec id: {codec}")
+    return packed if len(packed) < len(data) else data
+
+
+def decompress_chunk(codec, data, plain_len):
+    """Inflate a compressed chunk of plain_len bytes; at most plain_len bytes are ever produced."""
+    lzma = _lzma() if codec == CODEC_LZMA else None
+    errors = (zlib.error, lzma.LZMAError) if lzma is not None else zlib.error
+    try:
+        if codec == CODEC_ZLIB:
+            decompressor = zlib.decompressobj()
+            plaintext = decompressor.decompress(data, plain_len)
+            complete = decompressor.eof and not decompressor.unconsumed_tail and not decompressor.unused_data
+        elif codec == CODEC_LZMA:
+            decompressor = lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+            plaintext = decompressor.decompress(data, plain_len)
+            complete = decompressor.eof and not decompressor.unused_data
+        else:
+            raise ValueError(f"Unsupported compression codec id: {codec}")
+    except errors:
+        complete = False
+    if not complete or len(plaintext) != plain_len:
+        raise ValueError("Compressed chunk is corrupt. Decryption failed.")
+    return plaintext
@@ -0,0 +1,542 @@
+"""Single-file DataCrypt container format.
+
+Layout of a container file:
+
+    header       fixed-size, see _HEADER and _RECIPIENT_COUNT below
+    key table    the content key wrapped once per recipient, tagged with the
+                 recipient's key id (version 3 and later)
+    chunk table  one (plaintext length, stored length) entry per chunk
+    table seal   only with FLAG_REUSABLE_CHUNKS, see below
+    chunks       each chunk encrypted and authenticated on its own
+
+The payload is encrypted once under a random content key. For every recipient,
+the content key is wrapped with AES-256-GCM under a key derived (HKDF) from the
+ECDH secret between the file's ephemeral key and that recipient's public key,
+so adding a recipient costs WRAPPED_KEY_SIZE bytes, not another pass over the
+data.
+
+Every chunk is sealed with AES-256-GCM under the content key, so chunks can be
+decrypted (and checked) independently; the cipher id in the header may select
+ChaCha20-Poly1305 instead (see engines.py). From version 4 on, chunks may be
+compressed before sealing (see compression.py); the codec is in the header.
+The packed header plus the chunk index and a "last chunk" flag are bound into
+each chunk as associated data, which detects header tampering, reordering and
+truncation.
+
+With FLAG_REUSABLE_CHUNKS (version 5, written by incremental.py) a chunk does
+not depend on its position, so an unchanged chunk can be carried over from the
+previous encryption of a file as is: every chunk table entry also holds the
+chunk's random nonce, chunks are sealed with a fixed associated data, and the
+header, key table and chunk table are instead authenticated together by the
+table seal (a random nonce plus a GCM tag over them under the content key).
+
+FLAG_ARCHIVE marks a container whose plaintext is a multi-file archive with
+its own member index (see archive.py) rather than the content of one file.
+
+FLAG_STREAM containers are written in one pass to pipes and sockets (see
+streaming.py), where neither the size nor the chunk table is known up front.
+Their header has a plaintext size and chunk count of zero and no chunk table;
+instead every chunk is preceded by a frame (see _FRAME) holding its lengths
+and whether it is the last one. The frames need no authentication of their
+own: the last-chunk flag is bound into each chunk as usual, and wrong lengths
+make the chunk fail to open.
+
+With FLAG_CHUNK_HASHES the header ends with the SHA-256 of every stored chunk
+and the Merkle root of those hashes (see chunk_digest and merkle_root). They
+let anyone scrub a container for corruption, and locate it, without a private
+key (see integrity.py). They are not authenticated: they catch bit rot, while
+deliberate tampering is caught by the GCM tags, checked with the key.
+"""
+import hashlib
+import os
+import struct
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.exceptions import InvalidTag
+
+import compression
+import engines
+
+MAGIC = b"DCRY"
+FORMAT_VERSION = 5
+# Version 1 had no key table; its file key was derived directly from the ECDH secret.
+# Version 2 key table entries had no key id, so every entry has to be tried.
+# Version 3 had no compression; the codec byte was reserved (zero).
+# Version 4 had no flags; the flags byte was always zero.
+SUPPORTED_VERSIONS = (1, 2, 3, 4, 5)
+
+# Chunk cipher engine ids; see engines.ENGINES
+CIPHER_AES_256_GCM = engines.CIPHER_AES_256_GCM
+CIPHER_CHACHA20_POLY1305 = engines.CIPHER_CHACHA20_POLY1305
+
+FLAG_REUSABLE_CHUNKS = 0x01
+# The plaintext is a multi-file archive (see archive.py), not a single file
+FLAG_ARCHIVE = 0x02
+# Written to a non-seekable output: no chunk table, every chunk is preceded by a frame
+FLAG_STREAM = 0x04
+# The header ends with a SHA-256 of every stored chunk and their Merkle root
+FLAG_CHUNK_HASHES = 0x08
+KNOWN_FLAGS = FLAG_REUSABLE_CHUNKS | FLAG_ARCHIVE | FLAG_STREAM | FLAG_CHUNK_HASHES
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+TAG_SIZE = 16
+NONCE_SIZE = 12
+SALT_SIZE = 16
+CURVE = ec.SECP384R1()
+POINT_SIZE = 49  # compressed SECP384R1 point
+KEY_SIZE = 32
+WRAPPED_KEY_SIZE = KEY_SIZE + TAG_SIZE
+KEY_ID_SIZE = 8
+HASH_SIZE = 32
+
+# magic, version, flags, cipher id, compression codec, chunk size, plaintext size, chunk count, salt, ephemeral public key
+_HEADER = struct.Struct(">4sBBBBIQI16s49s")
+# Appended to the fixed header from version 2 on
+_RECIPIENT_COUNT = struct.Struct(">H")
+_CHUNK_ENTRY = struct.Struct(">II")
+# Chunk table entry with FLAG_REUSABLE_CHUNKS: lengths plus the chunk's nonce
+_REUSABLE_CHUNK_ENTRY = struct.Struct(">II12s")
+_CHUNK_AAD = struct.Struct(">QB")
+_REUSABLE_CHUNK_AAD = b"datacrypt reusable chunk"
+# Frame before every chunk of a FLAG_STREAM container: last-chunk flag, plaintext length, stored length
+_FRAME = struct.Struct(">BII")
+FRAME_SIZE = _FRAME.size
+TABLE_SEAL_SIZE = NONCE_SIZE + TAG_SIZE
+
+
+class ContainerHeader:
+    """Parsed container header and chunk table."""
+
+    def __init__(self, chunk_size, plaintext_size, salt, ephemeral_public_bytes, wrapped_keys=(),
+                 chunks=None, cipher_id=CIPHER_AES_256_GCM, flags=0, version=FORMAT_VERSION,
+                 codec=compression.CODEC_NONE, nonces=None, table_seal=None, chunk_hashes=None, merkle_root=None):
+        self.version = version
+        self.flags = flags
+        self.cipher_id = cipher_id
+        self.codec = codec
+        self.chunk_size = chunk_size
+        self.plaintext_size = plaintext_size
+        self.salt = salt
+        self.ephemeral_public_bytes = ephemeral_public_bytes
+        # (key id, wrapped content key) for each recipient, in recipient order;
+        # the key id is None in version 2 containers
+        self.wrapped_keys = list(wrapped_keys)
+        # List of (plaintext length, stored length) tuples; a compressed chunk
+        # is the only kind whose stored length is below plaintext + TAG_SIZE
+        self.chunks = chunks if chunks is not None else plan_chunks(plaintext_size, chunk_size)
+        # With FLAG_REUSABLE_CHUNKS: the nonce of every chunk, and the table seal
+        self.nonces = list(nonces) if nonces is not None else []
+        self.table_seal = table_seal
+        # With FLAG_CHUNK_HASHES: chunk_digest() of every stored chunk, and their merkle_root()
+        self.chunk_hashes = list(chunk_hashes) if chunk_hashes is not None else []
+        self.merkle_root = merkle_root
+        self._offsets = None
+
+    @property
+    def reusable_chunks(self):
+        return bool(self.flags & FLAG_REUSABLE_CHUNKS)
+
+    @property
+    def is_archive(self):
+        return bool(self.flags & FLAG_ARCHIVE)
+
+    @property
+    def streamed(self):
+        return bool(self.flags & FLAG_STREAM)
+
+    @property
+    def has_chunk_hashes(self):
+        return bool(self.flags & FLAG_CHUNK_HASHES)
+
+    @property
+    def chunk_count(self):
+        return len(self.chunks)
+
+    def pack_fixed(self):
+        """Return the fixed part of the header; it is authenticated with every chunk."""
+        fixed = _HEADER.pack(
+            MAGIC, self.version, self.flags, self.cipher_id, self.codec,
+            self.chunk_size, self.plaintext_size, self.chunk_count,
+            self.salt, self.ephemeral_public_bytes,
+        )
+        if self.version >= 2:
+            fixed += _RECIPIENT_COUNT.pack(len(self.wrapped_keys))
+        return fixed
+
+    def pack_tables(self):
+        """Return the fixed header, key table and chunk table; the table seal covers exactly these."""
+        if self.reusable_chunks:
+            table = b"".join(
+                _REUSABLE_CHUNK_ENTRY.pack(plain_len, stored_len, nonce)
+                for (plain_len, stored_len), nonce in zip(self.chunks, self.nonces)
+            )
+        else:
+            table = b"".join(_CHUNK_ENTRY.pack(plain_len, stored_len) for plain_len, stored_len in self.chunks)
+        key_table = b"".join(
+            (key_id if self.version >= 3 else b"") + wrapped for key_id, wrapped in self.wrapped_keys
+        )
+        return self.pack_fixed() + key_table + table
+
+    def pack(self):
+        """Return the full header, including the chunk table (and table seal and chunk hashes).
+
+        Seal, hashes and root that are not known yet are written as zeros.
+        """
+        packed = self.pack_tables()
+        if self.reusable_chunks:
+            packed += self.table_seal or bytes(TABLE_SEAL_SIZE)
+        if self.has_chunk_hashes:
+            hashes = self.chunk_hashes or [bytes(HASH_SIZE)] * self.chunk_count
+            packed += b"".join(hashes) + (self.merkle_root or bytes(HASH_SIZE))
+        return packed
+
+    def seal_table(self, content_key):
+        """Authenticate the header and tables of a FLAG_REUSABLE_CHUNKS container."""
+        nonce = os.urandom(NONCE_SIZE)
+        self.table_seal = nonce + engines.aead(self.cipher_id, content_key).encrypt(nonce, b"", self.pack_tables())
+
+    def check_table_seal(self, content_key):
+        """Raise ValueError unless the table seal matches the header and tables."""
+        nonce, tag = self.table_seal[:NONCE_SIZE], self.table_seal[NONCE_SIZE:]
+        try:
+            engines.aead(self.cipher_id, content_key).decrypt(nonce, tag, self.pack_tables())
+        except InvalidTag:
+            raise ValueError("Container header failed authentication. Decryption failed.")
+
+    @property
+    def size(self):
+        """Number of bytes taken by the header and chunk table on disk."""
+        entry_size = _REUSABLE_CHUNK_ENTRY.size if self.reusable_chunks else _CHUNK_ENTRY.size
+        size = _HEADER.size + entry_size * self.chunk_count
+        if self.version >= 2:
+            size += _RECIPIENT_COUNT.size + _key_entry_size(self.version) * len(self.wrapped_keys)
+        if self.reusable_chunks:
+            size += TABLE_SEAL_SIZE
+        if self.has_chunk_hashes:
+            size += HASH_SIZE * (self.chunk_count + 1)
+        return size
+
+    def plaintext_offsets(self):
+        """Return the plaintext offset at which every chunk starts."""
+        offsets = []
+        offset = 0
+        for plain_len, _ in self.chunks:
+            offsets.append(offset)
+            offset += plain_len
+        return offsets
+
+    def chunk_offsets(self):
+        """Return the absolute file offset of every chunk."""
+        if self._offsets is None:
+            offsets = []
+            offset = self.size
+            for _, stored_len in self.chunks:
+                offsets.append(offset)
+                offset += stored_len
+            self._offsets = offsets
+        return self._offsets
+
+    def ephemeral_public_key(self):
+        return ec.EllipticCurvePublicKey.from_encoded_point(CURVE, self.ephemeral_public_bytes)
+
+    def key_ids(self):
+        """Return the key ids of the recipients, skipping entries without one."""
+        return [key_id for key_id, _ in self.wrapped_keys if key_id is not None]
+
+    @classmethod
+    def read(cls, f):
+        """Parse a header and chunk table from the start of a binary file object."""
+        fixed = f.read(_HEADER.size)
+        if len(fixed) != _HEADER.size:
+            raise ValueError("Truncated container header.")
+        (magic, version, flags, cipher_id, codec, chunk_size, plaintext_size,
+         chunk_count, salt, ephemeral_public_bytes) = _HEADER.unpack(fixed)
+        if magic != MAGIC:
+            raise ValueError("Not a DataCrypt container.")
+        if version not in SUPPORTED_VERSIONS:
+            raise ValueError(f"Unsupported container version: {version}")
+        if cipher_id not in engines.ENGINES.values():
+            raise ValueError(f"Unsupported cipher id: {cipher_id}")
+        if version < 4:
+            codec = compression.CODEC_NONE
+        elif codec not in compression.CODECS.values():
+            raise ValueError(f"Unsupported compression codec id: {codec}")
+        if version < 5:
+            flags = 0
+        elif flags & ~KNOWN_FLAGS:
+            raise ValueError(f"Unsupported container flags: {flags:#04x}")
+
+        wrapped_keys = []
+        if version >= 2:
+            count_bytes = f.read(_RECIPIENT_COUNT.size)
+            if len(count_bytes) != _RECIPIENT_COUNT.size:
+                raise ValueError("Truncated container header.")
+            (recipient_count,) = _RECIPIENT_COUNT.unpack(count_bytes)
+            entry_size = _key_entry_size(version)
+            keys = f.read(entry_size * recipient_count)
+            if len(keys) != entry_size * recipient_count:
+                raise ValueError("Truncated container key table.")
+            for i in range(0, len(keys), entry_size):
+                entry = keys[i:i + entry_size]
+                if version >= 3:
+                    wrapped_keys.append((entry[:KEY_ID_SIZE], entry[KEY_ID_SIZE:]))
+                else:
+                    wrapped_keys.append((None, entry))
+
+        entry = _REUSABLE_CHUNK_ENTRY if flags & FLAG_REUSABLE_CHUNKS else _CHUNK_ENTRY
+        table = f.read(entry.size * chunk_count)
+        if len(table) != entry.size * chunk_count:
+            raise ValueError("Truncated container chunk table.")
+        nonces = table_seal = None
+        if flags & FLAG_REUSABLE_CHUNKS:
+            entries = list(entry.iter_unpack(table))
+            chunks = [(plain_len, stored_len) for plain_len, stored_len, _ in entries]
+            nonces = [nonce for _, _, nonce in entries]
+            table_seal = f.read(TABLE_SEAL_SIZE)
+            if len(table_seal) != TABLE_SEAL_SIZE:
+                raise ValueError("Truncated container chunk table.")
+        else:
+            chunks = list(entry.iter_unpack(table))
+        chunk_hashes = merkle_root = None
+        if flags & FLAG_CHUNK_HASHES:
+            hashes = f.read(HASH_SIZE * (chunk_count + 1))
+            if len(hashes) != HASH_SIZE * (chunk_count + 1):
+                raise ValueError("Truncated container chunk hashes.")
+            chunk_hashes = [hashes[i:i + HASH_SIZE] for i in range(0, HASH_SIZE * chunk_count, HASH_SIZE)]
+            merkle_root = hashes[HASH_SIZE * chunk_count:]
+        return cls(chunk_size, plaintext_size, salt, ephemeral_public_bytes, wrapped_keys,
+                   chunks=chunks, cipher_id=cipher_id, flags=flags, version=version, codec=codec,
+                   nonces=nonces, table_seal=table_seal, chunk_hashes=chunk_hashes, merkle_root=merkle_root)
+
+
+def _key_entry_size(version):
+    return WRAPPED_KEY_SIZE + (KEY_ID_SIZE if version >= 3 else 0)
+
+
+def plan_chunks(plaintext_size, chunk_size):
+    """Split plaintext_size bytes into chunk table entries.
+
+    An empty input still gets one (empty) chunk, so there is always an
+    authenticated last chunk.
+    """
+    chunks = []
+    remaining = plaintext_size
+    while True:
+        plain_len = min(chunk_size, remaining)
+        chunks.append((plain_len, plain_len + TAG_SIZE))
+        remaining -= plain_len
+        if remaining <= 0:
+            return chunks
+
+
+def is_container(path):
+    """Return True if the file at path starts with the container magic."""
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def key_id(public_key):
+    """Return the short id recorded for a recipient: a SHA-256 prefix of its compressed point."""
+    digest = hashes.Hash(hashes.SHA256())
+    digest.update(compress_public_key(public_key))
+    return digest.finalize()[:KEY_ID_SIZE]
+
+
+def compress_public_key(public_key):
+    # SEC1 compressed point: 0x02/0x03 (parity of y) then x. Built by hand so the
+    # encrypt path does not have to import the (slow to load) serialization module.
+    numbers = public_key.public_numbers()
+    size = (public_key.curve.key_size + 7) // 8
+    return bytes([2 + (numbers.y & 1)]) + numbers.x.to_bytes(size, "big")
+
+
+def derive_file_key(shared_key, salt):
+    """Derive the file key of a version 1 container from an ECDH shared secret."""
+    return HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=salt,
+        info=b'datacrypt container v1',
+    ).derive(shared_key)
+
+
+def _derive_wrap_key(shared_key, salt):
+    return HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=salt,
+        info=b'datacrypt recipient key v2',
+    ).derive(shared_key)
+
+
+def new_content_key():
+    return os.urandom(KEY_SIZE)
+
+
+def wrap_content_key(content_key, shared_key, salt, recipient_public_key):
+    """Return the key table entry wrapping the content key for one recipient."""
+    # The wrap key is unique per (file, recipient) and used once, so a fixed nonce is safe
+    wrapped = AESGCM(_derive_wrap_key(shared_key, salt)).encrypt(bytes(NONCE_SIZE), content_key, None)
+    return key_id(recipient_public_key), wrapped
+
+
+def unwrap_content_key(wrapped_keys, shared_key, salt, recipient_key_id=None):
+    """Return the content key from the entry wrapped for shared_key, or None if there is none.
+
+    When recipient_key_id is given, only entries with that id (or no id) are tried.
+    """
+    aead = AESGCM(_derive_wrap_key(shared_key, salt))
+    for entry_key_id, wrapped in wrapped_keys:
+        if recipient_key_id is not None and entry_key_id not in (None, recipient_key_id):
+            continue
+        try:
+            return aead.decrypt(bytes(NONCE_SIZE), wrapped, None)
+        except InvalidTag:
+            continue
+    return None
+
+
+def new_salt():
+    return os.urandom(SALT_SIZE)
+
+
+def chunk_nonce(index):
+    # The content key is random per file, so a counter nonce never repeats
+    return index.to_bytes(NONCE_SIZE, "big")
+
+
+def chunk_digest(data):
+    """Return the chunk hash recorded with FLAG_CHUNK_HASHES: SHA-256 of 0x00 plus the stored chunk."""
+    digest = hashlib.sha256(b"\x00")
+    digest.update(data)  # hashlib releases the GIL here, so worker threads hash in parallel
+    return digest.digest()
+
+
+def merkle_root(leaves):
+    """Return the Merkle root of a list of chunk hashes.
+
+    Inner nodes are SHA-256 of 0x01 plus both children (the 0x00/0x01 prefixes
+    keep leaves and inner nodes apart); an odd node out moves up unchanged.
+    """
+    level = list(leaves)
+    if not level:
+        return hashlib.sha256(b"").digest()
+    while len(level) > 1:
+        paired = [hashlib.sha256(b"\x01" + level[i] + level[i + 1]).digest() for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            paired.append(level[-1])
+        level = paired
+    return level[0]
+
+
+def pack_frame(plain_len, stored_len, last):
+    return _FRAME.pack(1 if last else 0, plain_len, stored_len)
+
+
+def unpack_frame(data):
+    """Return (plain length, stored length, last) from a FLAG_STREAM chunk frame."""
+    flags, plain_len, stored_len = _FRAME.unpack(data)
+    if flags & ~1:
+        raise ValueError("Chunk frame is corrupt. Decryption failed.")
+    return plain_len, stored_len, bool(flags)
+
+
+def chunk_aad(header_fixed, index, last):
+    return header_fixed + _CHUNK_AAD.pack(index, 1 if last else 0)
+
+
+class ChunkCipher:
+    """Seals and opens the chunks of one container under its content key."""
+
+    def __init__(self, file_key, header):
+        # A header read from a file must match its table seal before any chunk is trusted
+        if header.reusable_chunks and header.table_seal is not None:
+            header.check_table_seal(file_key)
+        self._aead = engines.aead(header.cipher_id, file_key)
+        # encrypt_into/decrypt_into are missing from older cryptography releases, which then pay one extra copy
+        self._into = hasattr(self._aead, "encrypt_into")
+        self._header_fixed = header.pack_fixed()
+        self._last_index = header.chunk_count - 1
+        self._chunks = header.chunks
+        self._codec = header.codec
+        self._nonces = header.nonces if header.reusable_chunks else None
+
+    def _nonce_and_aad(self, index, last=None):
+        if self._nonces is not None:
+            return self._nonces[index], _REUSABLE_CHUNK_AAD
+        if last is None:
+            last = index == self._last_index
+        return chunk_nonce(index), chunk_aad(self._header_fixed, index, last)
+
+    def seal(self, index, data):
+        nonce, aad = self._nonce_and_aad(index)
+        return self._aead.encrypt(nonce, data, aad)
+
+    def seal_reusable(self, nonce, data):
+        """Seal a FLAG_REUSABLE_CHUNKS chunk under its own nonce, before the chunk table exists."""
+        return self._aead.encrypt(nonce, data, _REUSABLE_CHUNK_AAD)
+
+    def seal_into(self, index, data, out, last=None):
+        """Seal chunk `index` into the writable buffer out; returns the view of out holding it.
+
+        last says whether this is the final chunk; it only has to be given for
+        FLAG_STREAM containers, whose chunk count is not in the header.
+        """
+        out = out[:len(data) + TAG_SIZE]
+        nonce, aad = self._nonce_and_aad(index, last)
+        if not self._into:
+            out[:] = self._aead.encrypt(nonce, data, aad)
+            return out
+        self._aead.encrypt_into(nonce, data, aad, out)
+        return out
+
+    def open(self, index, data):
+        """Authenticate and decrypt chunk `index`, raising ValueError if it was tampered with."""
+        nonce, aad = self._nonce_and_aad(index)
+        try:
+            plaintext = self._aead.decrypt(nonce, data, aad)
+        except InvalidTag:
+            raise ValueError(f"Chunk {index} failed authentication. Decryption failed.")
+        return self._expand(index, plaintext)
+
+    def _expand(self, index, payload, plain_len=None):
+        """Return the plaintext of an opened chunk payload, decompressing it if it is shorter."""
+        if plain_len is None:
+            plain_len = self._chunks[index][0]
+        if len(payload) == plain_len:
+            return payload
+        if len(payload) > plain_len or self._codec == compression.CODEC_NONE:
+            raise ValueError("Chunk table is corrupt. Decryption failed.")
+        return compression.decompress_chunk(self._codec, payload, plain_len)
+
+    def open_into(self, index, data, out, last=None, plain_len=None):
+        """Like open(), but decrypt into the writable buffer out; returns the view of out used.
+
+        A compressed chunk is inflated into a new bytes object, which is returned instead.
+        last is as for seal_into(); FLAG_STREAM chunks also take their plain_len
+        from their frame, as there is no chunk table.
+        """
+        if not self._into:
+            nonce, aad = self._nonce_and_aad(index, last)
+            try:
+                plaintext = self._expand(index, self._aead.decrypt(nonce, data, aad), plain_len)
+            except InvalidTag:
+                raise ValueError(f"Chunk {index} failed authentication. Decryption failed.")
+            if len(plaintext) > len(out):
+                return plaintext
+            out = out[:len(plaintext)]
+            out[:] = plaintext
+            return out
+        # Compressed chunks are inflated into a new buffer; stored ones stay in out
+        if not TAG_SIZE <= len(data) <= len(out) + TAG_SIZE:
+            raise ValueError("Chunk table is corrupt. Decryption failed.")
+        out = out[:len(data) - TAG_SIZE]
+        nonce, aad = self._nonce_and_aad(index, last)
+        try:
+            self._aead.decrypt_into(nonce, data, aad, out)
+        except InvalidTag:
+            raise ValueError(f"Chunk {index} failed authentication. Decryption failed.")
+        return self._expand(index, out, plain_len)
@@ -0,0 +1,394 @@
+"""Headless DataCrypt command line and library entry point.
+
+Usage:
+    python datacrypt.py keygen [--key-dir DIR]
+    python datacrypt.py show-key [--key-dir DIR] [--fingerprint]
+    python datacrypt.py encrypt FILE [FILE ...] -r RECIPIENT [-r RECIPIENT ...] [--cipher ENGINE] [--incremental | --resumable] [--session]
+    python datacrypt.py decrypt FILE [FILE ...] [--key PRIVATE_KEY] [--key-file LEGACY_KEY] [--resumable]
+    producer | python datacrypt.py encrypt - -r RECIPIENT | consumer
+    producer | python datacrypt.py decrypt - [--key PRIVATE_KEY] | consumer
+    python datacrypt.py verify FILE [FILE ...] [--key PRIVATE_KEY] [--method gcm|sha256]
+    python datacrypt.py archive create DIR -r RECIPIENT [-r RECIPIENT ...] [-o ARCHIVE] [--cipher ENGINE]
+    python datacrypt.py archive list ARCHIVE [--key PRIVATE_KEY]
+    python datacrypt.py archive extract ARCHIVE [MEMBER ...] [-C DIR] [--key PRIVATE_KEY]
+    python datacrypt.py engines [--refresh]
+    python datacrypt.py --max-memory 256M --stats encrypt FILE ... -r RECIPIENT
+
+A FILE of "-" means stdin/stdout (see streaming.py); status messages then go
+to stderr. Nothing here imports PyQt6, and each command imports only the modules (and so
+the cryptography primitives) it needs, so scripted use starts quickly. The
+functions below can also be called directly from Python.
+"""
+import argparse
+import os
+import sys
+
+# Mirror chunk_io.BACKENDS, engines.ENGINES and output.FSYNC_POLICIES; kept here so building the parser imports no crypto code
+IO_BACKENDS = ("readinto", "mmap", "read")
+CIPHER_ENGINES = ("aes-256-gcm", "chacha20-poly1305", "auto")
+FSYNC_POLICIES = ("file", "batch", "never")
+
+
+def keygen(key_dir=None):
+    """Generate the default key pair; returns False if it already exists."""
+    import key_manager
+
+    if key_dir is not None:
+        key_manager.KEY_DIR = os.path.abspath(key_dir)
+    return key_manager.generate_key_pair()
+
+
+def show_key(key_dir=None, with_fingerprint=False):
+    """Return the base64 public key of the default identity, as shown in the GUI."""
+    import key_manager
+    import key_ring
+
+    public_key_path = os.path.join(key_dir or key_manager.KEY_DIR, "public_key.pem")
+    with open(public_key_path, "r") as f:
+        public_key_str = key_ring.pem_body(f.read())
+    if with_fingerprint:
+        fp = key_ring.fingerprint(key_ring.parse_public_key(public_key_str))
+        return f"{public_key_str}\nfingerprint: {fp}"
+    return public_key_str
+
+
+def encrypt(file_paths, recipients, chunk_size=None, workers=None, legacy=False, io_backend=None, compress=None,
+            incremental=False, manifest_dir=None, resumable=False, use_session=False, cipher=None, fsync=None):
+    """Encrypt every file in file_paths for all recipients (see key_ring.read_recipient).
+
+    With incremental, only the parts of each file that changed since its last
+    incremental encryption are encrypted again (see incremental.py); chunk_size
+    is then the average chunk size. With resumable, an interrupted run can be
+    restarted and continues where it stopped (see resume.py). With use_session,
+    all the files share one ephemeral key and ECDH exchange (see session.py).
+    cipher picks the chunk engine (see engines.py), and fsync when outputs are
+    flushed to disk (see output.py); "batch" flushes them all at the end.
+    """
+    import encryptor
+    import key_ring
+    import output
+
+    public_keys = [encryptor.load_public_key(key_ring.read_recipient(recipient)) for recipient in recipients]
+    if incremental and (legacy or resumable or cipher is not None):
+        raise ValueError("--incremental cannot be combined with --legacy, --resumable or --cipher.")
+    # "batch" collects this command's outputs and puts them in place at the end
+    batch = output.FsyncBatch() if fsync == "batch" else None
+    try:
+        if incremental:
+            import incremental as incremental_mod
+
+            options = {"workers": workers, "compress": compress, "fsync": batch or fsync}
+            if chunk_size is not None:
+                options["average_chunk_size"] = chunk_size
+            for file_path in file_paths:
+                manifest_path = incremental_mod.manifest_path_for(file_path, manifest_dir)
+                stats = incremental_mod.encrypt_incremental(file_path, public_keys, manifest_path=manifest_path,
+                                                            verbose=False, **options)
+                print(f"Encrypted {file_path} -> {file_path}.enc "
+                      f"({stats['encrypted_chunks']}/{stats['chunks']} chunks changed)")
+            return
+        options = {"workers": workers, "legacy": legacy, "io_backend": io_backend, "compress": compress,
+                   "resumable": resumable, "cipher": cipher, "fsync": batch or fsync}
+        # A session only covers encrypt_file; a stream is a single file anyway
+        file_keys = encryptor.open_session(public_keys) if use_session else public_keys
+        if chunk_size is not None:
+            options["chunk_size"] = chunk_size
+        for file_path in file_paths:
+            if file_path == "-":
+                import streaming
+
+                if legacy or resumable:
+                    raise ValueError("Output written to stdout cannot be --legacy or --resumable.")
+                stream_options = {key: options[key] for key in ("workers", "compress", "chunk_size", "cipher")
+                                  if key in options}
+                size = streaming.encrypt_stream(sys.stdin.buffer, sys.stdout.buffer, public_keys, **stream_options)
+                print(f"Encrypted {size} bytes from stdin", file=sys.stderr)
+                continue
+            encryptor.encrypt_file(file_path, file_keys, verbose=False, **options)
+            print(f"Encrypted {file_path} -> {file_path}.enc")
+    finally:
+        if batch is not None:
+            # Files completed before any failure still go into place
+            batch.flush()
+
+
+def decrypt(file_paths, private_key_path=None, encrypted_key_path=None, workers=None, io_backend=None,
+            resumable=False, fsync=None):
+    """Decrypt every file in file_paths; the key ring picks the key unless one is given.
+
+    fsync is as for encrypt().
+    """
+    import decryptor
+    import key_manager
+    import output
+
+    batch = output.FsyncBatch() if fsync == "batch" else None
+    try:
+        for file_path in file_paths:
+            if file_path == "-":
+                import streaming
+
+                if resumable:
+                    raise ValueError("Output written to stdout cannot be --resumable.")
+                size = streaming.decrypt_stream(sys.stdin.buffer, sys.stdout.buffer, private_key_path, workers=workers)
+                print(f"Decrypted {size} bytes from stdin", file=sys.stderr)
+                continue
+            key_path = encrypted_key_path
+            if key_path is None and os.path.exists(file_path.rsplit(".", 1)[0] + ".key"):
+                key_path = file_path.rsplit(".", 1)[0] + ".key"
+            # Legacy files carry no key ids, so they need an explicit (default) private key
+            key = private_key_path
+            if key is None and key_path is not None:
+                key = os.path.join(key_manager.KEY_DIR, "private_key.pem")
+            out_path = decryptor.decrypt_file(file_path, key_path, key, workers=workers, io_backend=io_backend,
+                                              resumable=resumable, fsync=batch or fsync, verbose=False)
+            print(f"Decrypted {file_path} -> {out_path}")
+    finally:
+        if batch is not None:
+            # Files completed before any failure still go into place
+            batch.flush()
+        _clear_secrets()
+
+
+def _clear_secrets():
+    """Drop the ECDH secrets cached while decrypting (see session.py), if any were."""
+    session = sys.modules.get("session")
+    if session is not None:
+        session.clear_shared_secrets()
+
+
+def verify(file_paths, private_key_path=None, workers=None, io_backend=None, method="gcm"):
+    """Check every chunk of every file without writing plaintext; returns False if any is damaged.
+
+    Damaged byte ranges are listed per file. method "sha256" checks the chunk
+    hashes instead of the GCM tags and needs no private key (see integrity.py).
+    """
+    import integrity
+
+    intact = True
+    try:
+        for file_path in file_paths:
+            damaged = integrity.scrub_file(file_path, method, private_key_path, workers=workers, io_backend=io_backend)
+            if not damaged:
+                print(f"OK     {file_path}")
+                continue
+            intact = False
+            print(f"BAD    {file_path}")
+            for damage in damaged:
+                print(f"       {integrity.describe(damage)}")
+    finally:
+        _clear_secrets()
+    return intact
+
+
+def archive_create(source_dir, recipients, out_path=None, chunk_size=None, workers=None, compress=None, cipher=None,
+                   fsync=None):
+    """Pack source_dir into one encrypted archive for all recipients."""
+    import archive
+    import encryptor
+    import key_ring
+
+    public_keys = [encryptor.load_public_key(key_ring.read_recipient(recipient)) for recipient in recipients]
+    options = {"out_path": out_path, "workers": workers, "compress": compress, "cipher": cipher, "fsync": fsync}
+    if chunk_size is not None:
+        options["chunk_size"] = chunk_size
+    names = archive.create_archive(source_dir, public_keys, verbose=False, **options)
+    print(f"Archived {len(names)} files from {source_dir} -> {out_path or os.path.normpath(source_dir) + '.enc'}")
+
+
+def archive_list(archive_path, private_key_path=None):
+    """Print the members of an archive; only its index is decrypted."""
+    import archive
+
+    try:
+        for member in archive.list_archive(archive_path, private_key_path):
+            print(f"{member['size']:>12}  {member['name']}")
+    finally:
+        _clear_secrets()
+
+
+def archive_extract(archive_path, names=None, dest_dir=".", private_key_path=None, workers=None):
+    """Extract the named members (default: all) of an archive under dest_dir."""
+    import archive
+
+    try:
+        extracted = archive.extract_archive(archive_path, dest_dir, names or None, private_key_path, workers=workers,
+                                            verbose=False)
+    finally:
+        _clear_secrets()
+    print(f"Extracted {len(extracted)} files from {archive_path} into {dest_dir}")
+
+
+def show_engines(refresh=False):
+    """Benchmark the chunk ciphers and print their speed and the one --cipher auto uses."""
+    import engines
+
+    engine = engines.select_engine(refresh=refresh)
+    for name, rate in engines.benchmark().items():
+        print(f"{name:<18} {rate / (1024 * 1024):>9.0f} MB/s")
+    print(f"auto: {engine} (cached in {engines.bench_cache_path()})")
+
+
+class _HelpFormatter(argparse.HelpFormatter):
+    """argparse's formatter, minus the shutil import (which pulls in bz2 and lzma) it does to size every parser's help."""
+
+    def __init__(self, prog):
+        try:
+            width = int(os.environ.get("COLUMNS", 0)) or os.get_terminal_size(sys.__stdout__.fileno()).columns
+        except (AttributeError, ValueError, OSError):
+            width = 80
+        super().__init__(prog, width=width - 2)
+
+
+class _Parser(argparse.ArgumentParser):
+    """ArgumentParser using _HelpFormatter; add_subparsers() makes the subcommand parsers of the same class."""
+
+    def __init__(self, *args, formatter_class=_HelpFormatter, **kwargs):
+        super().__init__(*args, formatter_class=formatter_class, **kwargs)
+
+
+def build_parser():
+    parser = _Parser(prog="datacrypt", description="DataCrypt file encryption without the GUI.")
+    parser.add_argument("--metrics-jsonl", metavar="PATH", help="append per-phase timings to a JSON-lines file")
+    parser.add_argument("--metrics-prom", metavar="PATH", help="write per-phase counters as a Prometheus text file")
+    parser.add_argument("--stats", action="store_true", help="print how busy each pipeline stage was to stderr")
+    parser.add_argument("--max-memory", metavar="SIZE",
+                        help="cap chunk buffers of all operations together, e.g. 256M (default: no cap)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("keygen", help="generate your ECDH key pair")
+    p.add_argument("--key-dir", help="key directory (default: keys/ next to this script)")
+
+    p = commands.add_parser("show-key", help="print your public key to share with senders")
+    p.add_argument("--key-dir", help="key directory (default: keys/ next to this script)")
+    p.add_argument("--fingerprint", action="store_true", help="also print the key fingerprint")
+
+    p = commands.add_parser("encrypt", help="encrypt files into .enc containers")
+    p.add_argument("files", nargs="+")
+    p.add_argument("-r", "--recipient", required=True, action="append",
+                   help="base64 public key, PEM public key file or @contact (repeatable)")
+    p.add_argument("--chunk-size", type=int, help="container chunk size in bytes")
+    p.add_argument("-w", "--workers", type=int, help="threads per file (default: CPU count)")
+    p.add_argument("--legacy", action="store_true", help="write a legacy .enc/.key pair")
+    p.add_argument("-z", "--compress", choices=("zlib", "lzma"), help="compress each chunk before encrypting it")
+    p.add_argument("--io", choices=IO_BACKENDS, help="how input is read (default: readinto)")
+    p.add_argument("--incremental", action="store_true",
+                   help="re-encrypt only the parts changed since the last run (the output is still rewritten in "
+                        "full, except on reflink file systems such as btrfs and XFS)")
+    p.add_argument("--manifest-dir", help="where --incremental keeps its manifests (default: KEY_DIR/manifests)")
+    p.add_argument("--resumable", action="store_true",
+                   help="checkpoint progress so a killed run continues where it stopped when rerun")
+    p.add_argument("--session", action="store_true",
+                   help="one ephemeral key and ECDH exchange for all FILEs instead of one per file")
+    p.add_argument("--cipher", choices=CIPHER_ENGINES,
+                   help="chunk cipher (default: aes-256-gcm; auto: fastest on this machine)")
+    p.add_argument("--fsync", choices=FSYNC_POLICIES,
+                   help="flush each output to disk (file, the default), all at the end (batch) or leave it to the OS")
+
+    p = commands.add_parser("decrypt", help="decrypt .enc files")
+    p.add_argument("files", nargs="+")
+    p.add_argument("-k", "--key", help="private key PEM (default: pick from the key ring)")
+    p.add_argument("--key-file", help="ephemeral .key file of a legacy .enc file")
+    p.add_argument("--resumable", action="store_true",
+                   help="checkpoint progress so a killed run continues where it stopped when rerun")
+    p.add_argument("-w", "--workers", type=int, help="threads per file (default: CPU count)")
+    p.add_argument("--io", choices=IO_BACKENDS, help="how input is read (default: readinto)")
+    p.add_argument("--fsync", choices=FSYNC_POLICIES,
+                   help="flush each output to disk (file, the default), all at the end (batch) or leave it to the OS")
+
+    p = commands.add_parser("verify", help="check that .enc files are intact and list damaged byte ranges")
+    p.add_argument("files", nargs="+")
+    p.add_argument("-k", "--key", help="private key PEM (default: pick from the key ring)")
+    p.add_argument("--method", choices=("gcm", "sha256"), default="gcm",
+                   help="check GCM tags (needs the key) or chunk hashes (no key needed); default: gcm")
+    p.add_argument("-w", "--workers", type=int, help="threads per file (default: CPU count)")
+    p.add_argument("--io", choices=IO_BACKENDS, help="how input is read (default: readinto)")
+
+    p = commands.add_parser("archive", help="pack a directory into one encrypted archive, list or extract it")
+    archive_commands = p.add_subparsers(dest="archive_command", required=True)
+    a = archive_commands.add_parser("create", help="encrypt a directory tree into one archive")
+    a.add_argument("directory")
+    a.add_argument("-r", "--recipient", required=True, action="append",
+                   help="base64 public key, PEM public key file or @contact (repeatable)")
+    a.add_argument("-o", "--output", help="archive path (default: DIRECTORY.enc)")
+    a.add_argument("--chunk-size", type=int, help="container chunk size in bytes")
+    a.add_argument("-w", "--workers", type=int, help="threads (default: CPU count)")
+    a.add_argument("-z", "--compress", choices=("zlib", "lzma"), help="compress each chunk before encrypting it")
+    a.add_argument("--cipher", choices=CIPHER_ENGINES,
+                   help="chunk cipher (default: aes-256-gcm; auto: fastest on this machine)")
+    a.add_argument("--fsync", choices=("file", "never"), help="flush the archive to disk (default) or leave it to the OS")
+    a = archive_commands.add_parser("list", help="list the files in an archive")
+    a.add_argument("archive")
+    a.add_argument("-k", "--key", help="private key PEM (default: pick from the key ring)")
+    a = archive_commands.add_parser("extract", help="extract all or some files of an archive")
+    a.add_argument("archive")
+    a.add_argument("members", nargs="*", help="member names to extract (default: all)")
+    a.add_argument("-C", "--directory", default=".", help="extract under this directory (default: .)")
+    a.add_argument("-k", "--key", help="private key PEM (default: pick from the key ring)")
+    a.add_argument("-w", "--workers", type=int, help="threads (default: CPU count)")
+
+    p = commands.add_parser("engines", help="benchmark the chunk ciphers and show which one --cipher auto picks")
+    p.add_argument("--refresh", action="store_true", help="benchmark again instead of using the cached result")
+    return parser
+
+
+def install_metrics(jsonl_path=None, prom_path=None, stats=False):
+    """Send per-phase timings to a JSON-lines log and/or a Prometheus text file; with stats, print stage utilization."""
+    import metrics
+
+    exporters = []
+    if stats:
+        import pipeline
+
+        exporters.append(pipeline.UtilizationPrinter())
+    if jsonl_path:
+        exporters.append(metrics.JsonLinesExporter(jsonl_path))
+    if prom_path:
+        exporters.append(metrics.PrometheusExporter(prom_path))
+
+    def export(*record):
+        for exporter in exporters:
+            exporter(*record)
+
+    metrics.set_exporter(export if exporters else None)
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.metrics_jsonl or args.metrics_prom or args.stats:
+        install_metrics(args.metrics_jsonl, args.metrics_prom, args.stats)
+    try:
+        if args.max_memory:
+            import pipeline
+
+            pipeline.set_max_memory(pipeline.parse_size(args.max_memory))
+        if args.command == "keygen":
+            keygen(args.key_dir)
+        elif args.command == "show-key":
+            print(show_key(args.key_dir, args.fingerprint))
+        elif args.command == "encrypt":
+            encrypt(args.files, args.recipient, args.chunk_size, args.workers, args.legacy, args.io, args.compress,
+                    args.incremental, args.manifest_dir, args.resumable, args.session, args.cipher, args.fsync)
+        elif args.command == "decrypt":
+            decrypt(args.files, args.key, args.key_file, args.workers, args.io, args.resumable, args.fsync)
+        elif args.command == "verify":
+            if not verify(args.files, args.key, args.workers, args.io, args.method):
+                return 1
+        elif args.command == "archive":
+            if args.archive_command == "create":
+                archive_create(args.directory, args.recipient, args.output, args.chunk_size, args.workers,
+                               args.compress, args.cipher, args.fsync)
+            elif args.archive_command == "list":
+                archive_list(args.archive, args.key)
+            else:
+                archive_extract(args.archive, args.members, args.directory, args.key, args.workers)
+        elif args.command == "engines":
+            show_engines(args.refresh)
+    except (ValueError, OSError) as e:
+        print(f"datacrypt: error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,64 +1,464 @@
-from cryptography.hazmat.primitives.asymmetric import ec
-from cryptography.hazmat.primitives import serialization, hashes
-from cryptography.hazmat.primitives.kdf.hkdf import HKDF
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 import os
+import chunk_io
+import container
+from progress import Reporter
 
-def decrypt_file(encrypted_file_path, encrypted_key_path, private_key_path, sender_public_key_str=None):
-    """Decrypt file using ECDH and AES, with optional sender public key verification."""
-    # Load private key
-    with open(private_key_path, "rb") as key_file:
-        private_key = serialization.load_pem_private_key(key_file.read(), password=None)
+# Everything else is imported inside the functions that need it, so that
+# importing this module (e.g. for a one-file CLI run) stays quick
+
+# Size of the blocks read from the encrypted file; must be a multiple of the AES block size
+CHUNK_SIZE = 64 * 1024
+
+def _legacy_plaintext(decryptor, src, chunk_size, reporter, operation="decrypt_file"):
+    """Yield the plaintext of the rest of src, holding back only the last block for unpadding.
+
+    Pieces are views of a reused buffer, valid until the next one is taken.
+    Peak memory is two buffers of roughly chunk_size bytes, whatever the file size.
+    """
+    import metrics
+
+    in_buf = bytearray(chunk_size)
+    out_buf = bytearray(chunk_size + 48)  # held-back block + update_into slack
+    in_view = memoryview(in_buf)
+    out_view = memoryview(out_buf)
+    held = 0  # decrypted bytes at the front of out_buf not yet yielded
+    read_phase = metrics.accumulator(operation, "read")
+    aes_phase = metrics.accumulator(operation, "aes")
+    readinto = read_phase.wrap(src.readinto)
+    update_into = aes_phase.wrap(decryptor.update_into)
+
+    while True:
+        n = readinto(in_view)
+        if not n:
+            break
+        held += update_into(in_view[:n], out_view[held:])
+        reporter.advance(n)
+
+        # Hand out everything but the last block, which may hold the padding
+        if held > 16:
+            yield out_view[:held - 16]
+            out_view[:16] = out_view[held - 16:held]
+            held = 16
+
+    tail = bytes(out_view[:held]) + decryptor.finalize()
+    if len(tail) != 16:
+        raise ValueError("Invalid ciphertext length. Decryption failed.")
+
+    # Remove padding
+    pad_len = tail[-1]
+    if pad_len < 1 or pad_len > 16:
+        raise ValueError("Invalid padding detected. Decryption failed.")
+    yield memoryview(tail)[:-pad_len]
+    read_phase.emit()
+    aes_phase.emit()
+
+def load_private_key(private_key_path):
+    """Load an unencrypted PEM private key from disk (cached until the file changes)."""
+    import key_ring
+
+    return key_ring.load_private_key_file(private_key_path)
+
+def container_cipher(header, private_key, operation="decrypt_file"):
+    """Recover the content key of a container header and return its ChunkCipher."""
+    import metrics
+    import session
+
+    with metrics.span(operation, "ecdh"):
+        # Cached: the files of an encryption session share their ephemeral key
+        shared_key = session.shared_secret(private_key, header.ephemeral_public_bytes)
+    with metrics.span(operation, "hkdf"):
+        if header.version == 1:
+            content_key = container.derive_file_key(shared_key, header.salt)
+        else:
+            recipient_key_id = container.key_id(private_key.public_key())
+            content_key = container.unwrap_content_key(header.wrapped_keys, shared_key, header.salt, recipient_key_id)
+    if content_key is None:
+        raise ValueError("This file was not encrypted for your key. Decryption failed.")
+    return container.ChunkCipher(content_key, header)
+
+def open_container(src, private_key_path=None, keyring=None, operation="decrypt_file"):
+    """Read a container header from src and return (header, ChunkCipher).
+
+    The private key is loaded from private_key_path if given; otherwise the key
+    ids in the header select the matching identity of keyring (default: the
+    key ring in key_manager.KEY_DIR). operation names the caller in metrics.
+    """
+    import key_ring
+    import metrics
+
+    with metrics.span(operation, "header"):
+        header = container.ContainerHeader.read(src)
+    with metrics.span(operation, "load_key"):
+        if private_key_path is not None:
+            private_key = load_private_key(private_key_path)
+        else:
+            if keyring is None:
+                keyring = key_ring.default_keyring()
+            _, private_key = keyring.find_identity(header.key_ids())
+            if private_key is None:
+                raise ValueError("None of this file's recipients is in your key ring. Decryption failed.")
+    return header, container_cipher(header, private_key, operation)
+
+def _iter_plaintext(src, header, chunk_cipher, workers, reporter=None, io_backend=None, operation="decrypt_file",
+                    start=0):
+    """Yield the authenticated plaintext of every chunk of the container open in src, in order.
+
+    Each chunk is yielded as a memoryview of a reused buffer: it must be written
+    or copied before the generator is advanced again. With start, the first
+    start chunks are skipped without being decrypted; src must then be seekable.
+    """
+    import metrics
+    import parallel
+    import pipeline
+
+    if header.streamed:
+        # The chunk count is unknown until the last frame
+        workers = workers or parallel.default_workers()
+        max_plain_len = header.chunk_size
+        max_stored_len = header.chunk_size + container.TAG_SIZE
+        inline = False
+    else:
+        workers = parallel.workers_for(header.chunk_count, workers)
+        max_plain_len = max((plain_len for plain_len, _ in header.chunks), default=0)
+        max_stored_len = max((stored_len for _, stored_len in header.chunks), default=0)
+        inline = header.chunk_count - start <= 1
+    # Ring buffers are sized for the pipeline's chunks in flight; the budget may grant fewer workers
+    stages = pipeline.Pipeline(workers, max_stored_len + max_plain_len, operation, inline=inline)
+    read_phase = metrics.accumulator(operation, "read")
+    aes_phase = metrics.accumulator(operation, "aes")
+
+    def read_chunks(src):
+        lengths = [stored_len for _, stored_len in header.chunks]
+        if start:
+            src.seek(header.chunk_offsets()[start])
+        chunks = read_phase.iterate(chunk_io.iter_chunks(src, lengths[start:], io_backend, stages.slots))
+        for index, data in enumerate(chunks, start):
+            if reporter is not None:
+                reporter.check()
+            if len(data) != lengths[index]:
+                raise ValueError("Encrypted file is truncated. Decryption failed.")
+            yield index, data, header.chunks[index][0], None
+
+    def read_frames(src):
+        stored_buffers = chunk_io.BufferRing(stages.slots, max_stored_len)
+        frame = bytearray(container.FRAME_SIZE)
+        read_full = read_phase.wrap(chunk_io.read_full)
+        # Frames can only be found one after the other; skipped ones are stepped over unread
+        for _ in range(start):
+            if read_full(src, frame) != len(frame):
+                raise ValueError("Encrypted stream is truncated. Decryption failed.")
+            _, stored_len, _ = container.unpack_frame(frame)
+            src.seek(stored_len, os.SEEK_CUR)
+        index = start
+        while True:
+            if reporter is not None:
+                reporter.check()
+            if read_full(src, frame) != len(frame):
+                raise ValueError("Encrypted stream is truncated. Decryption failed.")
+            plain_len, stored_len, last = container.unpack_frame(frame)
+            if plain_len > header.chunk_size or stored_len > header.chunk_size + container.TAG_SIZE:
+                raise ValueError("Chunk frame is corrupt. Decryption failed.")
+            data = stored_buffers.get(index, stored_len)
+            if read_full(src, data) != stored_len:
+                raise ValueError("Encrypted stream is truncated. Decryption failed.")
+            yield index, data, plain_len, last
+            if last:
+                return
+            index += 1
+
+    def open_chunk(item):
+        index, data, plain_len, last = item
+        return chunk_cipher.open_into(index, data, plain_buffers.get(index, plain_len), last, plain_len)
+
+    with stages:
+        plain_buffers = chunk_io.BufferRing(stages.slots, max_plain_len)
+        chunks = read_frames(src) if header.streamed else read_chunks(src)
+        # Chunks are read, opened on the worker pool and yielded back in order
+        for plaintext in stages.run(aes_phase.wrap(open_chunk), chunks):
+            yield plaintext
+            if reporter is not None:
+                reporter.advance(len(plaintext))
+    read_phase.emit()
+    aes_phase.emit()
+
+def _container_plaintext(src, private_key_path, keyring, workers, reporter, io_backend=None, operation="decrypt_file",
+                         journal=None):
+    """Open the container in src and return an iterator over its plaintext (see _iter_plaintext).
+
+    With a resume.Journal, the journal is opened and the chunks it has
+    already checkpointed are skipped.
+    """
+    header, chunk_cipher = open_container(src, private_key_path, keyring, operation)
+    if header.is_archive:
+        raise ValueError("This file is an encrypted archive; unpack it with 'datacrypt.py archive extract'.")
+    if not header.streamed:
+        reporter.total = header.plaintext_size
+    start = 0
+    if journal is not None:
+        journal.begin()
+        start = journal.done
+        reporter.done = journal.written
+    return _iter_plaintext(src, header, chunk_cipher, workers, reporter, io_backend, operation, start)
+
+def _plaintext_of(src, encrypted_file_path, encrypted_key_path, private_key_path, keyring, chunk_size, workers, reporter,
+                  io_backend=None, operation="decrypt_file"):
+    """Return an iterator over the plaintext of encrypted_file_path, open in src: a container or a legacy .enc.
+
+    Keys are loaded before this returns, so a wrong key fails here. The pieces
+    are views of reused buffers, valid until the next one is taken.
+    """
+    import metrics
+
+    if container.is_container(encrypted_file_path):
+        return _container_plaintext(src, private_key_path, keyring, workers, reporter, io_backend, operation)
+    if encrypted_key_path is None or private_key_path is None:
+        raise ValueError("A .key file and a private key are required to decrypt a legacy .enc file.")
+    with metrics.span(operation, "load_key"):
+        private_key = load_private_key(private_key_path)
+    return _decrypt_legacy(src, private_key, encrypted_key_path, chunk_size, reporter, operation)
+
+def _write_plaintext(chunks, dst, operation="decrypt_file", journal=None):
+    """Write every piece of chunks to the binary file object dst; with a journal, checkpoint as it goes."""
+    import metrics
+
+    write_phase = metrics.accumulator(operation, "write")
+    write = write_phase.wrap(dst.write)
+    for plaintext in chunks:
+        write(plaintext)
+        if journal is not None:
+            journal.record(dst, len(plaintext), dst.tell())
+    if journal is not None:
+        journal.checkpoint(dst)
+    write_phase.emit()
+
+def _decrypt_container(src, private_key_path, keyring, out_path, workers, reporter, io_backend=None, journal=None):
+    """Decrypt a container (see container.py) from the binary file object src into out_path.
+
+    With a resume.Journal, the plaintext goes to the journal's .part file
+    instead and is checkpointed; an interrupted run carries on from its last
+    checkpoint.
+    """
+    chunks = _container_plaintext(src, private_key_path, keyring, workers, reporter, io_backend, journal=journal)
+    with (open(out_path, "wb") if journal is None else journal.open_output()) as dst:
+        _write_plaintext(chunks, dst, journal=journal)
+
+def _decrypt_legacy(src, private_key, encrypted_key_path, chunk_size, reporter, operation="decrypt_file"):
+    """Return an iterator over the plaintext of a legacy IV + AES-CBC stream whose ephemeral key lives in encrypted_key_path."""
+    # Legacy-only primitives are imported here to keep the default path quick to start
+    from cryptography.hazmat.primitives import serialization, hashes
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+    import engines
+    import metrics
 
     # Load ephemeral public key
-    with open(encrypted_key_path, "rb") as f:
-        ephemeral_public_pem = f.read()
-        ephemeral_public_key = serialization.load_pem_public_key(ephemeral_public_pem)
+    with metrics.span(operation, "load_key"):
+        with open(encrypted_key_path, "rb") as f:
+            ephemeral_public_pem = f.read()
+            ephemeral_public_key = serialization.load_pem_public_key(ephemeral_public_pem)
+
+    # ECDH key exchange
+    with metrics.span(operation, "ecdh"):
+        shared_key = private_key.exchange(ec.ECDH(), ephemeral_public_key)
+
+    # Derive AES key
+    with metrics.span(operation, "hkdf"):
+        aes_key = HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=None,
+            info=b'handshake data',
+        ).derive(shared_key)
+
+    # Decrypt using AES, streaming block by block
+    iv = src.read(16)
+    return _legacy_plaintext(engines.legacy_cbc(aes_key, iv).decryptor(), src, chunk_size, reporter, operation)
+
+def decrypt_file(encrypted_file_path, encrypted_key_path, private_key_path, sender_public_key_str=None,
+                 chunk_size=CHUNK_SIZE, workers=None, keyring=None, progress=None, cancel_event=None, io_backend=None,
+                 resumable=False, fsync=None, verbose=True):
+    """Decrypt file using ECDH and AES, with optional sender public key verification.
+
+    Single-file containers are detected by their header; encrypted_key_path is only
+    needed for legacy .enc/.key pairs and may be None otherwise. The ciphertext is
+    streamed, so memory use does not grow with file size. Container chunks are
+    decrypted on `workers` threads (default: one per CPU core).
+
+    For containers, private_key_path may be None: the recipient key ids in the
+    header then pick the right identity from keyring (see key_ring.KeyRing).
+
+    progress(bytes_done, bytes_total) is called after every chunk; setting
+    cancel_event stops the run, removes the partial output and raises
+    progress.OperationCancelled.
+
+    io_backend selects how container chunks are read (see chunk_io.BACKENDS).
+    Phase timings go to the exporter installed with metrics.set_exporter().
+
+    The plaintext is written to a preallocated temp file and renamed into
+    place once complete and authenticated, so a failed run leaves any earlier
+    output as it was. fsync is "file" (default) or "never", or an
+    output.FsyncBatch the caller flushes (see output.py).
+
+    With resumable=True (containers only) the plaintext is written to
+    <output>.part with a checkpoint journal (see resume.py) and renamed into
+    place once complete; an interrupted run keeps both, and calling
+    decrypt_file again continues from the last checkpoint.
+
+    Returns the path of the decrypted file; with verbose, it is also printed.
+    """
+    import key_ring
+    import metrics
+    import output
+
+    if chunk_size <= 0 or chunk_size % 16:
+        raise ValueError("chunk_size must be a positive multiple of 16 bytes.")
+    io_backend = chunk_io.check_backend(io_backend)
+    fsync = output.check_fsync(fsync)
+    if resumable and not container.is_container(encrypted_file_path):
+        raise ValueError("Legacy .enc files cannot be decrypted resumably.")
 
     # Optionally load sender's public key
     if sender_public_key_str:
         try:
-            # Reconstruct PEM format from base64 key content
-            sender_public_key_pem = '-----BEGIN PUBLIC KEY-----\n' + '\n'.join([sender_public_key_str[i:i+64] for i in range(0, len(sender_public_key_str), 64)]) + '\n-----END PUBLIC KEY-----\n'
-            sender_public_key = serialization.load_pem_public_key(sender_public_key_pem.encode())
+            sender_public_key = key_ring.parse_public_key(sender_public_key_str.strip())
             # Placeholder: Add cryptographic verification here if needed
-            print("Sender's public key loaded for verification.")
+            if verbose:
+                print("Sender's public key loaded for verification.")
         except Exception as e:
             raise ValueError(f"Invalid sender public key: {e}")
 
-    # ECDH key exchange
-    shared_key = private_key.exchange(ec.ECDH(), ephemeral_public_key)
+    # Work out the output path
+    original_filename = encrypted_file_path.rsplit(".enc", 1)[0]
+    name, ext = os.path.splitext(original_filename)
+    decrypted_file_path = f"{name}-decrypted{ext}"
 
-    # Derive AES key
-    aes_key = HKDF(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=None,
-        info=b'handshake data',
-    ).derive(shared_key)
-
-    # Read encrypted file
-    with open(encrypted_file_path, "rb") as f:
-        iv = f.read(16)
-        encrypted_data = f.read()
+    # Legacy progress counts ciphertext bytes; containers switch to the plaintext size
+    reporter = Reporter(max(0, os.path.getsize(encrypted_file_path) - 16), progress, cancel_event)
+    if resumable:
+        _decrypt_resumable(encrypted_file_path, private_key_path, keyring, decrypted_file_path, workers, reporter,
+                           io_backend, fsync)
+        if verbose:
+            print("Decryption successful! File saved as", decrypted_file_path)
+        return decrypted_file_path
 
-    # Decrypt using AES
-    cipher = Cipher(algorithms.AES(aes_key), modes.CBC(iv))
-    decryptor = cipher.decryptor()
-    decrypted_padded_data = decryptor.update(encrypted_data) + decryptor.finalize()
+    total_phase = metrics.span("decrypt_file", "total")
+    with open(encrypted_file_path, "rb") as f, total_phase:
+        chunks = _plaintext_of(f, encrypted_file_path, encrypted_key_path, private_key_path, keyring, chunk_size,
+                               workers, reporter, io_backend)
+        # reporter.total is now the plaintext size of a container, or an upper bound for a legacy file
+        with output.AtomicOutput(decrypted_file_path, reporter.total, fsync) as dst:
+            _write_plaintext(chunks, dst)
+        total_phase.nbytes = reporter.done
 
-    # Remove padding
-    pad_len = decrypted_padded_data[-1]
-    if pad_len < 1 or pad_len > 16:
-        raise ValueError("Invalid padding detected. Decryption failed.")
-    decrypted_data = decrypted_padded_data[:-pad_len]
+    if verbose:
+        print("Decryption successful! File saved as", decrypted_file_path)
+    return decrypted_file_path
 
-    # Save decrypted file
-    original_filename = encrypted_file_path.rsplit(".enc", 1)[0]
-    name, ext = os.path.splitext(original_filename)
-    decrypted_file_path = f"{name}-decrypted{ext}"
-    with open(decrypted_file_path, "wb") as f:
-        f.write(decrypted_data)
+def _decrypt_resumable(encrypted_file_path, private_key_path, keyring, out_path, workers, reporter, io_backend,
+                       fsync=None):
+    """Decrypt a container into out_path through a checkpoint journal (see resume.py)."""
+    import metrics
+    import resume
+
+    run = {"operation": "decrypt_file", "source": resume.source_identity(encrypted_file_path)}
+    journal = resume.Journal(out_path, run)
+    try:
+        total_phase = metrics.span("decrypt_file", "total")
+        with open(encrypted_file_path, "rb") as f, total_phase:
+            _decrypt_container(f, private_key_path, keyring, out_path, workers, reporter, io_backend, journal)
+            total_phase.nbytes = reporter.done
+        journal.finish(fsync)
+    finally:
+        journal.close()
+
+def _decrypted_pieces(encrypted_file_path, private_key_path, keyring, encrypted_key_path, workers, chunk_size, reporter,
+                      io_backend, operation):
+    """Yield the plaintext of an encrypted file as views of reused buffers, timing the whole run as operation."""
+    import metrics
 
-    print("Decryption successful! File saved as", decrypted_file_path)
+    if chunk_size <= 0 or chunk_size % 16:
+        raise ValueError("chunk_size must be a positive multiple of 16 bytes.")
+    io_backend = chunk_io.check_backend(io_backend)
+    total_phase = metrics.span(operation, "total")
+    with open(encrypted_file_path, "rb") as f, total_phase:
+        chunks = _plaintext_of(f, encrypted_file_path, encrypted_key_path, private_key_path, keyring, chunk_size,
+                               workers, reporter, io_backend, operation)
+        for plaintext in chunks:
+            total_phase.nbytes += len(plaintext)
+            yield plaintext
 
+def iter_decrypt(encrypted_file_path, private_key_path=None, keyring=None, encrypted_key_path=None, workers=None,
+                 chunk_size=CHUNK_SIZE, progress=None, cancel_event=None, io_backend=None):
+    """Yield the plaintext of an encrypted file as bytes objects, one per chunk, without writing it to disk.
+
+    Keys are resolved as in decrypt_file (encrypted_key_path is only needed
+    for legacy .enc/.key pairs). Container chunks are only yielded once
+    authenticated; a legacy file's padding is only checked at its end, so a
+    damaged legacy file raises ValueError after most of it was yielded.
+    """
+    reporter = Reporter(max(0, os.path.getsize(encrypted_file_path) - 16), progress, cancel_event)
+    for plaintext in _decrypted_pieces(encrypted_file_path, private_key_path, keyring, encrypted_key_path, workers,
+                                       chunk_size, reporter, io_backend, "iter_decrypt"):
+        yield bytes(plaintext)
+
+def decrypt_to(encrypted_file_path, dst, private_key_path=None, keyring=None, encrypted_key_path=None, workers=None,
+               chunk_size=CHUNK_SIZE, progress=None, cancel_event=None, io_backend=None):
+    """Decrypt an encrypted file into the writable binary stream dst; returns the plaintext size.
+
+    Arguments are as for iter_decrypt. Chunks are written straight from the
+    decryption buffers. dst is flushed but not closed; if decryption fails
+    part way, it has already received the chunks before the bad one.
+    """
+    import metrics
+
+    reporter = Reporter(max(0, os.path.getsize(encrypted_file_path) - 16), progress, cancel_event)
+    write_phase = metrics.accumulator("decrypt_to", "write")
+    write = write_phase.wrap(dst.write)
+    size = 0
+    for plaintext in _decrypted_pieces(encrypted_file_path, private_key_path, keyring, encrypted_key_path, workers,
+                                       chunk_size, reporter, io_backend, "decrypt_to"):
+        write(plaintext)
+        size += len(plaintext)
+    if hasattr(dst, "flush"):
+        dst.flush()
+    write_phase.emit()
+    return size
+
+def decrypt_bytes(encrypted_file_path, private_key_path=None, keyring=None, encrypted_key_path=None, workers=None,
+                  chunk_size=CHUNK_SIZE, progress=None, cancel_event=None, io_backend=None):
+    """Return the whole plaintext of an encrypted file as a bytearray; meant for small payloads.
+
+    Arguments are as for iter_decrypt. The bytearray is allocated once from
+    the plaintext size in the container header (the ciphertext size for
+    legacy files, trimmed at the end) and filled chunk by chunk.
+    """
+    reporter = Reporter(max(0, os.path.getsize(encrypted_file_path) - 16), progress, cancel_event)
+    chunks = _decrypted_pieces(encrypted_file_path, private_key_path, keyring, encrypted_key_path, workers, chunk_size,
+                               reporter, io_backend, "decrypt_bytes")
+    plaintext = bytearray()
+    size = 0
+    for piece in chunks:
+        if not size:
+            # The header has been read by now, so reporter.total is the expected size (0 for streamed containers)
+            plaintext = bytearray(max(reporter.total, len(piece)))
+        # Past the preallocated end (streamed containers), slice assignment appends
+        plaintext[size:size + len(piece)] = piece
+        size += len(piece)
+    del plaintext[size:]
+    return plaintext
+
+def verify_file(encrypted_file_path, private_key_path=None, keyring=None, workers=None, io_backend=None):
+    """Authenticate every chunk of a container without writing any plaintext.
+
+    Returns the plaintext size on success and raises ValueError naming the first
+    chunk that fails. The private key is resolved as in decrypt_file.
+    """
+    with open(encrypted_file_path, "rb") as f:
+        header, chunk_cipher = open_container(f, private_key_path, keyring, "verify_file")
+        size = 0
+        for plaintext in _iter_plaintext(f, header, chunk_cipher, workers, io_backend=io_backend, operation="verify_file"):
+            size += len(plaintext)
+        if f.read(1):
+            raise ValueError("Unexpected data after the last chunk.")
+    return size
@@ -1,40 +1,334 @@
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.primitives import serialization, hashes
-from cryptography.hazmat.primitives.kdf.hkdf import HKDF
-from cryptography.hazmat.primitives.asymmetric import ec
 import os
+import chunk_io
+import container
+from progress import Reporter
 
-def encrypt_file(file_path, public_key_str):
-    """Encrypt file using ECDH for key exchange and AES for data encryption."""
-    # Reconstruct PEM format from base64 key content
-    public_key_pem = '-----BEGIN PUBLIC KEY-----\n' + '\n'.join([public_key_str[i:i+64] for i in range(0, len(public_key_str), 64)]) + '\n-----END PUBLIC KEY-----\n'
-    public_key = serialization.load_pem_public_key(public_key_pem.encode())
+# Everything else is imported inside the functions that need it, so that
+# importing this module (e.g. for a one-file CLI run) stays quick
+
+def _stream_encrypt(encryptor, in_path, out_path, iv, chunk_size, reporter, fsync=None):
+    """Encrypt in_path into out_path block by block, applying PKCS7 padding to the tail.
+
+    Peak memory is two buffers of roughly chunk_size bytes, whatever the file size.
+    """
+    import metrics
+    import output
+
+    in_buf = bytearray(chunk_size + 16)  # room for up to one block of padding
+    out_buf = bytearray(chunk_size + 32)  # update_into needs len(data) + 15 bytes
+    in_view = memoryview(in_buf)
+    out_view = memoryview(out_buf)
+    phases = [metrics.accumulator("encrypt_file", phase) for phase in ("read", "aes", "write")]
+    read_phase, aes_phase, write_phase = phases
+    update_into = aes_phase.wrap(encryptor.update_into)
+
+    # IV, then the plaintext padded up to the next whole block
+    out_size = 16 + (reporter.total // 16 + 1) * 16
+    with open(in_path, "rb") as src, output.AtomicOutput(out_path, out_size, fsync) as dst:
+        readinto = read_phase.wrap(src.readinto)
+        write = write_phase.wrap(dst.write)
+        write(iv)
+        while True:
+            n = readinto(in_view[:chunk_size])
+            if n == chunk_size:
+                written = update_into(in_view[:n], out_buf)
+                write(out_view[:written])
+                reporter.advance(n)
+                continue
+
+            # Last (possibly empty) block: pad it and flush the cipher
+            pad_len = 16 - (n % 16)
+            in_view[n:n + pad_len] = bytes([pad_len] * pad_len)
+            written = update_into(in_view[:n + pad_len], out_buf)
+            write(out_view[:written])
+            write(encryptor.finalize())
+            reporter.advance(n)
+            break
+    for phase in phases:
+        phase.emit()
+
+def _new_header(public_keys, chunk_size, plaintext_size, codec, flags, operation, chunks=None,
+                cipher_id=container.CIPHER_AES_256_GCM):
+    """Draw a content key and return (header wrapping it for every recipient, content key).
+
+    public_keys may also be a session.EncryptionSession, whose ephemeral key
+    and ECDH secrets are then reused; only the salt and content key are new.
+    """
+    from cryptography.hazmat.primitives.asymmetric import ec
+
+    import metrics
+    import session
+
+    salt = container.new_salt()
+    content_key = container.new_content_key()
+    hkdf_phase = metrics.accumulator(operation, "hkdf")
+    wrap_content_key = hkdf_phase.wrap(container.wrap_content_key, count_bytes=False)
+    if isinstance(public_keys, session.EncryptionSession):
+        ephemeral_public_bytes = public_keys.ephemeral_public_bytes
+        wrapped_keys = [
+            wrap_content_key(content_key, shared_key, salt, public_key)
+            for public_key, shared_key in zip(public_keys.public_keys, public_keys.shared_keys)
+        ]
+    else:
+        # One ephemeral key for the file; one ECDH exchange per recipient
+        with metrics.span(operation, "keygen"):
+            ephemeral_private_key = ec.generate_private_key(container.CURVE)
+        ephemeral_public_bytes = container.compress_public_key(ephemeral_private_key.public_key())
+        ecdh_phase = metrics.accumulator(operation, "ecdh")
+        exchange = ecdh_phase.wrap(ephemeral_private_key.exchange, count_bytes=False)
+        wrapped_keys = [
+            wrap_content_key(content_key, exchange(ec.ECDH(), public_key), salt, public_key)
+            for public_key in public_keys
+        ]
+        ecdh_phase.emit()
+    hkdf_phase.emit()
+
+    header = container.ContainerHeader(
+        chunk_size,
+        plaintext_size,
+        salt,
+        ephemeral_public_bytes,
+        wrapped_keys,
+        chunks=chunks,
+        cipher_id=cipher_id,
+        codec=codec,
+        flags=flags,
+    )
+    return header, content_key
+
+def _encrypt_container(file_path, out_path, public_keys, chunk_size, workers, reporter, io_backend=None,
+                       codec=None, level=None, journal=None, cipher_id=container.CIPHER_AES_256_GCM,
+                       fsync=None):
+    """Write file_path to out_path as a single-file container (see container.py)."""
+    with open(file_path, "rb") as src:
+        write_container(src, os.path.getsize(file_path), out_path, public_keys, chunk_size, workers, reporter,
+                        io_backend, codec, level, journal=journal, cipher_id=cipher_id, fsync=fsync)
+
+def _resume_header(journal):
+    """Return (header, content key) saved in an encryption journal, or (None, None)."""
+    if journal is None or not journal.resumed:
+        return None, None
+    import io
+
+    state = journal.state
+    header = container.ContainerHeader.read(io.BytesIO(bytes.fromhex(state["header"])))
+    for index, (stored_len, digest) in enumerate(journal.chunks):
+        header.chunks[index] = (header.chunks[index][0], stored_len)
+        if digest is not None:
+            header.chunk_hashes[index] = bytes.fromhex(digest)
+    return header, bytes.fromhex(state["content_key"])
+
+def write_container(src, plaintext_size, out_path, public_keys, chunk_size, workers, reporter, io_backend=None,
+                    codec=None, level=None, flags=0, operation="encrypt_file", chunk_hashes=True,
+                    journal=None, cipher_id=container.CIPHER_AES_256_GCM, fsync=None):
+    """Encrypt plaintext_size bytes read from the binary file object src into a container at out_path.
+
+    Chunks are read through chunk_io and sealed into a ring of reusable output
+    buffers, which are written out as they are; nothing is allocated per chunk.
+    With a compression codec (None: none), each chunk is compressed first; as the stored
+    sizes are only known afterwards, the chunk table is rewritten at the end.
+    With chunk_hashes, every sealed chunk is also hashed for keyless scrubbing
+    (see integrity.py), and the hashes and their Merkle root go in that final
+    header. src must hold exactly plaintext_size bytes. Chunks are sealed with
+    the engine cipher_id (see engines.py).
+
+    The container is written to a preallocated temp file that replaces
+    out_path once complete, made durable as the fsync policy says (see
+    output.py); out_path is untouched if encryption fails.
+
+    With a resume.Journal, the container is written to the journal's .part
+    file (out_path is then unused), progress is checkpointed as it goes, and
+    a run the journal says was interrupted carries on after its last
+    checkpoint with the same header and content key; src must be seekable.
+    """
+    import compression
+    import metrics
+    import output
+    import parallel
+    import pipeline
+
+    if codec is None:
+        codec = compression.CODEC_NONE
+    if chunk_hashes:
+        flags |= container.FLAG_CHUNK_HASHES
+    header, content_key = _resume_header(journal)
+    if header is None:
+        header, content_key = _new_header(public_keys, chunk_size, plaintext_size, codec, flags, operation,
+                                          cipher_id=cipher_id)
+        header.chunk_hashes = [bytes(container.HASH_SIZE)] * header.chunk_count if chunk_hashes else []
+        if journal is not None:
+            journal.begin({"header": header.pack().hex(), "content_key": content_key.hex()})
+    else:
+        journal.begin()
+    chunk_cipher = container.ChunkCipher(content_key, header)
+    start = journal.done if journal is not None else 0
+
+    # Ring buffers are sized for the pipeline's chunks in flight; the budget may grant fewer workers
+    workers = parallel.workers_for(header.chunk_count, workers)
+    max_plain_len = max((plain_len for plain_len, _ in header.chunks), default=0)
+    stages = pipeline.Pipeline(workers, 2 * max_plain_len + container.TAG_SIZE, operation,
+                               inline=header.chunk_count - start <= 1)
+    phases = [metrics.accumulator(operation, phase) for phase in ("read", "compress", "aes", "hash", "write")]
+    read_phase, compress_phase, aes_phase, hash_phase, write_phase = phases
+    compress_chunk = compress_phase.wrap(compression.compress_chunk)
+    seal_into = aes_phase.wrap(chunk_cipher.seal_into)
+    chunk_digest = hash_phase.wrap(container.chunk_digest, count_bytes=False)
+
+    def read_chunks(src, slots):
+        lengths = [plain_len for plain_len, _ in header.chunks]
+        chunks = read_phase.iterate(chunk_io.iter_chunks(src, lengths[start:], io_backend, slots))
+        for index, data in enumerate(chunks, start):
+            reporter.check()
+            if len(data) != lengths[index]:
+                raise ValueError("File changed size during encryption.")
+            yield index, data
+
+    def seal(item):
+        index, data = item
+        if codec != compression.CODEC_NONE:
+            data = compress_chunk(codec, data, level)
+            header.chunks[index] = (header.chunks[index][0], len(data) + container.TAG_SIZE)
+        sealed = seal_into(index, data, sealed_buffers.get(index, len(data) + container.TAG_SIZE))
+        if chunk_hashes:
+            header.chunk_hashes[index] = chunk_digest(sealed)
+        return sealed
+
+    if journal is None:
+        # Compressed chunks only shrink, so this is exact without compression and an upper bound with it
+        out_file = output.AtomicOutput(out_path, header.size + plaintext_size + header.chunk_count * container.TAG_SIZE,
+                                       fsync)
+    else:
+        out_file = journal.open_output()
+    with stages, out_file as dst:
+        sealed_buffers = chunk_io.BufferRing(stages.slots, max_plain_len + container.TAG_SIZE)
+        write = write_phase.wrap(dst.write)
+        if start:
+            # Pick up after the last checkpoint
+            src.seek(sum(plain_len for plain_len, _ in header.chunks[:start]))
+            reporter.done = src.tell()
+        else:
+            write(header.pack())
+        # Chunks are read, sealed on the worker pool and written back in order
+        for index, sealed in enumerate(stages.run(seal, read_chunks(src, stages.slots)), start):
+            write(sealed)
+            if journal is not None:
+                digest = header.chunk_hashes[index].hex() if chunk_hashes else None
+                journal.record(dst, header.chunks[index][0], dst.tell(), (len(sealed), digest))
+            reporter.advance(header.chunks[index][0])
+        if src.read(1):
+            raise ValueError("File changed size during encryption.")
+        if chunk_hashes:
+            header.merkle_root = container.merkle_root(header.chunk_hashes)
+        if codec != compression.CODEC_NONE or chunk_hashes:
+            # Same size as the provisional header; only stored chunk lengths and hashes changed
+            dst.seek(0)
+            write(header.pack())
+        if journal is not None:
+            journal.checkpoint(dst)
+    for phase in phases:
+        phase.emit()
+
+def write_stream_container(src, dst, public_keys, chunk_size, workers, reporter, codec=None, level=None,
+                           operation="encrypt_stream", cipher_id=container.CIPHER_AES_256_GCM):
+    """Encrypt everything read from the binary stream src into a FLAG_STREAM container written to dst.
+
+    Neither stream has to be seekable and the input size need not be known:
+    each chunk goes out with its frame as soon as it is sealed. At most a few
+    chunks are held in memory. Returns the number of plaintext bytes.
+    """
+    import compression
+    import metrics
+    import parallel
+    import pipeline
+
+    if codec is None:
+        codec = compression.CODEC_NONE
+    header, content_key = _new_header(public_keys, chunk_size, 0, codec, container.FLAG_STREAM, operation, chunks=[],
+                                      cipher_id=cipher_id)
+    chunk_cipher = container.ChunkCipher(content_key, header)
+
+    # The reader holds one chunk more than usual: the one read ahead to spot the end
+    workers = workers or parallel.default_workers()
+    stages = pipeline.Pipeline(workers, 2 * chunk_size + container.TAG_SIZE, operation, extra_slots=1)
+    phases = [metrics.accumulator(operation, phase) for phase in ("read", "compress", "aes", "write")]
+    read_phase, compress_phase, aes_phase, write_phase = phases
+    read_full = read_phase.wrap(chunk_io.read_full)
+    compress_chunk = compress_phase.wrap(compression.compress_chunk)
+    seal_into = aes_phase.wrap(chunk_cipher.seal_into)
+
+    def read_chunks():
+        # A chunk is known to be the last one once the next read comes back empty
+        index = 0
+        data = plain_buffers.get(0, chunk_size)
+        data = data[:read_full(src, data)]
+        while True:
+            reporter.check()
+            if len(data) < chunk_size:
+                yield index, data, True
+                return
+            following = plain_buffers.get(index + 1, chunk_size)
+            following = following[:read_full(src, following)]
+            if not following:
+                yield index, data, True
+                return
+            yield index, data, False
+            index += 1
+            data = following
+
+    def seal(item):
+        index, data, last = item
+        plain_len = len(data)
+        if codec != compression.CODEC_NONE:
+            data = compress_chunk(codec, data, level)
+        sealed = seal_into(index, data, sealed_buffers.get(index, len(data) + container.TAG_SIZE), last)
+        return container.pack_frame(plain_len, len(sealed), last), sealed, plain_len
+
+    with stages:
+        plain_buffers = chunk_io.BufferRing(stages.slots, chunk_size)
+        sealed_buffers = chunk_io.BufferRing(stages.slots, chunk_size + container.TAG_SIZE)
+        write = write_phase.wrap(dst.write)
+        write(header.pack())
+        # Chunks are read, sealed on the worker pool and written back in order
+        for frame, sealed, plain_len in stages.run(seal, read_chunks()):
+            write(frame)
+            write(sealed)
+            reporter.advance(plain_len)
+        if hasattr(dst, "flush"):
+            dst.flush()
+    for phase in phases:
+        phase.emit()
+    return reporter.done
+
+def _encrypt_legacy(file_path, public_key, chunk_size, reporter, fsync=None):
+    """Write the legacy <file>.enc (IV + AES-CBC stream) and <file>.key (ephemeral PEM) pair."""
+    # Legacy-only primitives are imported here to keep the default path quick to start
+    from cryptography.hazmat.primitives import serialization, hashes
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+    import engines
+    import metrics
+    import output
 
     # Generate ephemeral private key
-    ephemeral_private_key = ec.generate_private_key(ec.SECP384R1())
-    shared_key = ephemeral_private_key.exchange(ec.ECDH(), public_key)
+    with metrics.span("encrypt_file", "keygen"):
+        ephemeral_private_key = ec.generate_private_key(ec.SECP384R1())
+    with metrics.span("encrypt_file", "ecdh"):
+        shared_key = ephemeral_private_key.exchange(ec.ECDH(), public_key)
 
     # Derive AES key
-    aes_key = HKDF(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=None,
-        info=b'handshake data',
-    ).derive(shared_key)
-
-    # Read file data
-    with open(file_path, "rb") as f:
-        file_data = f.read()
-
-    # Encrypt with AES (CBC)
-    iv = os.urandom(16)
-    cipher = Cipher(algorithms.AES(aes_key), modes.CBC(iv))
-    encryptor = cipher.encryptor()
+    with metrics.span("encrypt_file", "hkdf"):
+        aes_key = HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=None,
+            info=b'handshake data',
+        ).derive(shared_key)
 
-    # Pad file data
-    pad_len = 16 - (len(file_data) % 16)
-    padded_data = file_data + bytes([pad_len] * pad_len)
-    encrypted_data = encryptor.update(padded_data) + encryptor.finalize()
+    # Encrypt with AES (CBC), streaming fixed-size blocks through reusable buffers
+    iv = os.urandom(16)
+    encryptor = engines.legacy_cbc(aes_key, iv).encryptor()
+    _stream_encrypt(encryptor, file_path, file_path + ".enc", iv, chunk_size, reporter, fsync)
 
     # Save ephemeral public key
     ephemeral_public_pem = (
@@ -43,11 +337,149 @@ def encrypt_file(file_path, public_key_str):
             format=serialization.PublicFormat.SubjectPublicKeyInfo,
         )
     )
-    with open(file_path + ".key", "wb") as f:
+    with output.AtomicOutput(file_path + ".key", len(ephemeral_public_pem), fsync) as f:
         f.write(ephemeral_public_pem)
 
-    # Save encrypted file
-    with open(file_path + ".enc", "wb") as f:
-        f.write(iv + encrypted_data)
+def _encrypt_resumable(file_path, public_keys, chunk_size, workers, reporter, io_backend, codec, level, cipher_id,
+                       fsync=None):
+    """Encrypt file_path to <file>.enc through a checkpoint journal (see resume.py)."""
+    import metrics
+    import resume
+    import session
+
+    recipients = public_keys.public_keys if isinstance(public_keys, session.EncryptionSession) else public_keys
+    run = {
+        "operation": "encrypt_file",
+        "source": resume.source_identity(file_path),
+        "chunk_size": chunk_size,
+        "codec": codec,
+        "level": level,
+        "cipher": cipher_id,
+        "recipients": [container.key_id(public_key).hex() for public_key in recipients],
+    }
+    journal = resume.Journal(file_path + ".enc", run)
+    try:
+        with metrics.span("encrypt_file", "total", reporter.total):
+            _encrypt_container(file_path, None, public_keys, chunk_size, workers, reporter, io_backend, codec, level,
+                               journal, cipher_id)
+        journal.finish(fsync)
+    finally:
+        journal.close()
+
+def load_public_key(public_key_str):
+    """Parse a recipient public key given as the base64 body of a PEM file.
+
+    Parsed keys are cached, so encrypting many files for one recipient parses it once.
+    """
+    import key_ring
+
+    return key_ring.parse_public_key(public_key_str.strip())
+
+def open_session(public_key_str):
+    """Start an encryption session for one recipient key or a list of them (see session.py).
+
+    Example:
+        batch = open_session(recipient_key)
+        for path in paths:
+            encrypt_file(path, batch)
+    """
+    import metrics
+    import session
+
+    recipients = public_key_str if isinstance(public_key_str, (list, tuple)) else [public_key_str]
+    with metrics.span("encrypt_file", "load_key"):
+        public_keys = [load_public_key(key) if isinstance(key, str) else key for key in recipients]
+    return session.EncryptionSession(public_keys)
+
+def encrypt_file(file_path, public_key_str, chunk_size=container.DEFAULT_CHUNK_SIZE, legacy=False, workers=None, verbose=True,
+                 progress=None, cancel_event=None, io_backend=None, compress=None, compress_level=None,
+                 resumable=False, cipher=None, fsync=None):
+    """Encrypt file using ECDH for key exchange and AES for data encryption.
+
+    By default a single <file>.enc container is written. With legacy=True the old
+    <file>.enc/<file>.key pair is produced instead, e.g. for the Remote upload flow.
+    The file is streamed in chunk_size blocks, so memory use does not grow with file size.
+    Container chunks are encrypted on `workers` threads (default: one per CPU core);
+    legacy CBC output is inherently serial.
+
+    public_key_str may also be a key already parsed with load_public_key(), which
+    lets callers encrypting many files for one recipient parse it only once, or a
+    list of keys: the data is then encrypted once and readable by every recipient.
+    For many small files, pass a session.EncryptionSession (see open_session())
+    instead, so the whole batch shares one ephemeral key and ECDH exchange.
+
+    progress(bytes_done, bytes_total) is called after every chunk; setting
+    cancel_event stops the run, removes the partial output and raises
+    progress.OperationCancelled.
+
+    Output is written to a preallocated temp file and renamed into place once
+    complete, so a failed or interrupted run leaves any earlier <file>.enc as
+    it was. fsync is "file" (default) or "never", or an
+    output.FsyncBatch the caller flushes (see output.py).
+
+    io_backend selects how container input is read (see chunk_io.BACKENDS).
+    Phase timings go to the exporter installed with metrics.set_exporter().
+
+    compress ("zlib" or "lzma") compresses each container chunk before it is
+    encrypted; chunks that do not shrink are stored as they are. decrypt_file
+    decompresses transparently.
+
+    With resumable=True the container is written to <file>.enc.part with a
+    checkpoint journal (see resume.py), and only renamed to <file>.enc once
+    complete. If the run is killed or cancelled both are kept, and calling
+    encrypt_file again with the same arguments continues from the last
+    checkpoint.
+
+    cipher names the chunk engine: "aes-256-gcm" (default), "chacha20-poly1305",
+    or "auto" for the fastest one on this machine (see engines.py).
+    """
+    import compression
+    import engines
+    import metrics
+    import output
+    import session
+
+    if chunk_size <= 0 or chunk_size % 16:
+        raise ValueError("chunk_size must be a positive multiple of 16 bytes.")
+    io_backend = chunk_io.check_backend(io_backend)
+    codec = compression.codec_id(compress)
+    if legacy and codec != compression.CODEC_NONE:
+        raise ValueError("Legacy .enc/.key output cannot be compressed.")
+    if legacy and resumable:
+        raise ValueError("Legacy .enc/.key output cannot be resumed.")
+    if legacy and cipher is not None:
+        raise ValueError("Legacy .enc/.key output is always AES-256-CBC.")
+    cipher_id = engines.engine_id(None if legacy else cipher)
+    fsync = output.check_fsync(fsync)
+
+    if isinstance(public_key_str, session.EncryptionSession):
+        if legacy:
+            raise ValueError("Legacy .enc/.key output cannot use an encryption session.")
+        public_keys = public_key_str
+    else:
+        recipients = public_key_str if isinstance(public_key_str, (list, tuple)) else [public_key_str]
+        if not recipients:
+            raise ValueError("At least one recipient public key is required.")
+        with metrics.span("encrypt_file", "load_key"):
+            public_keys = [load_public_key(key) if isinstance(key, str) else key for key in recipients]
+
+    if legacy and len(public_keys) != 1:
+        raise ValueError("Legacy .enc/.key output supports a single recipient only.")
+
+    reporter = Reporter(os.path.getsize(file_path), progress, cancel_event)
+    if resumable:
+        _encrypt_resumable(file_path, public_keys, chunk_size, workers, reporter, io_backend, codec, compress_level,
+                           cipher_id, fsync)
+        if verbose:
+            print("Encryption successful!")
+        return
+
+    with metrics.span("encrypt_file", "total", reporter.total):
+        if legacy:
+            _encrypt_legacy(file_path, public_keys[0], chunk_size, reporter, fsync)
+        else:
+            _encrypt_container(file_path, file_path + ".enc", public_keys, chunk_size, workers, reporter, io_backend,
+                               codec, compress_level, cipher_id=cipher_id, fsync=fsync)
 
-    print("Encryption successful!")
\ No newline at end of file
+    if verbose:
+        print("Encryption successful!")
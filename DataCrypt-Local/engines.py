@@ -0,0 +1,145 @@
+"""Cipher engines for container chunks, and picking the fastest one for this machine.
+
+A container's chunks (and its table seal) are sealed with one AEAD engine,
+recorded by id in the header and so authenticated with every chunk:
+
+    aes-256-gcm         the default; fastest wherever the CPU has AES instructions
+    chacha20-poly1305   several times faster than AES-GCM on CPUs without them
+
+Both take a 32-byte key, a 12-byte nonce and add a 16-byte tag, so the format
+is otherwise identical. Content keys are always wrapped with AES-256-GCM:
+that is a few dozen bytes per recipient. Containers written with ChaCha20 can
+only be read by DataCrypt versions that know the engine.
+
+aes-256-cbc is the engine of legacy .enc/.key pairs. It has no container id
+and cannot be chosen for containers; legacy_cbc() builds it for the legacy
+paths of encryptor.py and decryptor.py.
+
+The engine name "auto" runs a short benchmark of the authenticated engines on
+first use (see select_engine) and caches the winner on disk, next to the keys.
+"""
+import os
+import time
+
+CIPHER_AES_256_GCM = 1
+CIPHER_CHACHA20_POLY1305 = 2
+
+ENGINES = {"aes-256-gcm": CIPHER_AES_256_GCM, "chacha20-poly1305": CIPHER_CHACHA20_POLY1305}
+DEFAULT_ENGINE = "aes-256-gcm"
+LEGACY_ENGINE = "aes-256-cbc"
+AUTO = "auto"
+
+# Benchmark: BENCH_ROUNDS seals of BENCH_SIZE bytes per engine, a few ms in all on current hardware
+BENCH_SIZE = 256 * 1024
+BENCH_ROUNDS = 8
+BENCH_CACHE_NAME = "engine-benchmark.json"
+
+
+def engine_id(name):
+    """Return the header id of an engine name (None: the default; "auto": the fastest here)."""
+    if name is None:
+        return ENGINES[DEFAULT_ENGINE]
+    if name == AUTO:
+        return ENGINES[select_engine()]
+    if name == LEGACY_ENGINE:
+        raise ValueError("aes-256-cbc is only supported for reading legacy .enc/.key files.")
+    try:
+        return ENGINES[name]
+    except KeyError:
+        choices = ", ".join(list(ENGINES) + [AUTO])
+        raise ValueError(f"Unknown cipher engine: {name} (choose from {choices})")
+
+
+def engine_name(cipher_id):
+    for name, known_id in ENGINES.items():
+        if known_id == cipher_id:
+            return name
+    raise ValueError(f"Unsupported cipher id: {cipher_id}")
+
+
+def aead(cipher_id, key):
+    """Return the AEAD object of engine cipher_id under key."""
+    if cipher_id == CIPHER_AES_256_GCM:
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+        return AESGCM(key)
+    if cipher_id == CIPHER_CHACHA20_POLY1305:
+        # Imported on first use: most containers are AES-GCM
+        from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+
+        return ChaCha20Poly1305(key)
+    raise ValueError(f"Unsupported cipher id: {cipher_id}")
+
+
+def legacy_cbc(key, iv):
+    """Return the AES-256-CBC Cipher of legacy .enc/.key pairs (unauthenticated; PKCS7 is up to the caller)."""
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+    return Cipher(algorithms.AES(key), modes.CBC(iv))
+
+
+def benchmark(size=BENCH_SIZE, rounds=BENCH_ROUNDS):
+    """Return {engine name: bytes sealed per second} for every container engine on this machine."""
+    data = bytes(size)
+    nonce = bytes(12)
+    rates = {}
+    for name, cipher_id in ENGINES.items():
+        engine = aead(cipher_id, os.urandom(32))
+        engine.encrypt(nonce, data, None)  # warm-up
+        best = None
+        for _ in range(rounds):
+            start = time.perf_counter()
+            engine.encrypt(nonce, data, None)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None or elapsed < best else best
+        rates[name] = size / best if best > 0 else float("inf")
+    return rates
+
+
+def _machine():
+    """What a cached benchmark result depends on: the host, its CPU and the crypto library."""
+    import platform
+
+    import cryptography
+
+    return {"node": platform.node(), "machine": platform.machine(), "processor": platform.processor(),
+            "cryptography": cryptography.__version__}
+
+
+def bench_cache_path():
+    import key_manager
+
+    return os.path.join(key_manager.KEY_DIR, BENCH_CACHE_NAME)
+
+
+def select_engine(cache_path=None, refresh=False):
+    """Return the name of the fastest authenticated engine on this machine.
+
+    The result is cached in cache_path (default: KEY_DIR/engine-benchmark.json)
+    and reused until the host, CPU or cryptography version changes, or
+    refresh is set.
+    """
+    import json
+
+    cache_path = cache_path or bench_cache_path()
+    machine = _machine()
+    if not refresh:
+        try:
+            with open(cache_path, "r") as f:
+                cached = json.load(f)
+            if cached.get("machine") == machine and cached.get("engine") in ENGINES:
+                return cached["engine"]
+        except (OSError, ValueError, AttributeError):
+            pass
+    rates = benchmark()
+    engine = max(rates, key=rates.get)
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"machine": machine, "engine": engine, "rates": rates}, f)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # A read-only key directory only costs a benchmark per run
+        pass
+    return engine
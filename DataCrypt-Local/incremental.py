@@ -0,0 +1,352 @@
+"""Incremental re-encryption: only chunks whose content changed are encrypted again.
+
+The file is split at content-defined boundaries (see iter_content_chunks), so an
+insert or delete moves only the boundaries next to it. A manifest kept per
+file records, for every chunk of the last encryption, its SHA-256, where its
+ciphertext lives in the previous .enc, its nonce and the hash of its
+ciphertext. On the next run, chunks
+with a known hash are copied from the previous .enc as they are (see
+chunk_io.copy_range) and only the others are compressed and sealed.
+
+What is saved is the encryption work, not disk writes: every run assembles a
+complete new output and renames it over the old one. On reflink file systems
+(btrfs, XFS) the copied chunks share the previous output's blocks, so the data
+written grows with the change; elsewhere the whole output is written each run.
+
+The output is a FLAG_REUSABLE_CHUNKS container with chunk hashes (see
+container.py), readable by decrypt_file and the random-access reader, and
+checked by integrity.py, like any other. Reusing ciphertext
+means reusing the content key, so the manifest holds it: manifests are written
+with owner-only permissions under KEY_DIR/manifests, next to the private keys.
+A new content key is drawn whenever the recipients, codec or chunking change,
+the previous .enc is not the one the manifest describes, or full=True.
+
+Chunks are sealed through a pipeline.Pipeline, so --max-memory covers them;
+the READ_SIZE block that chunking scans comes on top.
+"""
+import hashlib
+import json
+import operator
+import os
+
+import chunk_io
+import compression
+import container
+import key_ring
+import metrics
+import parallel
+import pipeline
+from progress import Reporter
+
+# Version 2 manifests had no ciphertext hashes; such files are encrypted in full once
+MANIFEST_VERSION = 3
+AVERAGE_CHUNK_SIZE = 256 * 1024
+READ_SIZE = 8 * 1024 * 1024
+# Content-defined chunking (see iter_content_chunks)
+GEAR_WINDOW = 32
+GEAR_BITS = 32
+_GEAR_MAX = (1 << GEAR_BITS) - 1
+ANCHOR = b"\x00\x01\x02\x03"
+NORMALIZATION = 2  # mask bits added before the average chunk size and dropped after it
+# Chunk nonces are random; draw a new content key long before 96-bit collisions matter
+MAX_NONCES_PER_KEY = 1 << 28
+
+
+def _gear_tables():
+    """Return the Gear table, shifted once per window position, and the anchor symbol of every byte value.
+
+    Both are derived from SHA-256 so that they never change: chunk boundaries,
+    and with them what a manifest can reuse, depend on them.
+    """
+    digests = [hashlib.sha256(b"datacrypt-gear" + bytes([value])).digest() for value in range(256)]
+    gear = [int.from_bytes(digest[:4], "big") for digest in digests]
+    shifted = [[(value << lag) & _GEAR_MAX for value in gear] for lag in range(GEAR_WINDOW)]
+    symbols = bytes(digest[4] & 3 for digest in digests)
+    return shifted, symbols
+
+
+def _gear_mask(bits):
+    """A mask of the top bits of a Gear fingerprint, which depend on the most bytes of the window."""
+    bits = max(0, min(bits, GEAR_BITS))
+    return ((1 << bits) - 1) << (GEAR_BITS - bits)
+
+
+_GEAR_SHIFTED, _ANCHOR_SYMBOLS = _gear_tables()
+
+
+def iter_content_chunks(f, average=AVERAGE_CHUNK_SIZE, minimum=None, maximum=None, read_size=READ_SIZE):
+    """Yield the content of f in chunks whose boundaries depend only on the content, byte by byte.
+
+    Chunking follows FastCDC: a boundary goes where the Gear fingerprint of
+    the GEAR_WINDOW bytes before it has its masked bits clear; nothing is cut
+    in the first `minimum` bytes of a chunk, a stricter mask applies before
+    `average` bytes and a looser one after it (which keeps chunk sizes close
+    to `average`), and a chunk is cut at `maximum` bytes regardless. As a
+    fingerprint costs a Python loop, it is only taken at anchors: the ends of
+    a fixed ANCHOR pattern in the bytes mapped to 2-bit symbols, found with
+    translate and find, about one every 256 bytes of varied data. A boundary
+    thus depends only on the GEAR_WINDOW bytes before it, so an insert or
+    delete moves only the boundaries next to it, in text and binary data
+    alike. An empty file yields one empty chunk.
+    """
+    minimum = average // 4 if minimum is None else minimum
+    maximum = average * 4 if maximum is None else maximum
+    # The fingerprint window must lie within the chunk, so that chunking does not depend on the reads
+    minimum = max(minimum, GEAR_WINDOW)
+    maximum = max(maximum, minimum)
+    # Anchors already select one position in 4 ** len(ANCHOR); the mask supplies the remaining bits
+    bits = max(0, average.bit_length() - 1 - 2 * len(ANCHOR))
+    strict, loose = _gear_mask(bits + NORMALIZATION), _gear_mask(bits - NORMALIZATION)
+    shifted = _GEAR_SHIFTED
+    getitem = operator.getitem
+    pending = bytearray()
+    yielded = False
+    eof = False
+    while not eof:
+        block = f.read(read_size)
+        eof = not block
+        pending += block
+        find = pending.translate(_ANCHOR_SYMBOLS).find
+        start = 0
+        while True:
+            end = min(len(pending), start + maximum)
+            cut = None
+            anchor = find(ANCHOR, start + minimum - len(ANCHOR), end)
+            while anchor >= 0:
+                pos = anchor + len(ANCHOR)
+                window = pending[pos - GEAR_WINDOW:pos]
+                window.reverse()
+                # Gear: the byte i places back is shifted left i times
+                if not sum(map(getitem, shifted, window)) & (strict if pos - start < average else loose):
+                    cut = pos
+                    break
+                anchor = find(ANCHOR, anchor + 1, end)
+            if cut is None:
+                if end - start < maximum and not eof:
+                    # A boundary may still come with the next block
+                    break
+                if end == start:
+                    break
+                cut = end
+            yield bytes(pending[start:cut])
+            yielded = True
+            start = cut
+        del pending[:start]
+    if not yielded:
+        yield b""
+
+
+def manifest_path_for(file_path, manifest_dir=None):
+    """Default manifest location of file_path: KEY_DIR/manifests/<hash of its absolute path>.json."""
+    if manifest_dir is None:
+        import key_manager
+
+        manifest_dir = os.path.join(key_manager.KEY_DIR, "manifests")
+    digest = hashlib.sha256(os.path.abspath(file_path).encode()).hexdigest()[:32]
+    return os.path.join(manifest_dir, digest + ".json")
+
+
+def load_manifest(path):
+    """Return the manifest stored at path, or None if there is none (or it is unreadable)."""
+    try:
+        with open(path, "r") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def _save_manifest(path, manifest, fsync=None):
+    import output
+
+    # Owner-only: the manifest holds the content key
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    with output.AtomicOutput(path, fsync=fsync, mode=0o600) as f:
+        f.write(json.dumps(manifest).encode())
+
+
+def _reusable(manifest, out_path, recipient_ids, codec, average):
+    """Return True if the chunks listed in manifest can be taken from out_path."""
+    if manifest is None:
+        return False
+    try:
+        st = os.stat(out_path)
+    except OSError:
+        return False
+    return (
+        manifest["output"] == os.path.abspath(out_path)
+        and manifest["output_size"] == st.st_size
+        and manifest["output_mtime_ns"] == st.st_mtime_ns
+        and manifest["recipients"] == recipient_ids
+        and manifest["codec"] == codec
+        and manifest["average_chunk_size"] == average
+        and manifest["nonces_used"] < MAX_NONCES_PER_KEY
+    )
+
+
+def encrypt_incremental(file_path, public_key_str, out_path=None, manifest_path=None, average_chunk_size=AVERAGE_CHUNK_SIZE,
+                        compress=None, workers=None, full=False, verbose=True, progress=None, cancel_event=None,
+                        fsync=None):
+    """Encrypt file_path into out_path (default <file>.enc), re-encrypting only changed chunks.
+
+    public_key_str is a recipient key or a list of them, as for encrypt_file.
+    The previous output is replaced atomically, and only once the new one is
+    complete, so the whole output is rewritten every run: only on reflink
+    file systems do the reused chunks cost no writes; fsync is the output's and manifest's fsync policy (see
+    output.py). Returns a dict with the number of chunks and bytes that were
+    reused and newly encrypted.
+    """
+    import encryptor
+    import output
+    from cryptography.hazmat.primitives.asymmetric import ec
+
+    recipients = public_key_str if isinstance(public_key_str, (list, tuple)) else [public_key_str]
+    if not recipients:
+        raise ValueError("At least one recipient public key is required.")
+    public_keys = [encryptor.load_public_key(key) if isinstance(key, str) else key for key in recipients]
+    recipient_ids = sorted(key_ring.fingerprint(key) for key in public_keys)
+    codec = compression.codec_id(compress)
+    out_path = out_path or file_path + ".enc"
+    manifest_path = manifest_path or manifest_path_for(file_path)
+
+    manifest = None if full else load_manifest(manifest_path)
+    if _reusable(manifest, out_path, recipient_ids, codec, average_chunk_size):
+        content_key = bytes.fromhex(manifest["content_key"])
+        nonces_used = manifest["nonces_used"]
+        # sha256 -> (plain length, stored length, nonce, offset in the previous output, chunk_digest)
+        known = {sha: (plain_len, stored_len, bytes.fromhex(nonce), offset, bytes.fromhex(digest))
+                 for sha, plain_len, stored_len, nonce, offset, digest in manifest["chunks"]}
+    else:
+        content_key = container.new_content_key()
+        nonces_used = 0
+        known = {}
+
+    reporter = Reporter(os.path.getsize(file_path), progress, cancel_event)
+    # Newly sealed chunks wait in a hidden temp file until the output is assembled
+    spill_path = output.temp_path(out_path)
+    # Reusable chunks do not depend on the header, so they are sealed before it is built
+    flags = container.FLAG_REUSABLE_CHUNKS | container.FLAG_CHUNK_HASHES
+    draft = container.ContainerHeader(0, 0, bytes(container.SALT_SIZE), bytes(container.POINT_SIZE),
+                                      chunks=[], flags=flags, codec=codec)
+    chunk_cipher = container.ChunkCipher(content_key, draft)
+    # A chunk is at most four times the average (see iter_content_chunks); the budget may grant fewer workers
+    max_chunk = max(average_chunk_size * 4, GEAR_WINDOW)
+    stages = pipeline.Pipeline(workers or parallel.default_workers(), 2 * max_chunk + container.TAG_SIZE,
+                               "encrypt_incremental")
+    read_phase = metrics.accumulator("encrypt_incremental", "read")
+    aes_phase = metrics.accumulator("encrypt_incremental", "aes")
+    copy_phase = metrics.accumulator("encrypt_incremental", "copy")
+
+    def process(data):
+        sha = hashlib.sha256(data).hexdigest()
+        if sha in known:
+            return sha, len(data), None, None, None
+        nonce = os.urandom(container.NONCE_SIZE)
+        sealed = chunk_cipher.seal_reusable(nonce, compression.compress_chunk(codec, data))
+        return sha, len(data), nonce, sealed, container.chunk_digest(sealed)
+
+    # (sha, plain length, stored length, nonce, source, chunk_digest) per chunk;
+    # source is ("old", offset) or ("new", offset)
+    entries = []
+    stats = {"chunks": 0, "reused_chunks": 0, "reused_bytes": 0, "encrypted_chunks": 0, "encrypted_bytes": 0}
+    try:
+        with metrics.span("encrypt_incremental", "total", reporter.total):
+            with stages, open(file_path, "rb") as src, open(spill_path, "wb") as spill:
+                chunks = read_phase.iterate(iter_content_chunks(src, average_chunk_size))
+                for sha, plain_len, nonce, sealed, digest in stages.run(aes_phase.wrap(process, count_bytes=False), chunks):
+                    reporter.advance(plain_len)
+                    stats["chunks"] += 1
+                    if sealed is None:
+                        _, stored_len, old_nonce, offset, old_digest = known[sha]
+                        entries.append((sha, plain_len, stored_len, old_nonce, ("old", offset), old_digest))
+                        stats["reused_chunks"] += 1
+                        stats["reused_bytes"] += plain_len
+                    else:
+                        entries.append((sha, plain_len, len(sealed), nonce, ("new", spill.tell()), digest))
+                        spill.write(sealed)
+                        stats["encrypted_chunks"] += 1
+                        stats["encrypted_bytes"] += plain_len
+                if reporter.done != reporter.total or src.read(1):
+                    raise ValueError("File changed size during encryption.")
+
+            # Fresh ephemeral key and salt every run; the content key may be the previous one
+            ephemeral_private_key = ec.generate_private_key(container.CURVE)
+            salt = container.new_salt()
+            wrapped_keys = [
+                container.wrap_content_key(content_key, ephemeral_private_key.exchange(ec.ECDH(), key), salt, key)
+                for key in public_keys
+            ]
+            header = container.ContainerHeader(
+                max(1, average_chunk_size * 4),
+                reporter.total,
+                salt,
+                container.compress_public_key(ephemeral_private_key.public_key()),
+                wrapped_keys,
+                chunks=[(plain_len, stored_len) for _, plain_len, stored_len, _, _, _ in entries],
+                flags=flags,
+                codec=codec,
+                nonces=[nonce for _, _, _, nonce, _, _ in entries],
+                chunk_hashes=[digest for _, _, _, _, _, digest in entries],
+            )
+            header.merkle_root = container.merkle_root(header.chunk_hashes)
+            header.seal_table(content_key)
+
+            # Assemble: header, then every chunk copied from the previous output or the spill file
+            chunk_offsets = header.chunk_offsets()
+            header_bytes = header.pack()
+            atomic = output.AtomicOutput(out_path, len(header_bytes) + sum(entry[2] for entry in entries), fsync)
+            old_fd = os.open(out_path, os.O_RDONLY) if stats["reused_chunks"] else None
+            try:
+                with open(spill_path, "rb") as spill, atomic as dst:
+                    dst.write(header_bytes)
+                    # The chunks are copied to the file descriptor, behind the file object's back
+                    dst.flush()
+                    copy = copy_phase.wrap(chunk_io.copy_range, count_bytes=False)
+                    run = None  # (fd, offset, length) of adjacent chunks copied in one call
+                    for _, _, stored_len, _, (origin, offset), _ in entries:
+                        fd = old_fd if origin == "old" else spill.fileno()
+                        if run is not None and run[0] == fd and run[1] + run[2] == offset:
+                            run = (fd, run[1], run[2] + stored_len)
+                            continue
+                        if run is not None:
+                            copy(run[0], dst.fileno(), run[1], run[2])
+                        run = (fd, offset, stored_len)
+                    if run is not None:
+                        copy(run[0], dst.fileno(), run[1], run[2])
+                    dst.wrote_to_fd()
+            finally:
+                if old_fd is not None:
+                    os.close(old_fd)
+    finally:
+        if os.path.exists(spill_path):
+            os.remove(spill_path)
+    read_phase.emit()
+    aes_phase.emit()
+    copy_phase.emit()
+
+    # The finished output's size and mtime, which a batched rename still has to put in place
+    st = atomic.stat
+    _save_manifest(manifest_path, {
+        "version": MANIFEST_VERSION,
+        "file": os.path.abspath(file_path),
+        "output": os.path.abspath(out_path),
+        "output_size": st.st_size,
+        "output_mtime_ns": st.st_mtime_ns,
+        "recipients": recipient_ids,
+        "codec": codec,
+        "average_chunk_size": average_chunk_size,
+        "content_key": content_key.hex(),
+        "nonces_used": nonces_used + stats["encrypted_chunks"],
+        "chunks": [
+            [sha, plain_len, stored_len, nonce.hex(), offset, digest.hex()]
+            for (sha, plain_len, stored_len, nonce, _, digest), offset in zip(entries, chunk_offsets)
+        ],
+    }, fsync)
+
+    if verbose:
+        mb = 1024 * 1024
+        print(f"Encryption successful! {stats['encrypted_chunks']}/{stats['chunks']} chunks changed "
+              f"({stats['encrypted_bytes'] / mb:.1f} of {reporter.total / mb:.1f} MB encrypted).")
+    return stats
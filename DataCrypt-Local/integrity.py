@@ -0,0 +1,140 @@
+"""Integrity scrubbing of containers: find exactly which byte ranges are corrupt.
+
+Two checks are available, both running over all chunks on `workers` threads
+without writing any plaintext:
+
+    sha256  compares every stored chunk with its hash in the header, after
+            checking the hash list against its Merkle root (FLAG_CHUNK_HASHES,
+            see container.py). Needs no private key, so a storage host can
+            scrub archives it cannot read; catches accidental corruption.
+    gcm     opens every chunk with the content key, i.e. checks its GCM tag.
+            Needs the private key; also catches deliberate tampering, and is
+            usually the faster of the two, as AES-GCM outruns SHA-256.
+
+Unlike decrypt_file, which stops at the first bad chunk, a scrub reports every
+damaged chunk as a range of file offsets (and the plaintext it held). Chunks
+go through a pipeline.Pipeline like decryption, so --max-memory covers scrubs.
+"""
+import os
+
+import chunk_io
+import container
+import metrics
+import parallel
+import pipeline
+
+METHODS = ("gcm", "sha256")
+
+
+def _damage(reason, start, end, chunk=None, plain_start=None, plain_end=None):
+    return {"reason": reason, "start": start, "end": end, "chunk": chunk,
+            "plain_start": plain_start, "plain_end": plain_end}
+
+
+def describe(damage):
+    """One-line description of a damage record, e.g. 'bytes 1048718-2097309 (chunk 1): ...'."""
+    where = f"bytes {damage['start']}-{damage['end'] - 1}"
+    if damage["chunk"] is not None:
+        where += f" (chunk {damage['chunk']}, plaintext {damage['plain_start']}-{damage['plain_end'] - 1})"
+    return f"{where}: {damage['reason']}"
+
+
+def scrub_file(encrypted_file_path, method="gcm", private_key_path=None, keyring=None, workers=None, io_backend=None):
+    """Check every chunk of a container; returns the list of damage records (empty if intact).
+
+    method is "gcm" or "sha256" (see the module docstring); for "gcm" the key
+    is resolved as in decrypt_file. Each record is a dict with the file range
+    (start, end), the chunk index and its plaintext range where known, and a
+    reason. A header too damaged to parse raises ValueError, as nothing after
+    it can be located.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown verification method: {method} (choose from {', '.join(METHODS)})")
+    file_size = os.path.getsize(encrypted_file_path)
+    with open(encrypted_file_path, "rb") as f:
+        with metrics.span("scrub_file", "header"):
+            header = container.ContainerHeader.read(f)
+        if method == "sha256" and not header.has_chunk_hashes:
+            raise ValueError("This container has no chunk hashes; check it with the private key instead.")
+
+        if header.streamed:
+            return _scrub_stream(f, private_key_path, keyring, workers, file_size)
+
+        damaged = []
+        open_chunk = None
+        if method == "sha256":
+            hashes_start = header.size - container.HASH_SIZE * (header.chunk_count + 1)
+            if container.merkle_root(header.chunk_hashes) != header.merkle_root:
+                # Without a trustworthy hash list no chunk can be judged
+                return [_damage("chunk hashes do not match their Merkle root", hashes_start, header.size)]
+        else:
+            import decryptor
+
+            f.seek(0)
+            _, chunk_cipher = decryptor.open_container(f, private_key_path, keyring, "scrub_file")
+            open_chunk = chunk_cipher.open_into
+
+        chunk_offsets = header.chunk_offsets()
+        plain_offsets = header.plaintext_offsets()
+        workers = parallel.workers_for(header.chunk_count, workers)
+        max_plain_len = max((plain_len for plain_len, _ in header.chunks), default=0)
+        max_stored_len = max((stored_len for _, stored_len in header.chunks), default=0)
+        # A hash check needs no plaintext buffers; the budget may grant fewer workers
+        slot_bytes = max_stored_len + (max_plain_len if open_chunk is not None else 0)
+        stages = pipeline.Pipeline(workers, slot_bytes, "scrub_file", inline=header.chunk_count <= 1)
+        check_phase = metrics.accumulator("scrub_file", method)
+
+        def check(item):
+            index, data = item
+            plain_len, stored_len = header.chunks[index]
+            if len(data) != stored_len:
+                return "missing (file is truncated)"
+            if open_chunk is None:
+                if container.chunk_digest(data) != header.chunk_hashes[index]:
+                    return "chunk does not match its SHA-256"
+                return None
+            try:
+                open_chunk(index, data, plain_buffers.get(index, plain_len))
+            except ValueError as e:
+                return str(e)
+            return None
+
+        f.seek(header.size)
+        lengths = [stored_len for _, stored_len in header.chunks]
+        with stages:
+            plain_buffers = chunk_io.BufferRing(stages.slots, max_plain_len if open_chunk is not None else 0)
+            chunks = enumerate(chunk_io.iter_chunks(f, lengths, io_backend, stages.slots))
+            for index, reason in enumerate(stages.run(check_phase.wrap(check, count_bytes=False), chunks)):
+                if reason is not None:
+                    plain_len, stored_len = header.chunks[index]
+                    start = chunk_offsets[index]
+                    damaged.append(_damage(reason, start, start + stored_len, index,
+                                           plain_offsets[index], plain_offsets[index] + plain_len))
+        check_phase.nbytes = sum(lengths)
+        check_phase.emit()
+
+        end = header.size + sum(lengths)
+        if file_size > end:
+            damaged.append(_damage("unexpected data after the last chunk", end, file_size))
+    return damaged
+
+
+def _scrub_stream(f, private_key_path, keyring, workers, file_size):
+    """Check a FLAG_STREAM container with its key.
+
+    Without a chunk table the damaged chunk cannot be placed, so the whole
+    chunk area is reported.
+    """
+    import decryptor
+
+    f.seek(0)
+    header, chunk_cipher = decryptor.open_container(f, private_key_path, keyring, "scrub_file")
+    try:
+        for _ in decryptor._iter_plaintext(f, header, chunk_cipher, workers, operation="scrub_file"):
+            pass
+    except ValueError as e:
+        return [_damage(f"{e} (streamed container, so the chunk cannot be located)", header.size, file_size)]
+    end = f.tell()
+    if file_size > end:
+        return [_damage("unexpected data after the last chunk", end, file_size)]
+    return []
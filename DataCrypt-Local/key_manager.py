@@ -1,6 +1,5 @@
 import os
-from cryptography.hazmat.primitives.asymmetric import ec
-from cryptography.hazmat.primitives import serialization
+import metrics
 
 # Use an absolute path for the keys directory
 KEY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "keys")
@@ -11,6 +10,10 @@ def generate_key_pair():
     Returns:
         bool: True if keys were generated, False if they already exist.
     """
+    # Imported here so that modules needing only KEY_DIR stay cheap to import
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.hazmat.primitives import serialization
+
     if not os.path.exists(KEY_DIR):
         os.makedirs(KEY_DIR)
 
@@ -23,27 +26,29 @@ def generate_key_pair():
         return False
 
     try:
-        private_key = ec.generate_private_key(ec.SECP384R1())
-
-        # Serialize and save private key
-        private_pem = private_key.private_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PrivateFormat.PKCS8,
-            encryption_algorithm=serialization.NoEncryption(),
-        )
-
-        with open(private_key_path, "wb") as f:
-            f.write(private_pem)
-
-        # Generate and save public key
-        public_key = private_key.public_key()
-        public_pem = public_key.public_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PublicFormat.SubjectPublicKeyInfo,
-        )
-
-        with open(public_key_path, "wb") as f:
-            f.write(public_pem)
+        with metrics.span("generate_key_pair", "total"):
+            with metrics.span("generate_key_pair", "keygen"):
+                private_key = ec.generate_private_key(ec.SECP384R1())
+
+            # Serialize the private and public keys
+            with metrics.span("generate_key_pair", "serialize"):
+                private_pem = private_key.private_bytes(
+                    encoding=serialization.Encoding.PEM,
+                    format=serialization.PrivateFormat.PKCS8,
+                    encryption_algorithm=serialization.NoEncryption(),
+                )
+                public_key = private_key.public_key()
+                public_pem = public_key.public_bytes(
+                    encoding=serialization.Encoding.PEM,
+                    format=serialization.PublicFormat.SubjectPublicKeyInfo,
+                )
+
+            # Save both
+            with metrics.span("generate_key_pair", "write", len(private_pem) + len(public_pem)):
+                with open(private_key_path, "wb") as f:
+                    f.write(private_pem)
+                with open(public_key_path, "wb") as f:
+                    f.write(public_pem)
 
         print("[✅] ECDH key pair generated and saved.")
         return True
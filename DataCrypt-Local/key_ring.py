@@ -0,0 +1,308 @@
+"""Key ring: many identities, an address book of recipients, and cached parsed keys.
+
+Layout under the key directory (key_manager.KEY_DIR by default):
+
+    private_key.pem / public_key.pem   default identity created by generate_key_pair()
+    identities/<fingerprint>.pem       additional private keys
+    contacts/<name>.pem                recipient public keys
+    keyring.json                       fingerprint index of everything above
+
+Keys are identified by their fingerprint, the hex form of the key id recorded
+for every recipient in container headers, so decryption can go straight from a
+header to the matching private key.
+
+The cryptography serialization (PEM) module is imported on first use: it is
+the slowest part of cryptography to load, and encrypting for a recipient given
+as a base64 key does not need it.
+"""
+import base64
+import binascii
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+from cryptography.hazmat.primitives.asymmetric import ec
+
+import container
+
+INDEX_FILE = "keyring.json"
+DEFAULT_CACHE_SIZE = 32
+
+# DER prefix of a SubjectPublicKeyInfo holding an uncompressed SECP384R1 point
+_P384_SPKI_PREFIX = bytes.fromhex("3076301006072a8648ce3d020106052b81040022036200")
+_P384_POINT_SIZE = 97
+
+
+def fingerprint(public_key):
+    """Return the fingerprint of a public key (hex of its container key id)."""
+    return container.key_id(public_key).hex()
+
+
+def pem_body(pem):
+    """Return the base64 body of a PEM document, as shown and pasted in the GUI."""
+    lines = pem.strip().splitlines()
+    return ''.join(line for line in lines if not line.startswith('-----'))
+
+
+def read_recipient(recipient, keyring=None):
+    """Return the base64 public key body for a recipient given on the command line.
+
+    recipient is "@name" for a key ring contact, the path of a PEM public key
+    file, or the base64 key itself as shown by the GUI.
+    """
+    if recipient.startswith("@"):
+        keyring = keyring if keyring is not None else default_keyring()
+        try:
+            recipient = keyring.contact_file(recipient[1:])
+        except KeyError:
+            raise ValueError(f"Unknown contact: {recipient[1:]}")
+    if os.path.isfile(recipient):
+        with open(recipient, "r") as f:
+            return pem_body(f.read())
+    return recipient.strip()
+
+
+@lru_cache(maxsize=256)
+def parse_public_key(public_key_str):
+    """Parse (and cache) a public key given as the base64 body of a PEM file."""
+    # Fast path for our own key type, without loading the PEM machinery
+    try:
+        der = base64.b64decode(public_key_str, validate=True)
+    except binascii.Error:
+        der = b""
+    if len(der) == len(_P384_SPKI_PREFIX) + _P384_POINT_SIZE and der.startswith(_P384_SPKI_PREFIX):
+        return ec.EllipticCurvePublicKey.from_encoded_point(container.CURVE, der[len(_P384_SPKI_PREFIX):])
+
+    from cryptography.hazmat.primitives import serialization
+
+    # Reconstruct PEM format from base64 key content
+    public_key_pem = '-----BEGIN PUBLIC KEY-----\n' + '\n'.join([public_key_str[i:i+64] for i in range(0, len(public_key_str), 64)]) + '\n-----END PUBLIC KEY-----\n'
+    return serialization.load_pem_public_key(public_key_pem.encode())
+
+
+@lru_cache(maxsize=DEFAULT_CACHE_SIZE)
+def _load_private_key_file(path, mtime_ns, size):
+    from cryptography.hazmat.primitives import serialization
+
+    with open(path, "rb") as key_file:
+        return serialization.load_pem_private_key(key_file.read(), password=None)
+
+
+def load_private_key_file(path):
+    """Load an unencrypted PEM private key, reusing the parsed key until the file changes."""
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    return _load_private_key_file(path, st.st_mtime_ns, st.st_size)
+
+
+def _stat_signature(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+_default_lock = threading.Lock()
+_default_ring = None
+_default_signature = None
+
+
+def default_keyring():
+    """Return the key ring of key_manager.KEY_DIR, shared by every caller in the process.
+
+    The ring (and the private keys it has parsed) is reused until KEY_DIR is
+    changed or its index or default identity is rewritten on disk.
+    """
+    global _default_ring, _default_signature
+    import key_manager
+
+    directory = key_manager.KEY_DIR
+    signature = (directory,
+                 _stat_signature(os.path.join(directory, INDEX_FILE)),
+                 _stat_signature(os.path.join(directory, "public_key.pem")))
+    with _default_lock:
+        if _default_ring is None or _default_signature != signature:
+            _default_ring = KeyRing(directory)
+            _default_signature = signature
+        return _default_ring
+
+
+def _check_contact_name(name):
+    # Contact names become file names under contacts/; keep them there
+    if not name or name in (".", "..") or "/" in name or "\\" in name:
+        raise ValueError(f"Invalid contact name: {name!r}")
+
+
+class KeyRing:
+    """Identities and contacts stored under one key directory, indexed by fingerprint."""
+
+    def __init__(self, directory=None, cache_size=DEFAULT_CACHE_SIZE):
+        if directory is None:
+            import key_manager
+
+            directory = key_manager.KEY_DIR
+        self.directory = directory
+        self._cache_size = cache_size
+        self._cache = OrderedDict()  # fingerprint -> parsed key, least recently used first
+        self._lock = threading.Lock()
+        self._index = self._load_index()
+
+    # Index
+
+    def _index_path(self):
+        return os.path.join(self.directory, INDEX_FILE)
+
+    def _load_index(self):
+        import json
+
+        index = {"identities": {}, "contacts": {}}
+        try:
+            with open(self._index_path(), "r") as f:
+                index.update(json.load(f))
+        except FileNotFoundError:
+            pass
+
+        # Pick up the default identity created by key_manager.generate_key_pair()
+        public_key_path = os.path.join(self.directory, "public_key.pem")
+        if os.path.exists(public_key_path) and "private_key.pem" not in index["identities"].values():
+            from cryptography.hazmat.primitives import serialization
+
+            with open(public_key_path, "rb") as f:
+                public_key = serialization.load_pem_public_key(f.read())
+            index["identities"][fingerprint(public_key)] = "private_key.pem"
+        return index
+
+    def _save_index(self):
+        import json
+
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self._index_path() + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._index, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self._index_path())
+
+    # Cache
+
+    def _cached(self, fp, load):
+        with self._lock:
+            key = self._cache.get(fp)
+            if key is not None:
+                self._cache.move_to_end(fp)
+                return key
+        key = load()
+        with self._lock:
+            self._cache[fp] = key
+            self._cache.move_to_end(fp)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return key
+
+    # Identities (private keys)
+
+    def identities(self):
+        """Return the fingerprints of all identities."""
+        return sorted(self._index["identities"])
+
+    def generate_identity(self):
+        """Create a new SECP384R1 identity and return its fingerprint."""
+        from cryptography.hazmat.primitives import serialization
+
+        private_key = ec.generate_private_key(container.CURVE)
+        return self.add_identity(private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption(),
+        ))
+
+    def add_identity(self, private_pem):
+        """Store a PEM private key as an identity and return its fingerprint."""
+        from cryptography.hazmat.primitives import serialization
+
+        private_key = serialization.load_pem_private_key(private_pem, password=None)
+        fp = fingerprint(private_key.public_key())
+        if fp in self._index["identities"]:
+            return fp
+
+        identities_dir = os.path.join(self.directory, "identities")
+        os.makedirs(identities_dir, exist_ok=True)
+        file_name = os.path.join("identities", fp + ".pem")
+        fd = os.open(os.path.join(self.directory, file_name), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(private_pem)
+        self._index["identities"][fp] = file_name
+        self._save_index()
+        return fp
+
+    def private_key(self, fp):
+        """Return the parsed private key of identity fp, or raise KeyError."""
+        file_name = self._index["identities"][fp]
+        return self._cached(fp, lambda: load_private_key_file(os.path.join(self.directory, file_name)))
+
+    def find_identity(self, key_ids):
+        """Return (fingerprint, private key) for the first key id that is one of our identities.
+
+        Each lookup is a dictionary hit, so the cost does not depend on how many
+        identities the ring holds. Returns (None, None) if none match.
+        """
+        for key_id in key_ids:
+            fp = key_id.hex()
+            if fp in self._index["identities"]:
+                return fp, self.private_key(fp)
+        return None, None
+
+    # Contacts (recipient public keys)
+
+    def contacts(self):
+        """Return a {name: fingerprint} mapping of the address book."""
+        return {name: entry["fingerprint"] for name, entry in self._index["contacts"].items()}
+
+    def add_contact(self, name, public_key_str):
+        """Store a recipient public key (base64 body or full PEM) under name; return its fingerprint."""
+        from cryptography.hazmat.primitives import serialization
+
+        _check_contact_name(name)
+        if "-----BEGIN" in public_key_str:
+            public_key_str = pem_body(public_key_str)
+        public_key = parse_public_key(public_key_str)
+        fp = fingerprint(public_key)
+
+        contacts_dir = os.path.join(self.directory, "contacts")
+        os.makedirs(contacts_dir, exist_ok=True)
+        file_name = os.path.join("contacts", name + ".pem")
+        with open(os.path.join(self.directory, file_name), "wb") as f:
+            f.write(public_key.public_bytes(
+                encoding=serialization.Encoding.PEM,
+                format=serialization.PublicFormat.SubjectPublicKeyInfo,
+            ))
+        self._index["contacts"][name] = {"fingerprint": fp, "file": file_name}
+        self._save_index()
+        return fp
+
+    def remove_contact(self, name):
+        entry = self._index["contacts"].pop(name)
+        self._save_index()
+        with self._lock:
+            self._cache.pop("contact:" + entry["fingerprint"], None)
+        try:
+            os.remove(os.path.join(self.directory, entry["file"]))
+        except FileNotFoundError:
+            pass
+
+    def contact_file(self, name):
+        """Return the path of the PEM file stored for contact name, or raise KeyError."""
+        return os.path.join(self.directory, self._index["contacts"][name]["file"])
+
+    def contact(self, name):
+        """Return the parsed public key stored under name, or raise KeyError."""
+        entry = self._index["contacts"][name]
+
+        def load():
+            from cryptography.hazmat.primitives import serialization
+
+            with open(os.path.join(self.directory, entry["file"]), "rb") as f:
+                return serialization.load_pem_public_key(f.read())
+
+        # Prefixed so a contact never shadows an identity with the same fingerprint
+        return self._cached("contact:" + entry["fingerprint"], load)
@@ -0,0 +1,243 @@
+"""Per-phase timing of encrypt_file, decrypt_file and generate_key_pair.
+
+Nothing is measured until an exporter is installed:
+
+    import metrics
+    metrics.set_exporter(metrics.JsonLinesExporter("datacrypt-metrics.jsonl"))
+
+An exporter is any callable taking (operation, phase, seconds, nbytes, ok). It
+is called once per phase of every operation, e.g. ("decrypt_file", "ecdh",
+0.0004, 0, True) or ("decrypt_file", "aes", 0.21, 268435456, True), plus a
+"total" phase covering the whole call. Phases repeated per chunk (read, aes,
+write) are summed into one record, so an operation produces a handful of
+records whatever the file size. Chunk phases running on several worker
+threads add up their busy time, which may exceed the wall time of "total".
+
+With no exporter installed, span() and accumulator() return a shared no-op
+object, so instrumented code costs one global lookup per phase.
+"""
+import os
+import threading
+import time
+
+_exporter = None
+
+
+def set_exporter(exporter):
+    """Install exporter (or None to disable metrics); returns the previous one."""
+    global _exporter
+    previous, _exporter = _exporter, exporter
+    return previous
+
+
+def get_exporter():
+    return _exporter
+
+
+class _NullPhase:
+    """Stand-in for Span and Accumulator while metrics are disabled."""
+
+    nbytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def add(self, seconds, nbytes=0):
+        pass
+
+    def wrap(self, func, count_bytes=True):
+        return func
+
+    def iterate(self, iterable):
+        return iterable
+
+    def emit(self, ok=True):
+        pass
+
+
+_NULL = _NullPhase()
+
+
+class Span:
+    """Times one phase as a with-block and reports it on exit; set .nbytes inside."""
+
+    def __init__(self, exporter, operation, phase, nbytes=0):
+        self._exporter = exporter
+        self.operation = operation
+        self.phase = phase
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._exporter(self.operation, self.phase, time.perf_counter() - self._start, self.nbytes, exc_type is None)
+        return False
+
+
+def _byte_count(result):
+    if isinstance(result, int):
+        return result
+    return len(result) if hasattr(result, "__len__") else 0
+
+
+class Accumulator:
+    """Sums many timed sections of one phase (e.g. every chunk) into a single record."""
+
+    def __init__(self, exporter, operation, phase):
+        self._exporter = exporter
+        self.operation = operation
+        self.phase = phase
+        self.seconds = 0.0
+        self.nbytes = 0
+        self._lock = threading.Lock()
+
+    def add(self, seconds, nbytes=0):
+        with self._lock:
+            self.seconds += seconds
+            self.nbytes += nbytes
+
+    def wrap(self, func, count_bytes=True):
+        """Return func timed on every call.
+
+        With count_bytes, the result's len() (or the result itself when it is an
+        int, as returned by readinto, update_into and write) is added as bytes.
+        """
+        def timed(*args):
+            start = time.perf_counter()
+            result = func(*args)
+            self.add(time.perf_counter() - start, _byte_count(result) if count_bytes else 0)
+            return result
+        return timed
+
+    def iterate(self, iterable):
+        """Yield from iterable, timing how long each item takes to produce."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(time.perf_counter() - start)
+                return
+            self.add(time.perf_counter() - start, _byte_count(item))
+            yield item
+
+    def emit(self, ok=True):
+        self._exporter(self.operation, self.phase, self.seconds, self.nbytes, ok)
+
+
+def span(operation, phase, nbytes=0):
+    """Context manager timing one phase of operation (a no-op while metrics are off)."""
+    exporter = _exporter
+    if exporter is None:
+        return _NULL
+    return Span(exporter, operation, phase, nbytes)
+
+
+def accumulator(operation, phase):
+    """Accumulator for a phase repeated per chunk; call emit() when done (no-op while off)."""
+    exporter = _exporter
+    if exporter is None:
+        return _NULL
+    return Accumulator(exporter, operation, phase)
+
+
+class JsonLinesExporter:
+    """Appends one JSON object per phase record to a log file."""
+
+    def __init__(self, path):
+        # Imported here: metrics is imported by every command, exporters only on request
+        import json
+
+        self._dumps = json.dumps
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, operation, phase, seconds, nbytes, ok):
+        line = self._dumps({
+            "time": time.time(),
+            "operation": operation,
+            "phase": phase,
+            "seconds": seconds,
+            "bytes": nbytes,
+            "ok": ok,
+        })
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(line + "\n")
+
+
+class PrometheusExporter:
+    """Keeps per-phase counters and writes them in Prometheus text format.
+
+    The file is rewritten atomically after every "total" record (i.e. once per
+    operation), so node_exporter's textfile collector can scrape it at any time.
+    Counters already in the file are read back first, so they keep growing
+    across short-lived CLI runs.
+    """
+
+    _FIELDS = ("phase_seconds_total", "phase_bytes_total", "phase_calls_total", "phase_errors_total")
+
+    def __init__(self, path, prefix="datacrypt"):
+        self.path = path
+        self.prefix = prefix
+        self._counters = {}  # (operation, phase) -> [seconds, bytes, calls, errors]
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return
+        for line in lines:
+            if line.startswith("#") or "{" not in line:
+                continue
+            name, rest = line.split("{", 1)
+            labels, _, value = rest.partition("} ")
+            field = name[len(self.prefix) + 1:]
+            if not name.startswith(self.prefix + "_") or field not in self._FIELDS:
+                continue
+            label_map = dict(item.split("=", 1) for item in labels.split(","))
+            key = (label_map.get("operation", "").strip('"'), label_map.get("phase", "").strip('"'))
+            counter = self._counters.setdefault(key, [0.0, 0, 0, 0])
+            index = self._FIELDS.index(field)
+            counter[index] = float(value) if index == 0 else int(float(value))
+
+    def __call__(self, operation, phase, seconds, nbytes, ok):
+        with self._lock:
+            counter = self._counters.setdefault((operation, phase), [0.0, 0, 0, 0])
+            counter[0] += seconds
+            counter[1] += nbytes
+            counter[2] += 1
+            counter[3] += 0 if ok else 1
+            if phase == "total":
+                self._write()
+
+    def flush(self):
+        with self._lock:
+            self._write()
+
+    def _write(self):
+        help_texts = (
+            "Time spent per operation phase.",
+            "Bytes processed per operation phase.",
+            "Number of times each operation phase ran.",
+            "Number of times each operation phase failed.",
+        )
+        lines = []
+        for field, (name, help_text) in enumerate(zip(self._FIELDS, help_texts)):
+            lines.append(f"# HELP {self.prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {self.prefix}_{name} counter")
+            for (operation, phase), counter in sorted(self._counters.items()):
+                lines.append(f'{self.prefix}_{name}{{operation="{operation}",phase="{phase}"}} {counter[field]}')
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,315 @@
+"""Atomic, preallocated output files with a choice of fsync policy.
+
+encrypt_file, decrypt_file, encrypt_incremental and create_archive write through
+AtomicOutput:
+
+    temp file   output goes to a hidden ".<name>.<random>.tmp" next to the target,
+                so a crash or failure never leaves a torn file under the real name
+                (and never destroys the file it would have replaced)
+    preallocate the expected size is reserved up front with posix_fallocate,
+                so large outputs are laid out in few extents instead of growing
+                a little per write; the file is cut to its real size when done
+    rename      once complete, the temp file atomically replaces the target
+
+When the data reaches the disk is set by the fsync policy:
+
+    file    fsync the file before the rename and the directory after it (default)
+    batch   hand the file to an FsyncBatch, which flushes many outputs with
+            one syncfs() (one fsync per file where that is unavailable),
+            renames them all, then fsyncs each directory once; outputs appear
+            when the batch is flushed: every BATCH_FILES outputs and when its
+            owner calls flush(). Pass the FsyncBatch itself as fsync: there
+            is no process-wide batch, so "batch" alone is refused
+    never   rename right away and leave flushing to the OS
+
+The temp names start with a dot, so watch.py never picks them up.
+"""
+import os
+import threading
+
+FSYNC_POLICIES = ("file", "batch", "never")
+DEFAULT_FSYNC = "file"
+
+# Outputs an FsyncBatch collects before it flushes them on its own
+BATCH_FILES = 256
+
+_syncfs = None
+
+
+def check_fsync(fsync):
+    """Return the policy for fsync: "file" or "never", or an FsyncBatch.
+
+    None means DEFAULT_FSYNC. The "batch" policy is given as the caller's
+    FsyncBatch, which the caller flushes; the name "batch" and unknown names
+    raise ValueError.
+    """
+    if fsync is None:
+        return DEFAULT_FSYNC
+    if fsync == "batch":
+        raise ValueError('The "batch" fsync policy needs an FsyncBatch: pass one as fsync and flush it when done.')
+    if isinstance(fsync, FsyncBatch) or fsync in FSYNC_POLICIES:
+        return fsync
+    raise ValueError(f"Unknown fsync policy: {fsync} (choose from file, never or an FsyncBatch)")
+
+
+def temp_path(path):
+    """A new hidden temp file name next to path: ".<name>.<random>.tmp"."""
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, f".{name}.{os.urandom(4).hex()}.tmp")
+
+
+def _preallocate(fd, size):
+    """Reserve size bytes for fd where the platform and file system support it."""
+    fallocate = getattr(os, "posix_fallocate", None)
+    if fallocate is None or not size:
+        return
+    try:
+        fallocate(fd, 0, size)
+    except OSError:
+        # Not supported here (or no room yet); writing will tell
+        pass
+
+
+def _fsync_file(path):
+    fd = os.open(path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_directory(path):
+    """Make a rename in directory path durable (POSIX only)."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _load_syncfs():
+    """Return libc's syncfs(fd) (Linux), or False where it is unavailable."""
+    global _syncfs
+    if _syncfs is None:
+        _syncfs = False
+        try:
+            import ctypes
+            import ctypes.util
+
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            _syncfs = libc.syncfs
+        except (OSError, AttributeError):
+            pass
+    return _syncfs
+
+
+class _TrackedFile:
+    """Minimal binary writer that remembers how far into the file anything was written."""
+
+    def __init__(self, fd):
+        self._file = os.fdopen(fd, "wb")
+        self.end = 0
+
+    def write(self, data):
+        n = self._file.write(data)
+        end = self._file.tell()
+        if end > self.end:
+            self.end = end
+        return n
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def wrote_to_fd(self):
+        """Count what was written straight to fileno() (e.g. by chunk_io.copy_range), up to the current position."""
+        end = self.tell()
+        if end > self.end:
+            self.end = end
+
+    def tell(self):
+        return self._file.tell()
+
+    def flush(self):
+        self._file.flush()
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def truncate(self, size):
+        return self._file.truncate(size)
+
+    def close(self):
+        self._file.close()
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+
+class AtomicOutput:
+    """Write path through a preallocated temp file that replaces it only once complete; see the module docstring.
+
+    Use as a with-block, which gives a binary file object (write, seek, tell,
+    flush, fileno). A block that raises removes the temp file and leaves path
+    as it was. size is the expected output size, or an upper bound (None or
+    0: unknown); fsync is a policy name or an FsyncBatch; mode is the new
+    file's permissions (before the umask). After the block, .stat holds the
+    finished file's os.stat result, which the rename does not change.
+    """
+
+    def __init__(self, path, size=None, fsync=None, mode=0o666):
+        self.path = path
+        self.size = size
+        self.fsync = check_fsync(fsync)
+        self.mode = mode
+        self.stat = None
+        self.tmp_path = temp_path(path)
+        self.directory = os.path.dirname(self.tmp_path)
+        self._file = None
+
+    def __enter__(self):
+        fd = os.open(self.tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), self.mode)
+        try:
+            _preallocate(fd, self.size)
+            self._file = _TrackedFile(fd)
+        except BaseException:
+            os.close(fd)
+            os.remove(self.tmp_path)
+            raise
+        return self._file
+
+    def __exit__(self, exc_type, exc, tb):
+        dst, self._file = self._file, None
+        try:
+            if exc_type is None:
+                dst.flush()
+                # Drop whatever of the preallocation was not needed
+                dst.truncate(dst.end)
+                if self.fsync == "file":
+                    os.fsync(dst.fileno())
+                self.stat = os.fstat(dst.fileno())
+        except BaseException:
+            dst.close()
+            os.remove(self.tmp_path)
+            raise
+        dst.close()
+        if exc_type is not None:
+            os.remove(self.tmp_path)
+            return False
+        _rename(self.tmp_path, self.path, self.fsync)
+        return False
+
+
+def replace(tmp_path, path, fsync=None):
+    """Move the finished file tmp_path over path under the fsync policy, as AtomicOutput does.
+
+    For outputs written some other way, e.g. a resumable run's .part file.
+    """
+    fsync = check_fsync(fsync)
+    if fsync == "file":
+        _fsync_file(tmp_path)
+    _rename(tmp_path, path, fsync)
+
+
+def _rename(tmp_path, path, fsync):
+    """Rename tmp_path (already flushed as fsync requires) to path, or leave that to an FsyncBatch."""
+    if isinstance(fsync, FsyncBatch):
+        fsync.add(tmp_path, path)
+        return
+    os.replace(tmp_path, path)
+    if fsync == "file":
+        _fsync_directory(os.path.dirname(os.path.abspath(path)))
+
+
+def _remove_temp_files(pending):
+    for tmp_path, _ in pending:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+class FsyncBatch:
+    """Outputs waiting to be flushed and renamed into place together; see the module docstring.
+
+    Pass the batch as the fsync policy of the outputs it should collect, and
+    call flush() (or use it as a with-block) when done. It flushes on its own
+    every max_files outputs. Safe to share between threads.
+    """
+
+    def __init__(self, max_files=BATCH_FILES):
+        self.max_files = max_files
+        self.pending = []  # (temp path, final path)
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+        return False
+
+    def add(self, tmp_path, path):
+        with self._lock:
+            self.pending.append((tmp_path, path))
+            full = len(self.pending) >= self.max_files
+        if full:
+            self.flush()
+
+    def take(self):
+        """Remove and return the pending outputs, e.g. to hand them to a batch in another process."""
+        with self._lock:
+            pending, self.pending = self.pending, []
+        return pending
+
+    def adopt(self, pending):
+        """Add outputs taken from another batch (see take())."""
+        for tmp_path, path in pending:
+            self.add(tmp_path, path)
+
+    def flush(self):
+        """Make every pending output durable, rename it into place and make the renames durable.
+
+        If a step fails, the temp files of the outputs not yet renamed are removed.
+        """
+        pending = self.take()
+        if not pending:
+            return
+        renamed = 0
+        try:
+            syncfs = _load_syncfs()
+            if syncfs:
+                # One flush per file system instead of one per file
+                devices = {}
+                for tmp_path, _ in pending:
+                    devices.setdefault(os.stat(tmp_path).st_dev, tmp_path)
+                for tmp_path in devices.values():
+                    fd = os.open(tmp_path, os.O_RDONLY)
+                    try:
+                        if syncfs(fd) != 0:
+                            import ctypes
+
+                            raise OSError(ctypes.get_errno(), "syncfs failed", tmp_path)
+                    finally:
+                        os.close(fd)
+            else:
+                for tmp_path, _ in pending:
+                    _fsync_file(tmp_path)
+            directories = set()
+            for tmp_path, path in pending:
+                os.replace(tmp_path, path)
+                renamed += 1
+                directories.add(os.path.dirname(tmp_path))
+        finally:
+            _remove_temp_files(pending[renamed:])
+        for directory in directories:
+            _fsync_directory(directory)
+
+    def discard(self):
+        """Remove the pending outputs' temp files without renaming them."""
+        _remove_temp_files(self.take())
@@ -0,0 +1,61 @@
+"""Thread-pool helpers for processing container chunks on several cores.
+
+Container chunks are sealed independently (each has its own nonce), so they can
+be encrypted or decrypted in any order. The `cryptography` AEAD calls release
+the GIL, which lets plain threads use every core without pickling any data.
+"""
+import os
+from collections import deque
+
+
+def default_workers():
+    """Number of worker threads used when the caller does not pick one."""
+    return os.cpu_count() or 1
+
+
+def workers_for(item_count, workers=None):
+    """Cap the worker count at the number of items, so small inputs run inline."""
+    if workers is None:
+        workers = default_workers()
+    return max(1, min(workers, item_count))
+
+
+def pending_limit(workers):
+    """Default number of items imap_ordered keeps in flight for `workers` threads."""
+    return 2 * workers
+
+
+def imap_ordered(func, items, workers=None, max_pending=None):
+    """Yield func(item) for every item, computed on a thread pool but in input order.
+
+    At most max_pending items (default: two per worker) are in flight at once, so
+    memory stays bounded however many items there are. With one worker the items
+    are processed inline without starting a pool.
+    """
+    if workers is None:
+        workers = default_workers()
+    if workers < 1:
+        raise ValueError("workers must be at least 1.")
+    if workers == 1:
+        for item in items:
+            yield func(item)
+        return
+
+    # Imported here: single-worker callers (e.g. small files) never need it
+    from concurrent.futures import ThreadPoolExecutor
+
+    if max_pending is None:
+        max_pending = pending_limit(workers)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(pool.submit(func, item))
+                if len(pending) >= max_pending:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # On error or early close, drop work that has not started yet
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,317 @@
+"""The read / cipher / write pipeline that containers are encrypted and decrypted through, under one memory budget.
+
+Every encrypt, decrypt, verify and incremental encrypt of a container runs in
+three stages:
+
+    read    one thread reading chunks into ring buffers
+    cipher  `workers` threads sealing or opening them (the AEAD calls release the GIL)
+    write   the calling thread, writing the results out in chunk order
+
+The stages are connected by bounded queues: the reader is at most one chunk
+per worker ahead, and at most two chunks per worker are being ciphered. A
+slow stage therefore makes the others wait instead of buffering more, and the
+ring buffers (see chunk_io.BufferRing) are sized from these bounds.
+
+Memory budget: set_max_memory(256 * 1024 * 1024), or --max-memory 256M on the
+command line, caps the ring buffers of all operations in the process
+together. Each operation reserves its buffers when it starts: if the budget
+is tight it gets fewer cipher workers, and if not even one worker fits, it
+waits until running operations hand their buffers back. By default there is
+no budget. Compressing a chunk allocates its compressed copy on top.
+
+Utilization: each pipeline reports how busy every stage was through the
+metrics exporter, as phases "busy_read", "busy_cipher" (per worker) and
+"busy_write" next to "pipeline", its wall time. A stage near 100% is the
+bottleneck. UtilizationPrinter (--stats) prints these per operation.
+"""
+import sys
+import threading
+import time
+from collections import deque
+
+import metrics
+import parallel
+
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+STAGES = ("read", "cipher", "write")
+
+# How long a blocked reader waits before checking whether the pipeline was abandoned
+_POLL_SECONDS = 0.1
+
+_budget = None
+
+
+def parse_size(text):
+    """Parse a byte size such as "256M", "1.5G" or "65536" (K/M/G/T are powers of 1024)."""
+    value = text.strip().upper()
+    for suffix in ("IB", "B"):
+        if value.endswith(suffix) and value[:-len(suffix)][-1:].isalpha():
+            value = value[:-len(suffix)]
+            break
+    unit = value[-1:] if value[-1:].isalpha() else ""
+    if unit not in SIZE_UNITS:
+        raise ValueError(f"Invalid size: {text}")
+    try:
+        size = int(float(value[:len(value) - len(unit)]) * SIZE_UNITS[unit])
+    except ValueError:
+        raise ValueError(f"Invalid size: {text}")
+    if size < 0:
+        raise ValueError(f"Invalid size: {text}")
+    return size
+
+
+class MemoryBudget:
+    """A number of bytes shared by every pipeline in the process; see the module docstring."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, costs):
+        """Take the largest of costs (largest first) that fits, waiting until the smallest does; returns it."""
+        smallest = costs[-1]
+        if smallest > self.limit:
+            raise ValueError(f"The memory budget of {self.limit} bytes is too small for this file's chunks "
+                             f"({smallest} bytes needed).")
+        with self._cond:
+            while self.limit - self.used < smallest:
+                self._cond.wait()
+            free = self.limit - self.used
+            cost = next(cost for cost in costs if cost <= free)
+            self.used += cost
+        return cost
+
+    def release(self, nbytes):
+        with self._cond:
+            self.used -= nbytes
+            self._cond.notify_all()
+
+
+def set_max_memory(limit):
+    """Cap the chunk buffers of all pipelines in this process at limit bytes (None: no cap)."""
+    global _budget
+    _budget = MemoryBudget(limit) if limit else None
+
+
+def get_budget():
+    return _budget
+
+
+def read_ahead(workers):
+    """Chunks the reader may have queued up for `workers` cipher threads."""
+    return workers
+
+
+def buffer_slots(workers):
+    """Ring buffer slots a pipeline needs: chunks queued and in flight, plus the one being read and the one being written."""
+    return read_ahead(workers) + parallel.pending_limit(workers) + 2
+
+
+class _Failed:
+    """An exception raised by the reader, passed on to the writer."""
+
+    def __init__(self, error):
+        self.error = error
+
+
+_END = object()
+
+
+class Pipeline:
+    """One operation's pass through the three stages; use as a with-block.
+
+    slot_bytes is what one ring slot costs (the input and output buffer of one
+    chunk). On entry the buffers are reserved from the memory budget, which
+    sets .workers (at most the number asked for) and .slots, the size the
+    caller's rings must have; extra_slots are added for readers that hold a
+    chunk more than usual. With inline, everything runs on the calling thread
+    (for single-chunk inputs, where threads cost more than they save).
+    """
+
+    def __init__(self, workers, slot_bytes, operation, inline=False, extra_slots=0):
+        self.operation = operation
+        self.inline = inline
+        self._wanted = workers
+        self._slot_bytes = slot_bytes
+        self._extra_slots = extra_slots
+        self._budget = None
+        self._reserved = 0
+        self.workers = workers
+        self.slots = 1 if inline else buffer_slots(workers) + extra_slots
+        self.busy = dict.fromkeys(STAGES, 0.0)
+        self._lock = threading.Lock()
+        self._started = None
+
+    def __enter__(self):
+        budget = _budget
+        if budget is not None and self._slot_bytes:
+            if self.inline:
+                costs = [self.slots * self._slot_bytes]
+            else:
+                costs = [(buffer_slots(workers) + self._extra_slots) * self._slot_bytes
+                         for workers in range(self._wanted, 0, -1)]
+            self._reserved = budget.acquire(costs)
+            self._budget = budget
+            if not self.inline:
+                self.workers = self._wanted - costs.index(self._reserved)
+                self.slots = buffer_slots(self.workers) + self._extra_slots
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._release()
+        self.report(exc_type is None)
+        return False
+
+    def _release(self):
+        """Hand the reserved buffers back to the memory budget (once)."""
+        if self._budget is not None:
+            self._budget.release(self._reserved)
+            self._budget = None
+
+    def _add(self, stage, seconds):
+        with self._lock:
+            self.busy[stage] += seconds
+
+    def run(self, func, items):
+        """Yield func(item) for every item, in order: items are read on the reader thread, func runs on the workers.
+
+        The time the caller spends between two results counts as the write
+        stage. Errors raised by items or func are raised here.
+        """
+        clock = time.perf_counter
+
+        def cipher(item):
+            start = clock()
+            try:
+                return func(item)
+            finally:
+                self._add("cipher", clock() - start)
+
+        if self.inline:
+            iterator = iter(items)
+            while True:
+                start = clock()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    self._add("read", clock() - start)
+                    return
+                self._add("read", clock() - start)
+                result = cipher(item)
+                start = clock()
+                yield result
+                self._add("write", clock() - start)
+
+        # Imported here: inline (single-chunk) callers never need them
+        import queue
+        from concurrent.futures import ThreadPoolExecutor
+
+        ahead = queue.Queue(read_ahead(self.workers))
+        abandoned = threading.Event()
+
+        def put(entry):
+            while not abandoned.is_set():
+                try:
+                    ahead.put(entry, timeout=_POLL_SECONDS)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def reader():
+            iterator = iter(items)
+            try:
+                while True:
+                    start = clock()
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        break
+                    finally:
+                        self._add("read", clock() - start)
+                    if not put(item):
+                        return
+                put(_END)
+            except BaseException as e:
+                put(_Failed(e))
+            finally:
+                # Close a generator on the thread that ran it (e.g. to unmap its input)
+                close = getattr(iterator, "close", None)
+                if close is not None:
+                    close()
+
+        thread = threading.Thread(target=reader, name=f"{self.operation}-reader", daemon=True)
+        thread.start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                pending = deque()
+                max_pending = parallel.pending_limit(self.workers)
+                try:
+                    while True:
+                        # Write out what is ready before waiting on the reader
+                        while pending and (pending[0].done() or len(pending) >= max_pending):
+                            result = pending.popleft().result()
+                            start = clock()
+                            yield result
+                            self._add("write", clock() - start)
+                        entry = ahead.get()
+                        if entry is _END:
+                            break
+                        if isinstance(entry, _Failed):
+                            raise entry.error
+                        pending.append(pool.submit(cipher, entry))
+                    while pending:
+                        result = pending.popleft().result()
+                        start = clock()
+                        yield result
+                        self._add("write", clock() - start)
+                finally:
+                    # On error or early close, drop work that has not started yet
+                    for future in pending:
+                        future.cancel()
+        finally:
+            # Stop the reader (it gives up waiting on a full queue) and wait for it, so that no thread
+            # touches the input or its ring buffers any more; only then may the buffers go back to the budget
+            abandoned.set()
+            thread.join()
+            self._release()
+
+    def report(self, ok=True):
+        """Send the stages' busy times and the wall time to the metrics exporter."""
+        if metrics.get_exporter() is None or self._started is None:
+            return
+        wall = time.perf_counter() - self._started
+        for stage in STAGES:
+            phase = metrics.accumulator(self.operation, "busy_" + stage)
+            busy = self.busy[stage]
+            phase.add(busy / self.workers if stage == "cipher" else busy)
+            phase.emit(ok)
+        total = metrics.accumulator(self.operation, "pipeline")
+        total.add(wall)
+        total.emit(ok)
+
+
+class UtilizationPrinter:
+    """Metrics exporter printing each pipeline's stage utilization, e.g.
+
+        encrypt_file: read 12%, cipher 97%, write 4% busy over 1.52s
+    """
+
+    def __init__(self, out=None):
+        self.out = out
+        self._busy = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, operation, phase, seconds, nbytes, ok):
+        with self._lock:
+            if phase.startswith("busy_"):
+                self._busy.setdefault(operation, {})[phase[len("busy_"):]] = seconds
+                return
+            if phase != "pipeline":
+                return
+            busy = self._busy.pop(operation, {})
+        parts = [f"{stage} {100 * busy.get(stage, 0.0) / seconds:.0f}%" if seconds > 0 else f"{stage} -"
+                 for stage in STAGES]
+        print(f"{operation}: {', '.join(parts)} busy over {seconds:.2f}s", file=self.out or sys.stderr)
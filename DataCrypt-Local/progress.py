@@ -0,0 +1,62 @@
+"""Progress reporting and cancellation for long-running encrypt/decrypt calls.
+
+encrypt_file and decrypt_file accept a `progress` callback, called as
+progress(bytes_done, bytes_total) after each chunk, and a `cancel_event`
+(threading.Event). Setting the event makes the call stop at the next chunk,
+remove its partial output and raise OperationCancelled.
+"""
+import time
+
+
+class OperationCancelled(Exception):
+    """Raised when an encryption or decryption was cancelled through its cancel_event."""
+
+
+class Reporter:
+    """Forwards per-chunk progress to a callback and checks for cancellation."""
+
+    def __init__(self, total, callback=None, cancel_event=None):
+        self.total = total
+        self.done = 0
+        self._callback = callback
+        self._cancel_event = cancel_event
+
+    def check(self):
+        if self._cancel_event is not None and self._cancel_event.is_set():
+            raise OperationCancelled("Operation cancelled.")
+
+    def advance(self, n):
+        self.check()
+        self.done += n
+        if self._callback is not None:
+            self._callback(self.done, self.total)
+
+
+class Throughput:
+    """Turns (bytes done, bytes total) samples into a rate and an ETA."""
+
+    def __init__(self):
+        self.start = time.monotonic()
+
+    def rate(self, done):
+        """Average bytes per second since start."""
+        elapsed = time.monotonic() - self.start
+        return done / elapsed if elapsed > 0 else 0.0
+
+    def eta(self, done, total):
+        """Estimated seconds remaining, or None while the rate is unknown."""
+        rate = self.rate(done)
+        if rate <= 0:
+            return None
+        return max(0.0, (total - done) / rate)
+
+    def describe(self, done, total):
+        """Human-readable summary, e.g. '45% - 12.0/26.7 MB - 118.2 MB/s - ETA 0:03'."""
+        mb = 1024 * 1024
+        percent = 100 * done // total if total else 100
+        text = f"{percent}% - {done / mb:.1f}/{total / mb:.1f} MB - {self.rate(done) / mb:.1f} MB/s"
+        eta = self.eta(done, total)
+        if eta is not None and done < total:
+            minutes, seconds = divmod(int(eta + 0.5), 60)
+            text += f" - ETA {minutes}:{seconds:02d}"
+        return text
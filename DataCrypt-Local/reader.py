@@ -0,0 +1,104 @@
+"""Random-access, read-only view of an encrypted container.
+
+Only the chunks overlapping the requested byte range are read and decrypted,
+so reading the last megabyte of a huge file costs about one megabyte of work.
+"""
+import io
+import os
+from bisect import bisect_right
+
+from decryptor import open_container
+
+
+class EncryptedFileReader(io.RawIOBase):
+    """Seekable file-like object returning the plaintext of a container."""
+
+    def __init__(self, encrypted_file_path, private_key_path=None, keyring=None):
+        super().__init__()
+        self._f = open(encrypted_file_path, "rb")
+        try:
+            self.header, self._cipher = open_container(self._f, private_key_path, keyring)
+            if self.header.streamed:
+                raise ValueError("Streamed containers have no chunk table, so they can only be decrypted in full.")
+        except Exception:
+            self._f.close()
+            raise
+        self._plain_offsets = self.header.plaintext_offsets()
+        self._chunk_offsets = self.header.chunk_offsets()
+        self._pos = 0
+        # Last decrypted chunk, so sequential small reads don't re-decrypt it
+        self._cached_index = None
+        self._cached_plaintext = b""
+
+    @property
+    def size(self):
+        return self.header.plaintext_size
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            pos = offset
+        elif whence == os.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == os.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if pos < 0:
+            raise ValueError("Negative seek position.")
+        self._pos = pos
+        return pos
+
+    def _chunk(self, index):
+        if index != self._cached_index:
+            _, stored_len = self.header.chunks[index]
+            self._f.seek(self._chunk_offsets[index])
+            data = self._f.read(stored_len)
+            if len(data) != stored_len:
+                raise ValueError("Encrypted file is truncated. Decryption failed.")
+            self._cached_plaintext = self._cipher.open(index, data)
+            self._cached_index = index
+        return self._cached_plaintext
+
+    def readinto(self, b):
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        view = memoryview(b).cast("B")
+        filled = 0
+        while filled < len(view) and self._pos < self.size:
+            index = bisect_right(self._plain_offsets, self._pos) - 1
+            plaintext = self._chunk(index)
+            start = self._pos - self._plain_offsets[index]
+            n = min(len(view) - filled, len(plaintext) - start)
+            view[filled:filled + n] = plaintext[start:start + n]
+            filled += n
+            self._pos += n
+        return filled
+
+    def close(self):
+        if not self.closed:
+            self._f.close()
+            self._cached_plaintext = b""
+        super().close()
+
+
+def open_encrypted(encrypted_file_path, private_key_path=None, keyring=None):
+    """Open a container for random-access reading.
+
+    The private key is taken from private_key_path, or else picked from keyring
+    by the recipient key ids in the header (see decryptor.open_container).
+
+    Example:
+        with open_encrypted("app.log.enc", "keys/private_key.pem") as f:
+            f.seek(-1024 * 1024, os.SEEK_END)
+            tail = f.read()
+    """
+    return EncryptedFileReader(encrypted_file_path, private_key_path, keyring)
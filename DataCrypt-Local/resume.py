@@ -0,0 +1,179 @@
+"""Checkpoint journals that let an interrupted encrypt_file or decrypt_file pick up where it stopped.
+
+With resumable=True, the output is written to <output>.part and progress is
+logged to a journal, a JSON-lines file (see journal_path_for):
+
+    {"run": {...}, "state": {...}}                  what is being done: input size and
+                                                    mtime, settings, and any state needed
+                                                    to carry on (e.g. the container header)
+    {"done": 120, "written": 125831616, ...}        one line per checkpoint: chunks
+                                                    completed and output bytes they fill
+
+Before a checkpoint line is appended the output is fsynced, so the journal
+never points past data that could be lost in a crash or reboot. Running the
+same call again reads the journal and continues after the last checkpoint; if
+the input or the settings changed, it starts over. On success the output is
+fsynced, renamed into place and the journal removed, so a finished file is
+never partial and an existing file is only replaced by a complete one. The
+rename follows the caller's fsync policy (see output.py); checkpoints are
+fsynced whatever it is, as resuming depends on them.
+
+An encryption journal holds the file's content key (the chunks written so far
+are sealed with it, and the encrypting side has only public keys, so it could
+not unwrap a stored header). Journals are therefore kept away from the data,
+owner-only, under KEY_DIR/journals next to the private keys.
+"""
+import hashlib
+import json
+import os
+
+# Plaintext bytes processed between checkpoints; at most this much work is redone after a crash
+CHECKPOINT_BYTES = 64 * 1024 * 1024
+
+
+def part_path_for(out_path):
+    return out_path + ".part"
+
+
+def journal_path_for(out_path, journal_dir=None):
+    """Journal location for out_path: KEY_DIR/journals/<hash of its absolute path>.journal."""
+    if journal_dir is None:
+        import key_manager
+
+        journal_dir = os.path.join(key_manager.KEY_DIR, "journals")
+    digest = hashlib.sha256(os.path.abspath(out_path).encode()).hexdigest()[:32]
+    return os.path.join(journal_dir, digest + ".journal")
+
+
+def source_identity(path):
+    """Size and modification time of an input, which a resumed run must find unchanged."""
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+class Journal:
+    """Checkpoint journal for writing out_path; see the module docstring.
+
+    After construction, resumed tells whether an earlier run of the same job
+    left a usable journal; done, written, chunks and state then describe how
+    far it got. Otherwise they describe an empty output.
+    """
+
+    def __init__(self, out_path, run, interval=None, journal_dir=None):
+        self.out_path = out_path
+        self.part_path = part_path_for(out_path)
+        self.path = journal_path_for(out_path, journal_dir)
+        self.run = run
+        self.interval = interval or CHECKPOINT_BYTES
+        self.resumed = False
+        self.state = None
+        self.done = 0  # chunks completed
+        self.written = 0  # bytes of output they fill
+        self.chunks = []  # per-chunk records, for writers that need them
+        self._pending = []
+        self._since = 0
+        self._valid_size = 0
+        self._file = None
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+            part_size = os.path.getsize(self.part_path)
+        except OSError:
+            return
+        lines = data.split(b"\n")
+        try:
+            first = json.loads(lines[0])
+        except ValueError:
+            return
+        if not isinstance(first, dict) or first.get("run") != self.run:
+            return
+        valid_size = len(lines[0]) + 1
+        records = []
+        # The last line is empty unless a crash tore it, in which case it is dropped
+        for line in lines[1:-1]:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+            valid_size += len(line) + 1
+        chunks = [chunk for record in records for chunk in record.get("chunks", [])]
+        done = records[-1]["done"] if records else 0
+        written = records[-1]["written"] if records else 0
+        if part_size < written or (chunks and len(chunks) != done):
+            return
+        self.resumed = True
+        self.state = first.get("state")
+        self.done = done
+        self.written = written
+        self.chunks = chunks
+        self._valid_size = valid_size
+
+    def begin(self, state=None):
+        """Open the journal for new checkpoints; a fresh journal records state with the run."""
+        if self.resumed:
+            self._file = open(self.path, "r+")
+            self._file.truncate(self._valid_size)
+            self._file.seek(self._valid_size)
+            return
+        self.state = state
+        # Owner-only: an encryption journal holds the content key
+        os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        self._file = os.fdopen(fd, "w")
+        self._append({"run": self.run, "state": state})
+
+    def _append(self, record):
+        self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def record(self, dst, nbytes, written, chunk=None):
+        """Note one more completed chunk of nbytes input, with output now written bytes long.
+
+        chunk is an optional JSON-serialisable record kept for the writer.
+        A checkpoint is taken once `interval` input bytes have built up.
+        """
+        self.done += 1
+        self.written = written
+        if chunk is not None:
+            self.chunks.append(chunk)
+            self._pending.append(chunk)
+        self._since += nbytes
+        if self._since >= self.interval:
+            self.checkpoint(dst)
+
+    def checkpoint(self, dst):
+        """Make the output written so far durable, then log how far it goes."""
+        dst.flush()
+        os.fsync(dst.fileno())
+        record = {"done": self.done, "written": self.written}
+        if self._pending:
+            record["chunks"] = self._pending
+        self._append(record)
+        self._pending = []
+        self._since = 0
+
+    def finish(self, fsync=None):
+        """Move the completed (and checkpointed) output into place under the fsync policy and drop the journal."""
+        import output
+
+        self.close()
+        output.replace(self.part_path, self.out_path, fsync)
+        os.remove(self.path)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def open_output(self):
+        """Open the .part file for writing at the last checkpoint (from the start if not resumed)."""
+        if not self.resumed:
+            return open(self.part_path, "wb")
+        dst = open(self.part_path, "r+b")
+        dst.truncate(self.written)
+        dst.seek(self.written)
+        return dst
@@ -0,0 +1,66 @@
+"""Encryption sessions: one ephemeral key and one ECDH exchange per batch instead of per file.
+
+Every container carries an ephemeral public key, a random HKDF salt and the
+content key wrapped under HKDF(ECDH secret, salt) for each recipient (see
+container.py). Outside a session each file draws a new ephemeral key, so
+encrypting 100k small files costs 100k key generations and 100k exchanges
+per recipient, which dominates the run time.
+
+An EncryptionSession draws the ephemeral key and does the exchange with each
+recipient once, and the files encrypted in it differ only in their salt and
+content key. As the salt is unique per file, so is every key derived from the
+shared secret. The container format is unchanged, so any DataCrypt version
+decrypts session files; shared_secret() caches the exchange on the decrypting
+side, so a whole batch also decrypts with a single ECDH. The cached secrets
+decrypt every file of their session, so whoever runs a decryption job calls
+clear_shared_secrets() when it ends rather than keeping them for the life of
+the process.
+
+Files of one session carry the same ephemeral public key, which shows that
+they were encrypted together. Use one session per batch, and don't keep it
+around: the ephemeral private key stays in memory for as long as it lives.
+"""
+from functools import lru_cache
+
+from cryptography.hazmat.primitives.asymmetric import ec
+
+import container
+import metrics
+
+# Exchanges remembered by shared_secret(): one per (private key, session) pair
+SHARED_SECRET_CACHE_SIZE = 64
+
+
+class EncryptionSession:
+    """An ephemeral key pair and its ECDH secrets with every recipient, shared by many files.
+
+    Pass a session to encryptor.encrypt_file() in place of the recipient keys.
+    public_keys are parsed keys (see encryptor.load_public_key); the session is
+    safe to use from several threads.
+    """
+
+    def __init__(self, public_keys, operation="encrypt_file"):
+        if not public_keys:
+            raise ValueError("At least one recipient public key is required.")
+        self.public_keys = list(public_keys)
+        with metrics.span(operation, "keygen"):
+            self._ephemeral_private_key = ec.generate_private_key(container.CURVE)
+        self.ephemeral_public_bytes = container.compress_public_key(self._ephemeral_private_key.public_key())
+        with metrics.span(operation, "ecdh"):
+            self.shared_keys = [self._ephemeral_private_key.exchange(ec.ECDH(), key) for key in self.public_keys]
+
+
+@lru_cache(maxsize=SHARED_SECRET_CACHE_SIZE)
+def shared_secret(private_key, ephemeral_public_bytes):
+    """ECDH between private_key and a container's ephemeral public key, cached per session.
+
+    Parsed private keys are cached by key_ring, so every file of a session
+    decrypted with the same key finds the secret here.
+    """
+    ephemeral_public_key = ec.EllipticCurvePublicKey.from_encoded_point(container.CURVE, ephemeral_public_bytes)
+    return private_key.exchange(ec.ECDH(), ephemeral_public_key)
+
+
+def clear_shared_secrets():
+    """Forget the exchanges cached by shared_secret(); call when a decryption job ends."""
+    shared_secret.cache_clear()
@@ -0,0 +1,169 @@
+"""Encryption and decryption between streams, for pipelines and asyncio services.
+
+    pg_dump mydb | python datacrypt.py encrypt - -r backup.pem | upload
+
+encrypt_stream() reads any readable binary stream and writes a FLAG_STREAM
+container (see container.py) to any writable one; neither needs to be
+seekable, and the input size need not be known. decrypt_stream() reads any
+container, streamed or not, and writes the plaintext. Plaintext never goes to
+disk, and memory use stays at a few chunks whatever the stream length.
+
+encrypt_stream_async() and decrypt_stream_async() do the same between an
+asyncio StreamReader and StreamWriter. The work runs on a thread, as the
+blocking versions, so the event loop stays responsive; every write waits for
+writer.drain(), so a slow consumer slows the producer down instead of
+filling memory.
+"""
+import asyncio
+import functools
+import io
+import threading
+
+import compression
+import container
+import engines
+import metrics
+from progress import Reporter
+
+
+def encrypt_stream(src, dst, public_key_str, chunk_size=container.DEFAULT_CHUNK_SIZE, workers=None, compress=None,
+                   compress_level=None, progress=None, cancel_event=None, cipher=None):
+    """Encrypt everything readable from src into a container written to dst; returns the plaintext size.
+
+    public_key_str is a recipient key or list of keys, and cipher a chunk
+    engine name, as for encrypt_file.
+    progress(bytes_done, bytes_total) gets a total of 0, since the size of a
+    stream is unknown. dst is flushed but not closed.
+    """
+    import encryptor
+
+    if chunk_size <= 0 or chunk_size % 16:
+        raise ValueError("chunk_size must be a positive multiple of 16 bytes.")
+    codec = compression.codec_id(compress)
+    cipher_id = engines.engine_id(cipher)
+    recipients = public_key_str if isinstance(public_key_str, (list, tuple)) else [public_key_str]
+    if not recipients:
+        raise ValueError("At least one recipient public key is required.")
+    with metrics.span("encrypt_stream", "load_key"):
+        public_keys = [encryptor.load_public_key(key) if isinstance(key, str) else key for key in recipients]
+
+    reporter = Reporter(0, progress, cancel_event)
+    total_phase = metrics.span("encrypt_stream", "total")
+    with total_phase:
+        encryptor.write_stream_container(src, dst, public_keys, chunk_size, workers, reporter, codec, compress_level,
+                                         cipher_id=cipher_id)
+        total_phase.nbytes = reporter.done
+    return reporter.done
+
+
+def decrypt_stream(src, dst, private_key_path=None, keyring=None, workers=None, progress=None, cancel_event=None):
+    """Decrypt the container read from src, writing its plaintext to dst; returns the plaintext size.
+
+    src may hold a streamed or a regular container and is read strictly
+    sequentially. The private key is resolved as in decrypt_file. dst is
+    flushed but not closed. If decryption fails part way, dst has already
+    received the chunks before the bad one, all of them authenticated.
+    """
+    import decryptor
+
+    reporter = Reporter(0, progress, cancel_event)
+    total_phase = metrics.span("decrypt_stream", "total")
+    with total_phase:
+        header, chunk_cipher = decryptor.open_container(src, private_key_path, keyring, "decrypt_stream")
+        if not header.streamed:
+            reporter.total = header.plaintext_size
+        write_phase = metrics.accumulator("decrypt_stream", "write")
+        write = write_phase.wrap(dst.write)
+        for plaintext in decryptor._iter_plaintext(src, header, chunk_cipher, workers, reporter,
+                                                   operation="decrypt_stream"):
+            write(plaintext)
+        if hasattr(dst, "flush"):
+            dst.flush()
+        write_phase.emit()
+        total_phase.nbytes = reporter.done
+    return reporter.done
+
+
+class _AsyncSource(io.RawIOBase):
+    """Blocking file-like view of an asyncio StreamReader, for use off the event loop thread."""
+
+    def __init__(self, reader, loop):
+        super().__init__()
+        self._reader = reader
+        self._loop = loop
+        self.pending = None
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        view = memoryview(b).cast("B")
+        self.pending = asyncio.run_coroutine_threadsafe(self._reader.read(len(view)), self._loop)
+        data = self.pending.result()
+        view[:len(data)] = data
+        return len(data)
+
+
+class _AsyncSink(io.RawIOBase):
+    """Blocking file-like view of an asyncio StreamWriter; every write waits for drain()."""
+
+    def __init__(self, writer, loop):
+        super().__init__()
+        self._writer = writer
+        self._loop = loop
+        self.pending = None
+
+    def writable(self):
+        return True
+
+    async def _write(self, data):
+        self._writer.write(data)
+        await self._writer.drain()
+
+    def write(self, b):
+        # Copied: the transport may keep the buffer, and ours are reused for later chunks
+        data = bytes(b)
+        self.pending = asyncio.run_coroutine_threadsafe(self._write(data), self._loop)
+        self.pending.result()
+        return len(data)
+
+
+async def _run_on_thread(func, src, dst, *args, **kwargs):
+    """Run func(src, dst, *args, cancel_event, **kwargs) on a thread; cancelling the task stops it at the next chunk."""
+    loop = asyncio.get_running_loop()
+    cancel_event = threading.Event()
+    job = loop.run_in_executor(None, functools.partial(func, src, dst, *args, cancel_event=cancel_event, **kwargs))
+    try:
+        return await asyncio.shield(job)
+    except asyncio.CancelledError:
+        cancel_event.set()
+        # The thread ends with OperationCancelled (or a cancelled read); nobody awaits it any more
+        job.add_done_callback(lambda done: done.exception())
+        # Unblock a thread waiting on the reader or writer, so it sees the event
+        for stream in (src, dst):
+            if stream.pending is not None:
+                stream.pending.cancel()
+        raise
+
+
+async def encrypt_stream_async(reader, writer, public_key_str, chunk_size=container.DEFAULT_CHUNK_SIZE, workers=None,
+                               compress=None, compress_level=None, progress=None, cipher=None):
+    """Encrypt everything from an asyncio StreamReader into a container written to a StreamWriter.
+
+    Arguments and result are as for encrypt_stream(); progress is called from
+    the worker thread. The writer is drained but not closed.
+    """
+    loop = asyncio.get_running_loop()
+    return await _run_on_thread(encrypt_stream, _AsyncSource(reader, loop), _AsyncSink(writer, loop), public_key_str,
+                                chunk_size, workers, compress, compress_level, progress, cipher=cipher)
+
+
+async def decrypt_stream_async(reader, writer, private_key_path=None, keyring=None, workers=None, progress=None):
+    """Decrypt a container from an asyncio StreamReader, writing the plaintext to a StreamWriter.
+
+    Arguments and result are as for decrypt_stream(); progress is called from
+    the worker thread. The writer is drained but not closed.
+    """
+    loop = asyncio.get_running_loop()
+    return await _run_on_thread(decrypt_stream, _AsyncSource(reader, loop), _AsyncSink(writer, loop),
+                                private_key_path, keyring, workers, progress)
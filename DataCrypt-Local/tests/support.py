@@ -0,0 +1,57 @@
+"""Helpers shared by the tests: put the application modules on sys.path, make keys."""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(HERE)
+
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+
+def make_keys(directory):
+    """Write a fresh key pair into directory; return (recipient public key, private key path)."""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+
+    import key_ring
+
+    private_key = ec.generate_private_key(ec.SECP384R1())
+    private_path = os.path.join(directory, "private_key.pem")
+    public_path = os.path.join(directory, "public_key.pem")
+    with open(private_path, "wb") as f:
+        f.write(private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                          serialization.NoEncryption()))
+    with open(public_path, "wb") as f:
+        f.write(private_key.public_key().public_bytes(serialization.Encoding.PEM,
+                                                      serialization.PublicFormat.SubjectPublicKeyInfo))
+    return key_ring.read_recipient(public_path), private_path
+
+
+class KeyedTestCase(unittest.TestCase):
+    """A test with its own directory (.dir) and key pair, and KEY_DIR pointed into it."""
+
+    def setUp(self):
+        import key_manager
+
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.public_key, self.private_key_path = make_keys(self.dir)
+        patcher = mock.patch.object(key_manager, "KEY_DIR", os.path.join(self.dir, "keys"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write(self, name, data):
+        """Write data to the file name in .dir and return its path."""
+        path = os.path.join(self.dir, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def read(self, name):
+        with open(os.path.join(self.dir, name), "rb") as f:
+            return f.read()
@@ -0,0 +1,46 @@
+"""Encrypted directory archives (archive.py)."""
+import os
+import unittest
+
+from support import KeyedTestCase
+
+import archive
+
+
+class MemberPathTest(unittest.TestCase):
+    def test_names_that_escape_the_destination_are_rejected(self):
+        for name in ("", "/etc/passwd", "../up", "a/../../up", "a//b", "./a", "a\\..\\b", "a/"):
+            with self.subTest(name=name):
+                with self.assertRaises(ValueError):
+                    archive._member_path("dest", name)
+
+    def test_nested_names_stay_under_the_destination(self):
+        self.assertEqual(archive._member_path("dest", "a/b/c.txt"), os.path.join("dest", "a", "b", "c.txt"))
+
+
+class ArchiveTest(KeyedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.source = os.path.join(self.dir, "project")
+        os.makedirs(os.path.join(self.source, "conf"))
+        self.files = {"readme.txt": b"hello\n", "conf/settings.json": b"{}", "data.bin": os.urandom(200000)}
+        for name, data in self.files.items():
+            self.write(os.path.join("project", name), data)
+        self.archive_path = os.path.join(self.dir, "project.enc")
+        archive.create_archive(self.source, self.public_key, self.archive_path, chunk_size=64 * 1024, verbose=False)
+
+    def test_list_and_extract_everything(self):
+        names = [member["name"] for member in archive.list_archive(self.archive_path, self.private_key_path)]
+        self.assertEqual(sorted(names), sorted(self.files))
+        dest = os.path.join(self.dir, "restored")
+        archive.extract_archive(self.archive_path, dest, private_key_path=self.private_key_path, verbose=False)
+        for name, data in self.files.items():
+            self.assertEqual(self.read(os.path.join("restored", name)), data)
+
+    def test_read_one_member(self):
+        with archive.open_archive(self.archive_path, self.private_key_path) as opened:
+            self.assertEqual(opened.read("conf/settings.json"), b"{}")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,24 @@
+"""Input selection of batch.py."""
+import os
+import shutil
+import tempfile
+import unittest
+
+import support  # puts the application modules on sys.path
+
+import batch
+
+
+class ExpandPathsTest(unittest.TestCase):
+    def test_outputs_and_temp_files_are_skipped(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for name in ("a.txt", "a.txt.enc", "b.key", ".a.txt.enc.1f2e3d4c.tmp", "notes.tmp"):
+            with open(os.path.join(directory, name), "wb") as f:
+                f.write(b"x")
+        found = sorted(os.path.basename(path) for path in batch.expand_paths([directory]))
+        self.assertEqual(found, ["a.txt", "notes.tmp"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+"""Content-defined chunking and chunk reuse of incremental.py."""
+import hashlib
+import io
+import os
+import random
+import unittest
+
+from support import KeyedTestCase
+
+import decryptor
+import incremental
+import output
+
+
+def _chunks(data, *args, **kwargs):
+    return list(incremental.iter_content_chunks(io.BytesIO(data), *args, **kwargs))
+
+
+class ChunkingTest(unittest.TestCase):
+    def setUp(self):
+        self.data = random.Random(15).randbytes(2 * 1024 * 1024)
+
+    def test_chunks_cover_the_input_within_bounds(self):
+        chunks = _chunks(self.data, 16 * 1024)
+        self.assertEqual(b"".join(chunks), self.data)
+        for chunk in chunks[:-1]:
+            self.assertGreaterEqual(len(chunk), 4 * 1024)
+            self.assertLessEqual(len(chunk), 64 * 1024)
+        self.assertLess(abs(len(self.data) / len(chunks) - 16 * 1024), 8 * 1024)
+
+    def test_boundaries_do_not_depend_on_the_reads(self):
+        expected = _chunks(self.data, 16 * 1024)
+        for read_size in (1000, 77777, len(self.data)):
+            self.assertEqual(_chunks(self.data, 16 * 1024, read_size=read_size), expected)
+
+    def test_insert_into_binary_data_moves_only_nearby_boundaries(self):
+        before = {hashlib.sha256(chunk).digest() for chunk in _chunks(self.data, 16 * 1024)}
+        edited = self.data[:1000000] + b"inserted" + self.data[1000005:]
+        after = [hashlib.sha256(chunk).digest() for chunk in _chunks(edited, 16 * 1024)]
+        self.assertLessEqual(sum(digest not in before for digest in after), 2)
+
+    def test_maximum_cuts_data_without_boundaries(self):
+        self.assertEqual([len(chunk) for chunk in _chunks(bytes(100000), 4096)], [16384] * 6 + [1696])
+
+    def test_empty_input_is_one_empty_chunk(self):
+        self.assertEqual(_chunks(b""), [b""])
+
+
+class ReuseTest(KeyedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.manifest = os.path.join(self.dir, "manifest.json")
+
+    def _encrypt(self, data, fsync=None):
+        self.path = self.write("data.bin", data)
+        stats = incremental.encrypt_incremental(self.path, self.public_key, manifest_path=self.manifest,
+                                                average_chunk_size=16 * 1024, verbose=False, fsync=fsync)
+        if isinstance(fsync, output.FsyncBatch):
+            fsync.flush()
+        decryptor.decrypt_file(self.path + ".enc", None, self.private_key_path, verbose=False)
+        self.assertEqual(self.read("data-decrypted.bin"), data)
+        return stats
+
+    def test_second_run_encrypts_only_the_changed_chunks(self):
+        data = random.Random(16).randbytes(1024 * 1024)
+        first = self._encrypt(data)
+        self.assertEqual(first["reused_chunks"], 0)
+        second = self._encrypt(data[:500000] + b"changed" + data[500000:])
+        self.assertLessEqual(second["encrypted_chunks"], 2)
+        self.assertEqual(second["reused_chunks"] + second["encrypted_chunks"], second["chunks"])
+
+    def test_batched_output_is_reused_and_leaves_no_temp_files(self):
+        data = random.Random(17).randbytes(256 * 1024)
+        self._encrypt(data, output.FsyncBatch())
+        stats = self._encrypt(data, output.FsyncBatch())
+        self.assertEqual(stats["encrypted_chunks"], 0)
+        self.assertEqual([name for name in os.listdir(self.dir) if name.startswith(".")], [])
+
+    def test_default_manifest_lives_under_key_dir(self):
+        self.path = self.write("data.bin", b"data")
+        incremental.encrypt_incremental(self.path, self.public_key, verbose=False)
+        manifest = incremental.manifest_path_for(self.path)
+        self.assertTrue(manifest.startswith(os.path.join(self.dir, "keys", "manifests")))
+        self.assertIsNotNone(incremental.load_manifest(manifest))
+
+    def test_manifest_is_owner_only(self):
+        self._encrypt(b"secret")
+        if os.name == "posix":
+            self.assertEqual(os.stat(self.manifest).st_mode & 0o777, 0o600)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+"""Locating damage in containers (integrity.py) and `datacrypt verify`."""
+import contextlib
+import io
+import os
+import random
+import unittest
+
+from support import KeyedTestCase
+
+import container
+import datacrypt
+import encryptor
+import incremental
+import integrity
+import pipeline
+
+CHUNK_SIZE = 64 * 1024
+
+
+class ScrubTest(KeyedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = random.Random(3).randbytes(3 * CHUNK_SIZE + 500)
+        self.path = self.write("data.bin", self.data)
+        self.enc_path = self.path + ".enc"
+
+    def _header(self):
+        with open(self.enc_path, "rb") as f:
+            return container.ContainerHeader.read(f)
+
+    def _flip(self, offset):
+        with open(self.enc_path, "r+b") as f:
+            f.seek(offset)
+            byte = f.read(1)
+            f.seek(offset)
+            f.write(bytes([byte[0] ^ 0xFF]))
+
+    def _scrub(self, method):
+        return integrity.scrub_file(self.enc_path, method, self.private_key_path)
+
+    def test_intact_container(self):
+        encryptor.encrypt_file(self.path, self.public_key, chunk_size=CHUNK_SIZE, verbose=False)
+        for method in integrity.METHODS:
+            with self.subTest(method=method):
+                self.assertEqual(self._scrub(method), [])
+
+    def test_damaged_chunk_is_located(self):
+        encryptor.encrypt_file(self.path, self.public_key, chunk_size=CHUNK_SIZE, verbose=False)
+        header = self._header()
+        start = header.chunk_offsets()[1]
+        self._flip(start + 10)
+        for method in integrity.METHODS:
+            with self.subTest(method=method):
+                damaged = self._scrub(method)
+                self.assertEqual(len(damaged), 1)
+                damage = damaged[0]
+                self.assertEqual((damage["chunk"], damage["start"], damage["end"]),
+                                 (1, start, start + header.chunks[1][1]))
+                self.assertEqual((damage["plain_start"], damage["plain_end"]), (CHUNK_SIZE, 2 * CHUNK_SIZE))
+                self.assertIn("(chunk 1, plaintext 65536-131071)", integrity.describe(damage))
+
+    def test_damaged_hash_list_fails_the_merkle_root(self):
+        encryptor.encrypt_file(self.path, self.public_key, chunk_size=CHUNK_SIZE, verbose=False)
+        header = self._header()
+        hashes_start = header.size - container.HASH_SIZE * (header.chunk_count + 1)
+        self._flip(hashes_start)
+        damaged = self._scrub("sha256")
+        self.assertEqual([(d["reason"], d["start"], d["end"]) for d in damaged],
+                         [("chunk hashes do not match their Merkle root", hashes_start, header.size)])
+        # The chunks themselves are fine
+        self.assertEqual(self._scrub("gcm"), [])
+
+    def test_truncated_container(self):
+        encryptor.encrypt_file(self.path, self.public_key, chunk_size=CHUNK_SIZE, verbose=False)
+        header = self._header()
+        os.truncate(self.enc_path, header.chunk_offsets()[3] + 1)
+        for method in integrity.METHODS:
+            with self.subTest(method=method):
+                self.assertEqual([(d["chunk"], d["reason"]) for d in self._scrub(method)],
+                                 [(3, "missing (file is truncated)")])
+
+    def test_incremental_output_has_chunk_hashes(self):
+        incremental.encrypt_incremental(self.path, self.public_key, average_chunk_size=16 * 1024, verbose=False)
+        self.assertEqual(self._scrub("sha256"), [])
+        # Re-encrypting after an edit reuses chunks together with their hashes
+        self.data = self.data[:1000] + b"edit" + self.data[1000:]
+        self.write("data.bin", self.data)
+        stats = incremental.encrypt_incremental(self.path, self.public_key, average_chunk_size=16 * 1024, verbose=False)
+        self.assertGreater(stats["reused_chunks"], 0)
+        self.assertEqual(self._scrub("sha256"), [])
+
+        header = self._header()
+        self._flip(header.chunk_offsets()[-1])
+        for method in integrity.METHODS:
+            with self.subTest(method=method):
+                self.assertEqual([d["chunk"] for d in self._scrub(method)], [header.chunk_count - 1])
+
+    def test_memory_budget_applies(self):
+        encryptor.encrypt_file(self.path, self.public_key, chunk_size=CHUNK_SIZE, verbose=False)
+        pipeline.set_max_memory(CHUNK_SIZE)
+        self.addCleanup(pipeline.set_max_memory, None)
+        # Too small for even one worker's chunk buffers
+        for method in integrity.METHODS:
+            with self.subTest(method=method):
+                with self.assertRaises(ValueError):
+                    self._scrub(method)
+        with self.assertRaises(ValueError):
+            incremental.encrypt_incremental(self.path, self.public_key, average_chunk_size=CHUNK_SIZE, verbose=False)
+        self.assertEqual(sorted(os.listdir(self.dir)), ["data.bin", "data.bin.enc", "private_key.pem", "public_key.pem"])
+
+    def test_verify_command(self):
+        encryptor.encrypt_file(self.path, self.public_key, chunk_size=CHUNK_SIZE, verbose=False)
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.assertTrue(datacrypt.verify([self.enc_path], method="sha256"))
+        self.assertEqual(out.getvalue(), f"OK     {self.enc_path}\n")
+
+        self._flip(self._header().chunk_offsets()[0])
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.assertFalse(datacrypt.verify([self.enc_path], self.private_key_path))
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], f"BAD    {self.enc_path}")
+        self.assertIn("(chunk 0, plaintext 0-65535)", lines[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
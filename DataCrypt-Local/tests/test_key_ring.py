@@ -0,0 +1,84 @@
+"""Identities, contacts and the shared default key ring (key_ring.py)."""
+import os
+import unittest
+
+from support import KeyedTestCase, make_keys
+
+import decryptor
+import encryptor
+import key_manager
+import key_ring
+
+
+class KeyRingTest(KeyedTestCase):
+    def test_decrypt_without_key_path_uses_key_dir(self):
+        # The ring is resolved from KEY_DIR when decrypting, not when key_ring is imported
+        key_manager.generate_key_pair()
+        public_key = key_ring.read_recipient(os.path.join(key_manager.KEY_DIR, "public_key.pem"))
+        path = self.write("data.bin", b"secret" * 1000)
+        encryptor.encrypt_file(path, public_key, verbose=False)
+        decryptor.decrypt_file(path + ".enc", None, None, verbose=False)
+        self.assertEqual(self.read("data-decrypted.bin"), b"secret" * 1000)
+
+    def test_default_keyring_follows_key_dir(self):
+        key_manager.generate_key_pair()
+        ring = key_ring.default_keyring()
+        self.assertEqual(ring.directory, key_manager.KEY_DIR)
+        self.assertIs(key_ring.default_keyring(), ring)
+
+        other_dir = os.path.join(self.dir, "other")
+        os.makedirs(other_dir)
+        make_keys(other_dir)
+        key_manager.KEY_DIR = other_dir
+        other = key_ring.default_keyring()
+        self.assertIsNot(other, ring)
+        self.assertEqual(other.directory, other_dir)
+        self.assertNotEqual(other.identities(), ring.identities())
+
+    def test_default_keyring_sees_new_identities(self):
+        ring = key_ring.default_keyring()
+        self.assertEqual(ring.identities(), [])
+        fp = key_ring.KeyRing().generate_identity()
+        self.assertEqual(key_ring.default_keyring().identities(), [fp])
+
+    def test_find_identity(self):
+        ring = key_ring.KeyRing(cache_size=1)
+        first, second = ring.generate_identity(), ring.generate_identity()
+        unknown = bytes(len(bytes.fromhex(first)))
+        fp, private_key = ring.find_identity([unknown, bytes.fromhex(second)])
+        self.assertEqual(fp, second)
+        self.assertIs(ring.private_key(second), private_key)
+        self.assertEqual(ring.find_identity([unknown]), (None, None))
+
+        # With room for one key, loading the other evicts it
+        ring.private_key(first)
+        self.assertNotIn(second, ring._cache)
+
+    def test_contacts(self):
+        ring = key_ring.KeyRing()
+        fp = ring.add_contact("alice", self.public_key)
+        self.assertEqual(ring.contacts(), {"alice": fp})
+        self.assertEqual(key_ring.read_recipient("@alice", ring), self.public_key)
+        self.assertEqual(key_ring.fingerprint(ring.contact("alice")), fp)
+
+        # Other rings over the same directory see the contact through the index
+        self.assertEqual(key_ring.read_recipient("@alice"), self.public_key)
+
+        ring.remove_contact("alice")
+        self.assertEqual(ring.contacts(), {})
+        self.assertFalse(os.listdir(os.path.join(key_manager.KEY_DIR, "contacts")))
+        with self.assertRaises(ValueError):
+            key_ring.read_recipient("@alice", ring)
+
+    def test_contact_names_stay_in_contacts_directory(self):
+        ring = key_ring.KeyRing()
+        for name in ("", ".", "..", "../evil", "a/b", "a\\b", "/tmp/evil"):
+            with self.subTest(name=name):
+                with self.assertRaises(ValueError):
+                    ring.add_contact(name, self.public_key)
+        self.assertEqual(ring.contacts(), {})
+        self.assertFalse(os.path.exists(os.path.join(key_manager.KEY_DIR, "evil.pem")))
+
+
+if __name__ == "__main__":
+    unittest.main()
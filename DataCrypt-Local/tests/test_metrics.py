@@ -0,0 +1,89 @@
+"""Phase records and their exporters (metrics.py)."""
+import json
+import os
+import unittest
+from unittest import mock
+
+from support import KeyedTestCase
+
+import encryptor
+import metrics
+
+
+class JsonLinesExporterTest(KeyedTestCase):
+    def test_one_record_per_phase(self):
+        log_path = os.path.join(self.dir, "metrics.jsonl")
+        previous = metrics.set_exporter(metrics.JsonLinesExporter(log_path))
+        self.addCleanup(metrics.set_exporter, previous)
+        path = self.write("data.bin", b"x" * 100000)
+        encryptor.encrypt_file(path, self.public_key, verbose=False)
+
+        with open(log_path, "r") as f:
+            records = [json.loads(line) for line in f]
+        for record in records:
+            self.assertEqual(sorted(record), ["bytes", "ok", "operation", "phase", "seconds", "time"])
+            self.assertEqual(record["operation"], "encrypt_file")
+            self.assertTrue(record["ok"])
+            self.assertGreaterEqual(record["seconds"], 0)
+        phases = [record["phase"] for record in records]
+        self.assertEqual(phases.count("total"), 1)
+        self.assertEqual(phases[-1], "total")
+        self.assertEqual(records[-1]["bytes"], 100000)
+
+    def test_records_are_appended(self):
+        log_path = os.path.join(self.dir, "metrics.jsonl")
+        exporter = metrics.JsonLinesExporter(log_path)
+        exporter("decrypt_file", "aes", 0.5, 1024, True)
+        metrics.JsonLinesExporter(log_path)("decrypt_file", "total", 0.75, 1024, False)
+        with open(log_path, "r") as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([(r["phase"], r["seconds"], r["bytes"], r["ok"]) for r in records],
+                         [("aes", 0.5, 1024, True), ("total", 0.75, 1024, False)])
+
+
+class PrometheusExporterTest(KeyedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.prom_path = os.path.join(self.dir, "datacrypt.prom")
+
+    def _read(self):
+        with open(self.prom_path, "r") as f:
+            return f.read()
+
+    def test_counters_are_written_per_operation(self):
+        exporter = metrics.PrometheusExporter(self.prom_path)
+        exporter("encrypt_file", "aes", 0.25, 4096, True)
+        # Only a finished operation rewrites the file
+        self.assertFalse(os.path.exists(self.prom_path))
+        exporter("encrypt_file", "total", 0.5, 4096, False)
+        text = self._read()
+        self.assertIn("# TYPE datacrypt_phase_seconds_total counter", text)
+        self.assertIn('datacrypt_phase_seconds_total{operation="encrypt_file",phase="aes"} 0.25', text)
+        self.assertIn('datacrypt_phase_bytes_total{operation="encrypt_file",phase="total"} 4096', text)
+        self.assertIn('datacrypt_phase_errors_total{operation="encrypt_file",phase="total"} 1', text)
+        self.assertEqual(os.listdir(self.dir).count("datacrypt.prom.tmp"), 0)
+
+    def test_counters_survive_restarts(self):
+        metrics.PrometheusExporter(self.prom_path)("decrypt_file", "total", 1.0, 10, True)
+        metrics.PrometheusExporter(self.prom_path)("decrypt_file", "total", 2.0, 5, True)
+        text = self._read()
+        self.assertIn('datacrypt_phase_seconds_total{operation="decrypt_file",phase="total"} 3.0', text)
+        self.assertIn('datacrypt_phase_bytes_total{operation="decrypt_file",phase="total"} 15', text)
+        self.assertIn('datacrypt_phase_calls_total{operation="decrypt_file",phase="total"} 2', text)
+
+    def test_file_is_replaced_atomically(self):
+        exporter = metrics.PrometheusExporter(self.prom_path)
+        exporter("decrypt_file", "total", 1.0, 10, True)
+        before = self._read()
+        # A scraper sees the old file or the new one, never a partial write
+        with mock.patch.object(metrics.os, "replace", side_effect=OSError("disk full")) as replace:
+            with self.assertRaises(OSError):
+                exporter("decrypt_file", "total", 1.0, 10, True)
+        replace.assert_called_once_with(self.prom_path + ".tmp", self.prom_path)
+        self.assertEqual(self._read(), before)
+        exporter.flush()
+        self.assertIn('datacrypt_phase_calls_total{operation="decrypt_file",phase="total"} 2', self._read())
+
+
+if __name__ == "__main__":
+    unittest.main()
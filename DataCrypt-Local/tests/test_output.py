@@ -0,0 +1,105 @@
+"""Atomic outputs and fsync policies of output.py."""
+import os
+import shutil
+import tempfile
+import unittest
+
+import support  # puts the application modules on sys.path
+
+import output
+
+
+class AtomicOutputTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, "out.bin")
+        with open(self.path, "wb") as f:
+            f.write(b"old")
+
+    def test_complete_output_replaces_the_file_at_its_real_size(self):
+        with output.AtomicOutput(self.path, 1024 * 1024) as dst:
+            dst.write(b"new")
+            # Nothing shows under the real name until the block ends
+            with open(self.path, "rb") as f:
+                self.assertEqual(f.read(), b"old")
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), b"new")
+        self.assertEqual(os.listdir(self.dir), ["out.bin"])
+
+    def test_failed_output_leaves_the_file_as_it_was(self):
+        with self.assertRaises(RuntimeError):
+            with output.AtomicOutput(self.path, 100) as dst:
+                dst.write(b"partial")
+                raise RuntimeError("interrupted")
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), b"old")
+        self.assertEqual(os.listdir(self.dir), ["out.bin"])
+
+
+class FsyncPolicyTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, "out.bin")
+
+    def _write(self, data, fsync=None):
+        with output.AtomicOutput(self.path, len(data), fsync) as dst:
+            dst.write(data)
+
+    def test_batch_needs_a_caller_owned_batch(self):
+        with self.assertRaises(ValueError):
+            self._write(b"data", "batch")
+        with self.assertRaises(ValueError):
+            self._write(b"data", "sometimes")
+
+    def test_batched_output_appears_on_flush(self):
+        batch = output.FsyncBatch()
+        self._write(b"new", batch)
+        self.assertFalse(os.path.exists(self.path))
+        batch.flush()
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), b"new")
+
+    def test_discarded_batch_leaves_no_temp_files(self):
+        batch = output.FsyncBatch()
+        self._write(b"new", batch)
+        batch.discard()
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def test_failed_flush_leaves_no_temp_files(self):
+        # The first rename fails (its target is a non-empty directory); neither temp file may stay behind
+        blocked = os.path.join(self.dir, "blocked")
+        os.makedirs(os.path.join(blocked, "inside"))
+        batch = output.FsyncBatch()
+        for path in (blocked, self.path):
+            tmp_path = output.temp_path(path)
+            with open(tmp_path, "wb") as f:
+                f.write(b"new")
+            batch.add(tmp_path, path)
+        with self.assertRaises(OSError):
+            batch.flush()
+        self.assertEqual(sorted(os.listdir(self.dir)), ["blocked"])
+        self.assertEqual(batch.pending, [])
+
+    def test_replace_moves_a_finished_file_under_the_policy(self):
+        part = self.path + ".part"
+        for fsync in ("file", "never"):
+            with open(part, "wb") as f:
+                f.write(fsync.encode())
+            output.replace(part, self.path, fsync)
+            with open(self.path, "rb") as f:
+                self.assertEqual(f.read(), fsync.encode())
+        batch = output.FsyncBatch()
+        with open(part, "wb") as f:
+            f.write(b"batch")
+        output.replace(part, self.path, batch)
+        self.assertTrue(os.path.exists(part))
+        batch.flush()
+        self.assertFalse(os.path.exists(part))
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), b"batch")
+
+
+if __name__ == "__main__":
+    unittest.main()
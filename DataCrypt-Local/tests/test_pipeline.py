@@ -0,0 +1,59 @@
+"""The read / cipher / write pipeline and its memory budget (pipeline.py)."""
+import threading
+import unittest
+
+import support  # puts the application modules on sys.path
+
+import pipeline
+
+
+class PipelineTest(unittest.TestCase):
+    def setUp(self):
+        pipeline.set_max_memory(1024 * 1024)
+        self.addCleanup(pipeline.set_max_memory, None)
+
+    def test_results_come_in_order(self):
+        with pipeline.Pipeline(4, 1024, "test") as p:
+            self.assertEqual(list(p.run(lambda n: n * n, range(100))), [n * n for n in range(100)])
+        self.assertEqual(pipeline.get_budget().used, 0)
+
+    def test_abandoned_run_stops_the_reader_and_releases_the_budget(self):
+        read = []
+
+        def items():
+            for n in range(1000):
+                read.append(n)
+                yield n
+
+        with pipeline.Pipeline(2, 1024, "test") as p:
+            results = p.run(lambda n: n, items())
+            self.assertEqual(next(results), 0)
+            results.close()
+            # The reader has been joined: nothing more is read, and the buffers are back
+            self.assertFalse([t for t in threading.enumerate() if t.name == "test-reader"])
+            count = len(read)
+            self.assertLess(count, 1000)
+            self.assertEqual(pipeline.get_budget().used, 0)
+        self.assertEqual(len(read), count)
+        self.assertEqual(pipeline.get_budget().used, 0)
+
+    def test_reader_errors_are_raised_to_the_writer(self):
+        def items():
+            yield 1
+            raise OSError("disk gone")
+
+        with self.assertRaises(OSError):
+            with pipeline.Pipeline(2, 1024, "test") as p:
+                list(p.run(lambda n: n, items()))
+        self.assertEqual(pipeline.get_budget().used, 0)
+
+    def test_parse_size(self):
+        self.assertEqual(pipeline.parse_size("256M"), 256 * 1024 * 1024)
+        self.assertEqual(pipeline.parse_size("1.5GiB"), 3 * 1024 ** 3 // 2)
+        self.assertEqual(pipeline.parse_size("65536"), 65536)
+        with self.assertRaises(ValueError):
+            pipeline.parse_size("12Q")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+"""Random-access reads of containers (reader.py)."""
+import io
+import os
+import random
+import unittest
+
+from support import KeyedTestCase
+
+import encryptor
+import reader
+import streaming
+
+CHUNK_SIZE = 64 * 1024
+
+
+class ReaderTest(KeyedTestCase):
+    def setUp(self):
+        super().setUp()
+        # Compressible, so a compressed container's chunks are shorter than their plaintext
+        rng = random.Random(5)
+        self.data = bytes(rng.choice(b"abcdefgh") for _ in range(3 * CHUNK_SIZE + 321))
+        self.path = self.write("data.bin", self.data)
+
+    def _open(self, **options):
+        encryptor.encrypt_file(self.path, self.public_key, chunk_size=CHUNK_SIZE, verbose=False, **options)
+        f = reader.open_encrypted(self.path + ".enc", self.private_key_path)
+        self.addCleanup(f.close)
+        return f
+
+    def test_reads_across_chunk_boundaries(self):
+        f = self._open()
+        self.assertEqual(f.size, len(self.data))
+        for start, length in ((0, 10), (CHUNK_SIZE - 5, 10), (CHUNK_SIZE - 1, 2 * CHUNK_SIZE + 2),
+                              (2 * CHUNK_SIZE, CHUNK_SIZE), (0, len(self.data))):
+            with self.subTest(start=start, length=length):
+                self.assertEqual(f.seek(start), start)
+                self.assertEqual(f.read(length), self.data[start:start + length])
+                self.assertEqual(f.tell(), start + length)
+
+    def test_reads_near_the_end_of_a_compressed_container(self):
+        f = self._open(compress="zlib")
+        self.assertEqual(f.seek(-100, os.SEEK_END), len(self.data) - 100)
+        self.assertEqual(f.read(1000), self.data[-100:])
+        self.assertEqual(f.read(1), b"")
+        # From just before the last chunk boundary to past the end
+        boundary = 3 * CHUNK_SIZE
+        f.seek(boundary - 3)
+        self.assertEqual(f.read(), self.data[boundary - 3:])
+        f.seek(10, os.SEEK_END)
+        self.assertEqual(f.read(), b"")
+
+    def test_key_from_key_ring(self):
+        os.makedirs(os.path.join(self.dir, "keys"))
+        for name in ("private_key.pem", "public_key.pem"):
+            os.replace(os.path.join(self.dir, name), os.path.join(self.dir, "keys", name))
+        encryptor.encrypt_file(self.path, self.public_key, chunk_size=CHUNK_SIZE, verbose=False)
+        with reader.open_encrypted(self.path + ".enc") as f:
+            f.seek(CHUNK_SIZE + 1)
+            self.assertEqual(f.read(5), self.data[CHUNK_SIZE + 1:CHUNK_SIZE + 6])
+
+    def test_streamed_container_is_refused(self):
+        src = io.BytesIO(self.data)
+        with open(self.path + ".enc", "wb") as dst:
+            streaming.encrypt_stream(src, dst, self.public_key, chunk_size=CHUNK_SIZE)
+        with self.assertRaises(ValueError):
+            reader.open_encrypted(self.path + ".enc", self.private_key_path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+"""Resuming interrupted runs from their checkpoint journal (resume.py)."""
+import os
+import random
+import unittest
+from unittest import mock
+
+from support import KeyedTestCase
+
+import decryptor
+import encryptor
+import resume
+
+CHUNK = 64 * 1024
+
+
+class Interrupted(Exception):
+    pass
+
+
+def _stop_after(limit):
+    def progress(done, total):
+        if done >= limit:
+            raise Interrupted()
+    return progress
+
+
+class ResumeTest(KeyedTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(resume, "CHECKPOINT_BYTES", 2 * CHUNK)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.data = random.Random(2).randbytes(16 * CHUNK + 5)
+        self.path = self.write("data.bin", self.data)
+
+    def _encrypt(self, progress=None):
+        encryptor.encrypt_file(self.path, self.public_key, chunk_size=CHUNK, workers=2, verbose=False,
+                               resumable=True, progress=progress)
+
+    def test_encrypt_resumes_after_interruption(self):
+        with self.assertRaises(Interrupted):
+            self._encrypt(_stop_after(10 * CHUNK))
+        journal = resume.journal_path_for(self.path + ".enc")
+        self.assertTrue(journal.startswith(os.path.join(self.dir, "keys", "journals")))
+        if os.name == "posix":
+            self.assertEqual(os.stat(journal).st_mode & 0o777, 0o600)
+        self.assertFalse(os.path.exists(self.path + ".enc"))
+
+        seen = []
+        self._encrypt(lambda done, total: seen.append(done))
+        self.assertGreaterEqual(seen[0], 4 * CHUNK)
+        self.assertFalse(os.path.exists(journal))
+        self.assertFalse(os.path.exists(self.path + ".enc.part"))
+        decryptor.decrypt_file(self.path + ".enc", None, self.private_key_path, verbose=False)
+        self.assertEqual(self.read("data-decrypted.bin"), self.data)
+
+    def test_decrypt_resumes_after_interruption(self):
+        self._encrypt()
+        with self.assertRaises(Interrupted):
+            decryptor.decrypt_file(self.path + ".enc", None, self.private_key_path, resumable=True,
+                                   progress=_stop_after(10 * CHUNK), verbose=False)
+        seen = []
+        decryptor.decrypt_file(self.path + ".enc", None, self.private_key_path, resumable=True,
+                               progress=lambda done, total: seen.append(done), verbose=False)
+        self.assertGreaterEqual(seen[0], 4 * CHUNK)
+        self.assertEqual(self.read("data-decrypted.bin"), self.data)
+
+    def test_changed_input_starts_over(self):
+        with self.assertRaises(Interrupted):
+            self._encrypt(_stop_after(10 * CHUNK))
+        self.data = self.data[::-1] + b"more"
+        self.write("data.bin", self.data)
+        seen = []
+        self._encrypt(lambda done, total: seen.append(done))
+        self.assertLessEqual(seen[0], CHUNK)
+        decryptor.decrypt_file(self.path + ".enc", None, self.private_key_path, verbose=False)
+        self.assertEqual(self.read("data-decrypted.bin"), self.data)
+
+
+if __name__ == "__main__":
+    unittest.main()
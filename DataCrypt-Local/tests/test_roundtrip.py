@@ -0,0 +1,126 @@
+"""Encrypting and decrypting whole files (encryptor.py, decryptor.py)."""
+import io
+import os
+import random
+import unittest
+
+from support import KeyedTestCase, make_keys
+
+import chunk_io
+import container
+import decryptor
+import encryptor
+import progress
+
+
+class RoundTripTest(KeyedTestCase):
+    def setUp(self):
+        super().setUp()
+        # A few chunks of the smallest size, so the tests cover chunk boundaries cheaply
+        self.data = random.Random(1).randbytes(3 * 64 * 1024 + 123)
+        self.path = self.write("data.bin", self.data)
+
+    def _encrypt(self, **kwargs):
+        encryptor.encrypt_file(self.path, self.public_key, chunk_size=64 * 1024, verbose=False, **kwargs)
+        return self.path + ".enc"
+
+    def _decrypt(self, enc_path=None, key_path=None):
+        return decryptor.decrypt_file(enc_path or self.path + ".enc", key_path, self.private_key_path, verbose=False)
+
+    def test_round_trip(self):
+        for options in ({}, {"compress": "zlib"}, {"workers": 1}, {"cipher": "chacha20-poly1305"}):
+            with self.subTest(**options):
+                self._encrypt(**options)
+                self.assertTrue(container.is_container(self.path + ".enc"))
+                self.assertEqual(self._decrypt(), os.path.join(self.dir, "data-decrypted.bin"))
+                self.assertEqual(self.read("data-decrypted.bin"), self.data)
+
+    def test_io_backends(self):
+        # Odd sizes leave a short last chunk; an empty file has a single empty chunk
+        for size in (0, 1, 64 * 1024 - 1, 2 * 64 * 1024 + 7):
+            data = self.data[:size]
+            self.path = self.write(f"data{size}.bin", data)
+            for backend in chunk_io.BACKENDS:
+                with self.subTest(size=size, io_backend=backend):
+                    self._encrypt(io_backend=backend)
+                    decryptor.decrypt_file(self.path + ".enc", None, self.private_key_path, io_backend=backend,
+                                           verbose=False)
+                    self.assertEqual(self.read(f"data{size}-decrypted.bin"), data)
+
+    def test_several_recipients(self):
+        keys = {}
+        for name in ("bob", "carol", "mallory"):
+            os.makedirs(os.path.join(self.dir, name))
+            keys[name] = make_keys(os.path.join(self.dir, name))
+        encryptor.encrypt_file(self.path, [self.public_key, keys["bob"][0], keys["carol"][0]],
+                               chunk_size=64 * 1024, verbose=False)
+        for private_key_path in (self.private_key_path, keys["bob"][1], keys["carol"][1]):
+            with self.subTest(key=private_key_path):
+                decrypted = decryptor.decrypt_file(self.path + ".enc", None, private_key_path, verbose=False)
+                self.assertEqual(self.read("data-decrypted.bin"), self.data)
+                os.remove(decrypted)
+        with self.assertRaises(ValueError):
+            decryptor.decrypt_file(self.path + ".enc", None, keys["mallory"][1], verbose=False)
+        self.assertFalse(os.path.exists(os.path.join(self.dir, "data-decrypted.bin")))
+
+    def test_empty_file(self):
+        self.path = self.write("empty.bin", b"")
+        self._encrypt()
+        self._decrypt()
+        self.assertEqual(self.read("empty-decrypted.bin"), b"")
+
+    def test_tampered_chunk_is_rejected(self):
+        enc = bytearray(self.read(self._encrypt()))
+        # A byte in the middle of the second chunk's ciphertext
+        enc[len(enc) - 64 * 1024 - 123 - 1000] ^= 1
+        self.write("data.bin.enc", bytes(enc))
+        with self.assertRaises(ValueError):
+            self._decrypt()
+        self.assertFalse(os.path.exists(os.path.join(self.dir, "data-decrypted.bin")))
+
+    def test_truncated_file_is_rejected(self):
+        enc = self.read(self._encrypt())
+        for size in (len(enc) - 1, len(enc) - 64 * 1024, 20):
+            with self.subTest(size=size):
+                self.write("data.bin.enc", enc[:size])
+                with self.assertRaises(ValueError):
+                    self._decrypt()
+
+    def test_legacy_enc_and_key_pair(self):
+        self._encrypt(legacy=True)
+        self.assertFalse(container.is_container(self.path + ".enc"))
+        self._decrypt(key_path=self.path + ".key")
+        self.assertEqual(self.read("data-decrypted.bin"), self.data)
+
+    def test_decrypt_to_memory_and_sinks(self):
+        enc = self._encrypt()
+        self.assertEqual(decryptor.decrypt_bytes(enc, self.private_key_path), self.data)
+        self.assertEqual(b"".join(decryptor.iter_decrypt(enc, self.private_key_path)), self.data)
+        out = io.BytesIO()
+        self.assertEqual(decryptor.decrypt_to(enc, out, self.private_key_path), len(self.data))
+        self.assertEqual(out.getvalue(), self.data)
+        self.assertFalse(os.path.exists(os.path.join(self.dir, "data-decrypted.bin")))
+
+    def test_failed_decrypt_keeps_the_previous_output(self):
+        self._encrypt()
+        self._decrypt()
+        enc = bytearray(self.read("data.bin.enc"))
+        enc[-1] ^= 1
+        self.write("data.bin.enc", bytes(enc))
+        with self.assertRaises(ValueError):
+            self._decrypt()
+        self.assertEqual(self.read("data-decrypted.bin"), self.data)
+        self.assertEqual([name for name in os.listdir(self.dir) if name.endswith(".tmp")], [])
+
+    def test_cancelled_encrypt_keeps_the_previous_output(self):
+        old = self.read(self._encrypt())
+        self.write("data.bin", self.data[::-1])
+        with self.assertRaises(progress.OperationCancelled):
+            def cancel(done, total):
+                raise progress.OperationCancelled()
+            self._encrypt(progress=cancel)
+        self.assertEqual(self.read("data.bin.enc"), old)
+
+
+if __name__ == "__main__":
+    unittest.main()
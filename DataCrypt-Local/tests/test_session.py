@@ -0,0 +1,32 @@
+"""Encryption sessions and the decrypting side's secret cache (session.py)."""
+import contextlib
+import io
+import unittest
+
+from support import KeyedTestCase
+
+import datacrypt
+import decryptor
+import encryptor
+import session
+
+
+class SharedSecretTest(KeyedTestCase):
+    def test_decrypt_command_clears_cached_secrets(self):
+        session.clear_shared_secrets()
+        files = [self.write(name, name.encode()) for name in ("a.txt", "b.txt")]
+        shared = encryptor.open_session(self.public_key)
+        for path in files:
+            encryptor.encrypt_file(path, shared, verbose=False)
+        with contextlib.redirect_stdout(io.StringIO()):
+            # Decrypting alone leaves the session's exchange cached for its other files
+            decryptor.decrypt_file(files[0] + ".enc", None, self.private_key_path, verbose=False)
+            self.assertEqual(session.shared_secret.cache_info().currsize, 1)
+            datacrypt.decrypt([path + ".enc" for path in files], self.private_key_path)
+        self.assertEqual(session.shared_secret.cache_info().currsize, 0)
+        for name in ("a", "b"):
+            self.assertEqual(self.read(name + "-decrypted.txt"), name.encode() + b".txt")
+
+
+if __name__ == "__main__":
+    unittest.main()
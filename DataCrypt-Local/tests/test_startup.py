@@ -0,0 +1,39 @@
+"""Cold-start guards for the headless CLI (see benchmarks/bench_startup.py)."""
+import os
+import subprocess
+import sys
+import unittest
+
+from support import APP_DIR
+
+
+def _modules_after(code):
+    """Return the names of the modules a fresh interpreter has loaded after running code."""
+    script = f"import sys; sys.path.insert(0, {APP_DIR!r}); {code}; print(' '.join(sys.modules))"
+    result = subprocess.run([sys.executable, "-c", script], check=True, capture_output=True, text=True)
+    return set(result.stdout.split())
+
+
+class ImportTest(unittest.TestCase):
+    def test_parser_loads_no_crypto(self):
+        modules = _modules_after("import datacrypt; datacrypt.build_parser()")
+        self.assertNotIn("cryptography", modules)
+        self.assertNotIn("encryptor", modules)
+
+    def test_encryptor_and_decryptor_import_lazily(self):
+        modules = _modules_after("import encryptor, decryptor")
+        for name in ("key_ring", "metrics", "output", "parallel", "pipeline", "session", "json"):
+            self.assertNotIn(name, modules)
+
+
+# Wall-clock timings depend on the machine, so they only run where asked for
+@unittest.skipUnless(os.environ.get("DATACRYPT_TIMING_TESTS"), "set DATACRYPT_TIMING_TESTS=1 to run timing tests")
+class StartupTest(unittest.TestCase):
+    def test_small_encrypt_under_100_ms(self):
+        bench = os.path.join(APP_DIR, "benchmarks", "bench_startup.py")
+        result = subprocess.run([sys.executable, bench, "--max-ms", "100"], capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+"""Encrypting and decrypting pipes and other unseekable streams (streaming.py)."""
+import io
+import os
+import random
+import unittest
+
+from support import KeyedTestCase
+
+import decryptor
+import streaming
+
+
+class _Unseekable(io.RawIOBase):
+    """A pipe-like reader that hands out at most `step` bytes per read."""
+
+    def __init__(self, data, step=10000):
+        self._data = memoryview(data)
+        self._step = step
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = min(len(buffer), self._step, len(self._data))
+        buffer[:n] = self._data[:n]
+        self._data = self._data[n:]
+        return n
+
+
+class StreamTest(KeyedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = random.Random(3).randbytes(5 * 64 * 1024 + 17)
+
+    def _encrypt(self, data, **kwargs):
+        out = io.BytesIO()
+        size = streaming.encrypt_stream(_Unseekable(data), out, self.public_key, chunk_size=64 * 1024, **kwargs)
+        self.assertEqual(size, len(data))
+        return out.getvalue()
+
+    def test_round_trip(self):
+        for options in ({}, {"compress": "zlib"}):
+            with self.subTest(**options):
+                out = io.BytesIO()
+                streaming.decrypt_stream(_Unseekable(self._encrypt(self.data, **options)), out, self.private_key_path)
+                self.assertEqual(out.getvalue(), self.data)
+
+    def test_stream_container_decrypts_as_a_file(self):
+        self.write("data.bin.enc", self._encrypt(self.data))
+        decryptor.decrypt_file(os.path.join(self.dir, "data.bin.enc"), None, self.private_key_path, verbose=False)
+        self.assertEqual(self.read("data-decrypted.bin"), self.data)
+
+    def test_truncated_stream_is_rejected(self):
+        enc = self._encrypt(self.data)
+        with self.assertRaises(ValueError):
+            streaming.decrypt_stream(_Unseekable(enc[:-100]), io.BytesIO(), self.private_key_path)
+
+
+if __name__ == "__main__":
+    unittest.main()
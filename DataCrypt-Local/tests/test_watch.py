@@ -0,0 +1,131 @@
+"""The watch-folder daemon (watch.py), driven with the poll watcher."""
+import os
+import threading
+import time
+import unittest
+from unittest import mock
+
+from support import KeyedTestCase
+
+import container
+import encryptor
+import watch
+
+
+class StateIndexTest(KeyedTestCase):
+    def test_results_survive_a_restart(self):
+        state_path = os.path.join(self.dir, "state", "watch.jsonl")
+        path = self.write("a.txt", b"a")
+        st = os.stat(path)
+        state = watch.StateIndex(state_path)
+        self.assertFalse(state.seen(path, st))
+        state.record(path, st.st_size, st.st_mtime_ns - 1, "failed once")
+        state.record(path, st.st_size, st.st_mtime_ns)
+        state.close()
+        # A crash mid-write leaves a torn last line
+        with open(state_path, "a") as f:
+            f.write('{"path": "/torn", "si')
+
+        state = watch.StateIndex(state_path)
+        self.addCleanup(state.close)
+        self.assertTrue(state.seen(path, st))
+        with open(state_path, "r") as f:
+            self.assertEqual(len(f.readlines()), 1)
+
+        # A changed file is new again
+        self.write("a.txt", b"changed")
+        self.assertFalse(state.seen(path, os.stat(path)))
+
+
+class WatchFolderTest(KeyedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.spool = os.path.join(self.dir, "spool")
+        os.makedirs(self.spool)
+
+    def _daemon(self, **kwargs):
+        kwargs.setdefault("poll_interval", 0.1)
+        daemon = watch.WatchFolder([self.spool], [encryptor.load_public_key(self.public_key)],
+                                   os.path.join(self.dir, "state.jsonl"), jobs=1, chunk_size=64 * 1024, **kwargs)
+        self.addCleanup(daemon.state.close)
+        return daemon
+
+    def _spool(self, name, data):
+        path = os.path.join(self.spool, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_files_are_queued_once_settled(self):
+        daemon = self._daemon(settle=2.0)
+        path = self._spool("a.txt", b"first")
+        self._spool(".hidden", b"x")
+        self._spool("b.txt.enc", b"x")
+        for path_ in daemon._scan():
+            daemon._consider(path_, 0.0)
+        self.assertEqual(list(daemon._pending), [path])
+
+        daemon._enqueue_settled(1.0)
+        self.assertTrue(daemon._queue.empty())
+
+        # Still being written: the settle timer starts again
+        with open(path, "ab") as f:
+            f.write(b" and more")
+        daemon._enqueue_settled(1.5)
+        daemon._enqueue_settled(3.0)
+        self.assertTrue(daemon._queue.empty())
+        daemon._enqueue_settled(3.5)
+        self.assertEqual(daemon._queue.get_nowait(), path)
+        self.assertEqual(daemon._pending, {})
+
+        # Queued files are not offered again
+        daemon._consider(path, 10.0)
+        self.assertEqual(daemon._pending, {})
+
+    def test_full_queue_keeps_files_pending(self):
+        daemon = self._daemon(settle=0.0, queue_size=1)
+        paths = sorted(self._spool(name, b"data") for name in ("a.txt", "b.txt", "c.txt"))
+        for path in paths:
+            daemon._consider(path, 0.0)
+        daemon._enqueue_settled(1.0)
+        self.assertEqual(daemon._queue.qsize(), 1)
+        self.assertEqual(len(daemon._pending), 2)
+
+        queued = {daemon._queue.get_nowait()}
+        daemon._enqueue_settled(2.0)
+        queued.add(daemon._queue.get_nowait())
+        daemon._enqueue_settled(3.0)
+        queued.add(daemon._queue.get_nowait())
+        self.assertEqual(sorted(queued), paths)
+        self.assertEqual(daemon._pending, {})
+
+    def test_falls_back_to_polling_without_inotify(self):
+        daemon = self._daemon(poll_interval=None)
+        with mock.patch.object(watch.sys, "platform", "linux"), \
+                mock.patch.object(watch, "_InotifyWatcher", side_effect=OSError(24, "out of watches")):
+            watcher = daemon._watcher()
+        self.assertEqual(watcher.mode, "poll")
+        with mock.patch.object(watch, "_InotifyWatcher") as inotify:
+            self.assertEqual(self._daemon()._watcher().mode, "poll")
+        inotify.assert_not_called()
+
+    def test_run_encrypts_new_files(self):
+        daemon = self._daemon(settle=0.0)
+        path = self._spool("a.txt", b"hello" * 1000)
+        thread = threading.Thread(target=daemon.run)
+        with mock.patch("builtins.print"):
+            thread.start()
+            deadline = time.monotonic() + 30
+            while daemon.processed < 1 and time.monotonic() < deadline:
+                time.sleep(0.05)
+            daemon.stop()
+            thread.join()
+        self.assertEqual((daemon.mode, daemon.processed, daemon.failed), ("poll", 1, 0))
+        self.assertTrue(container.is_container(path + ".enc"))
+        state = watch.StateIndex(os.path.join(self.dir, "state.jsonl"))
+        self.addCleanup(state.close)
+        self.assertTrue(state.seen(path, os.stat(path)))
+
+
+if __name__ == "__main__":
+    unittest.main()
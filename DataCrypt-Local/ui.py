@@ -1,11 +1,58 @@
-from PyQt6.QtWidgets import QApplication, QWidget, QPushButton, QVBoxLayout, QMessageBox, QFileDialog, QLabel, QHBoxLayout, QDialogButtonBox, QInputDialog, QSpacerItem, QSizePolicy, QDialog
-from PyQt6.QtGui import QFont, QClipboard, QPixmap 
-from PyQt6.QtCore import Qt, QTimer
+from PyQt6.QtWidgets import QApplication, QWidget, QPushButton, QVBoxLayout, QMessageBox, QFileDialog, QLabel, QHBoxLayout, QDialogButtonBox, QInputDialog, QSpacerItem, QSizePolicy, QDialog, QListWidget, QListWidgetItem, QCheckBox
+from PyQt6.QtGui import QFont, QClipboard, QPixmap, QColor
+from PyQt6.QtCore import Qt, QTimer, QObject, QRunnable, QThreadPool, pyqtSignal
 import sys
 import os
+import threading
+import time
 from key_manager import generate_key_pair
 from encryptor import encrypt_file
 from decryptor import decrypt_file
+from session import clear_shared_secrets
+from container import is_container
+from progress import OperationCancelled, Throughput
+
+# Number of files encrypted/decrypted at the same time; further jobs wait in the queue
+MAX_PARALLEL_JOBS = 2
+
+class JobSignals(QObject):
+    """Signals emitted by a CryptoJob on its worker thread and delivered on the GUI thread."""
+    progress = pyqtSignal(int, object, object)  # job id, bytes done, bytes total
+    finished = pyqtSignal(int, str, str)  # job id, state ("done", "failed", "cancelled"), message
+
+class CryptoJob(QRunnable):
+    """Runs encrypt_file/decrypt_file on a QThreadPool thread with progress and cancellation."""
+
+    def __init__(self, job_id, func, args, kwargs):
+        super().__init__()
+        self.setAutoDelete(False)  # DataCryptApp keeps the job until it has finished
+        self.job_id = job_id
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = JobSignals()
+        self.cancel_event = threading.Event()
+        self._last_emit = 0.0
+
+    def report(self, done, total):
+        # Throttle to ~10 updates a second so the GUI thread is not flooded
+        now = time.monotonic()
+        if done >= total or now - self._last_emit >= 0.1:
+            self._last_emit = now
+            self.signals.progress.emit(self.job_id, done, total)
+
+    def run(self):
+        if self.cancel_event.is_set():
+            self.signals.finished.emit(self.job_id, "cancelled", "")
+            return
+        try:
+            self.func(*self.args, progress=self.report, cancel_event=self.cancel_event, **self.kwargs)
+        except OperationCancelled:
+            self.signals.finished.emit(self.job_id, "cancelled", "")
+        except Exception as e:
+            self.signals.finished.emit(self.job_id, "failed", str(e))
+        else:
+            self.signals.finished.emit(self.job_id, "done", "")
 
 class DataCryptApp(QWidget):
     def __init__(self):
@@ -50,6 +97,10 @@ class DataCryptApp(QWidget):
                 button-layout: 2;  /* Center the buttons */
             }
         """)
+        self.thread_pool = QThreadPool(self)
+        self.thread_pool.setMaxThreadCount(MAX_PARALLEL_JOBS)
+        self.jobs = {}  # job id -> dict(job, item, label, throughput)
+        self.next_job_id = 0
         self.initUI()
     
     def initUI(self):
@@ -207,6 +258,11 @@ class DataCryptApp(QWidget):
         
         layout.addLayout(button_layout)
         
+        # DataCrypt-Remote still expects an .enc file plus its .key file
+        self.legacy_checkbox = QCheckBox("Legacy format (.enc + .key) for DataCrypt-Remote uploads", self)
+        self.legacy_checkbox.setStyleSheet("font-size: 13px;")
+        layout.addWidget(self.legacy_checkbox)
+        
         # Add the generate keys button and copy key button in sequence
         self.generate_keys_button = QPushButton("🔑 Generate ECDH Keys", self)
         self.generate_keys_button.setStyleSheet(generate_keys_button_style)
@@ -250,6 +306,23 @@ class DataCryptApp(QWidget):
         self.hint_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         self.hint_label.setVisible(False)  # Initially hidden
         layout.addWidget(self.hint_label)  # Add it to the main layout
+
+        # Background jobs: queued, running and finished encryptions/decryptions
+        jobs_label = QLabel("Jobs", self)
+        jobs_label.setFont(QFont("Arial", 12, QFont.Weight.Bold))
+        layout.addWidget(jobs_label)
+
+        self.job_list = QListWidget(self)
+        self.job_list.setStyleSheet("background-color: #2C2F33; color: #FFFFFF; border-radius: 6px;")
+        self.job_list.setMinimumHeight(110)
+        self.job_list.itemSelectionChanged.connect(self.update_cancel_button)
+        layout.addWidget(self.job_list)
+
+        self.cancel_job_button = QPushButton("⏹ Cancel Job", self)
+        self.cancel_job_button.setStyleSheet(deselect_button_style)
+        self.cancel_job_button.clicked.connect(self.cancel_selected_jobs)
+        self.cancel_job_button.setEnabled(False)
+        layout.addWidget(self.cancel_job_button)
         
         self.setLayout(layout)
     
@@ -287,25 +360,11 @@ class DataCryptApp(QWidget):
             if dialog.exec() == QInputDialog.DialogCode.Accepted:
                 public_key = dialog.textValue()
                 if public_key:
-                    # Proceed with file encryption using the provided public key
-                    try:
-                        encrypt_file(self.selected_file, public_key)
-                        msg = QMessageBox(self)
-                        msg.setWindowTitle("Success")
-                        msg.setText("File encrypted successfully!")
-                        msg.setIcon(QMessageBox.Icon.Information)
-                        msg.setStandardButtons(QMessageBox.StandardButton.Ok)
-                        reply = msg.exec()
-                        
-                        if reply == QMessageBox.StandardButton.Ok:
-                            self.deselect_file()
-                    except Exception as e:
-                        msg = QMessageBox(self)
-                        msg.setWindowTitle("Error")
-                        msg.setText(f"Encryption failed: {str(e)}")
-                        msg.setIcon(QMessageBox.Icon.Warning)
-                        msg.setStandardButtons(QMessageBox.StandardButton.Ok)
-                        msg.exec()
+                    # Queue the encryption; it runs in the background so the window stays responsive
+                    label = f"Encrypt {os.path.basename(self.selected_file)}"
+                    options = {"verbose": False, "legacy": self.legacy_checkbox.isChecked()}
+                    self.start_job(label, encrypt_file, (self.selected_file, public_key), options)
+                    self.deselect_file()
                 else:
                     msg = QMessageBox(self)
                     msg.setWindowTitle("Cancelled")
@@ -354,7 +413,10 @@ class DataCryptApp(QWidget):
             msg.exec()
             return
 
-        if not os.path.exists(key_file):
+        # Single-file containers carry their own key material; only legacy .enc files need a .key
+        if is_container(encrypted_file):
+            key_file = None
+        elif not os.path.exists(key_file):
             msg = QMessageBox(self)
             msg.setWindowTitle("Error")
             msg.setText(f"Key file not found: {key_file}")
@@ -371,24 +433,11 @@ class DataCryptApp(QWidget):
         if dialog.exec() == QInputDialog.DialogCode.Accepted:
             sender_public_key = dialog.textValue()
             if sender_public_key:
-                try:
-                    decrypt_file(encrypted_file, key_file, private_key_path, sender_public_key)
-                except ValueError as e:
-                    msg = QMessageBox(self)
-                    msg.setWindowTitle("Error")
-                    msg.setText(f"Failed to decrypt: {str(e)}")
-                    msg.setIcon(QMessageBox.Icon.Warning)
-                    msg.setStandardButtons(QMessageBox.StandardButton.Ok)
-                    msg.exec()
-                    return
-                msg = QMessageBox(self)
-                msg.setWindowTitle("Success")
-                msg.setText("File decrypted successfully!")
-                msg.setIcon(QMessageBox.Icon.Information)
-                msg.setStandardButtons(QMessageBox.StandardButton.Ok)
-                reply = msg.exec()
-                if reply == QMessageBox.StandardButton.Ok:
-                    self.deselect_file()
+                # Queue the decryption; it runs in the background so the window stays responsive
+                label = f"Decrypt {os.path.basename(encrypted_file)}"
+                self.start_job(label, decrypt_file, (encrypted_file, key_file, private_key_path, sender_public_key),
+                               {"verbose": False})
+                self.deselect_file()
             else:
                 msg = QMessageBox(self)
                 msg.setWindowTitle("Cancelled")
@@ -404,6 +453,62 @@ class DataCryptApp(QWidget):
             msg.setStandardButtons(QMessageBox.StandardButton.Ok)
             msg.exec()
     
+    def start_job(self, label, func, args, kwargs):
+        """Add a job to the list and queue it on the thread pool."""
+        job_id = self.next_job_id
+        self.next_job_id += 1
+        job = CryptoJob(job_id, func, args, kwargs)
+        job.signals.progress.connect(self.on_job_progress)
+        job.signals.finished.connect(self.on_job_finished)
+
+        item = QListWidgetItem(f"{label} - queued")
+        item.setData(Qt.ItemDataRole.UserRole, job_id)
+        self.job_list.addItem(item)
+        self.jobs[job_id] = {"job": job, "item": item, "label": label, "throughput": None}
+        self.thread_pool.start(job)
+
+    def on_job_progress(self, job_id, done, total):
+        entry = self.jobs.get(job_id)
+        if entry is None:
+            return
+        if entry["throughput"] is None:
+            entry["throughput"] = Throughput()
+        entry["item"].setText(f"{entry['label']} - {entry['throughput'].describe(done, total)}")
+
+    def on_job_finished(self, job_id, state, message):
+        entry = self.jobs.pop(job_id, None)
+        if entry is None:
+            return
+        item = entry["item"]
+        if state == "done":
+            item.setText(f"{entry['label']} - done")
+            item.setForeground(QColor("#43B581"))
+        elif state == "cancelled":
+            item.setText(f"{entry['label']} - cancelled")
+            item.setForeground(QColor("#99AAB5"))
+        else:
+            item.setText(f"{entry['label']} - failed: {message}")
+            item.setToolTip(message)
+            item.setForeground(QColor("#F04747"))
+        if not self.jobs:
+            # Keep no ECDH secrets cached between batches of jobs (see session.py)
+            clear_shared_secrets()
+        self.update_cancel_button()
+
+    def selected_jobs(self):
+        """Running or queued jobs whose list items are selected."""
+        job_ids = (item.data(Qt.ItemDataRole.UserRole) for item in self.job_list.selectedItems())
+        return [self.jobs[job_id]["job"] for job_id in job_ids if job_id in self.jobs]
+
+    def update_cancel_button(self):
+        self.cancel_job_button.setEnabled(bool(self.selected_jobs()))
+
+    def cancel_selected_jobs(self):
+        # The job stops at its next chunk and removes its partial output
+        for job in self.selected_jobs():
+            job.cancel_event.set()
+            self.jobs[job.job_id]["item"].setText(f"{self.jobs[job.job_id]['label']} - cancelling...")
+
     def generate_keys(self):
         if generate_key_pair():
             msg = QMessageBox(self)
@@ -504,7 +609,10 @@ class DataCryptApp(QWidget):
     def closeEvent(self, event):
         msg = QMessageBox(self)
         msg.setWindowTitle("Confirm Exit")
-        msg.setText("Are you sure you want to quit?")
+        if self.jobs:
+            msg.setText(f"{len(self.jobs)} job(s) are still running and will be cancelled. Are you sure you want to quit?")
+        else:
+            msg.setText("Are you sure you want to quit?")
         msg.setIcon(QMessageBox.Icon.Question)
         msg.setStandardButtons(QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
         msg.setDefaultButton(QMessageBox.StandardButton.No)
@@ -531,6 +639,10 @@ class DataCryptApp(QWidget):
         reply = msg.exec()
         
         if reply == QMessageBox.StandardButton.Yes:
+            # Cancel running and queued jobs and wait for them to clean up their partial output
+            for entry in self.jobs.values():
+                entry["job"].cancel_event.set()
+            self.thread_pool.waitForDone()
             event.accept()
         else:
             event.ignore()
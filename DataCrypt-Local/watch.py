@@ -0,0 +1,445 @@
+"""Watch-folder daemon: encrypt every file that appears in one or more spool directories.
+
+Usage:
+    python watch.py -r RECIPIENT [-r RECIPIENT ...] [-j JOBS] [--queue-size N] [--settle SECONDS]
+                    [--poll SECONDS] [--state FILE] [--status FILE] [-z CODEC] [--cipher ENGINE]
+                    [--max-memory SIZE] [--fsync file|never] DIR [DIR ...]
+
+New and changed files directly inside each DIR are encrypted with encrypt_file
+into FILE.enc next to them. The daemon runs until SIGINT or SIGTERM, letting
+files already being encrypted finish.
+
+    watching   inotify on Linux (close-write and moved-in events); elsewhere, or
+               with --poll, the directories are rescanned every few seconds
+    debounce   a file is only queued once its size and mtime have not changed
+               for --settle seconds, so files still being written are left alone
+    queue      ready files go into a bounded queue served by -j worker threads;
+               when it is full they wait, instead of piling up in memory
+    state      every result is appended to a JSON-lines index (--state), so a
+               restarted daemon skips files it already encrypted unless they
+               changed since
+    status     a JSON status file (--status) is rewritten every few seconds with
+               queue depth, counts, throughput and a heartbeat, for health checks
+    memory     --max-memory caps the chunk buffers of all workers together; a
+               worker that does not fit waits for the others (see pipeline.py)
+
+Hidden files (names starting with "."), and .enc, .key, .part and .journal
+files, are never picked up.
+"""
+import argparse
+import json
+import os
+import queue
+import signal
+import struct
+import sys
+import threading
+import time
+from collections import deque
+
+from encryptor import encrypt_file, load_public_key
+from key_ring import read_recipient
+import container
+import engines
+import output
+import pipeline
+import session
+
+DEFAULT_QUEUE_SIZE = 256
+DEFAULT_SETTLE = 2.0
+DEFAULT_POLL_INTERVAL = 2.0
+STATUS_INTERVAL = 5.0
+# Throughput in the status file is averaged over this many seconds
+RATE_WINDOW = 60.0
+# How often the main loop wakes up to check settling files, at most
+TICK = 0.5
+SKIPPED_SUFFIXES = (".enc", ".key", ".part", ".journal")
+
+# inotify(7) event bits
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_Q_OVERFLOW = 0x00004000
+_IN_EVENT = struct.Struct("iIII")  # wd, mask, cookie, name length
+
+
+def _wanted(name):
+    return not name.startswith(".") and not name.endswith(SKIPPED_SUFFIXES)
+
+
+class _PollWatcher:
+    """Rescans the directories every interval seconds."""
+
+    mode = "poll"
+
+    def __init__(self, directories, interval=DEFAULT_POLL_INTERVAL):
+        self._directories = directories
+        self._interval = interval
+        self._next = 0.0
+
+    def wait(self, timeout):
+        """Return the paths that may have changed, None for "rescan everything", or [] on timeout."""
+        now = time.monotonic()
+        if now >= self._next:
+            self._next = now + self._interval
+            return None
+        time.sleep(min(timeout, self._next - now))
+        return []
+
+    def close(self):
+        pass
+
+
+class _InotifyWatcher:
+    """Linux inotify on the directories, through libc (no extra dependency)."""
+
+    mode = "inotify"
+
+    def __init__(self, directories):
+        import ctypes
+        import ctypes.util
+
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._fd = fd
+        self._directories = {}
+        # Later writes need no events: settling files are re-checked with stat() on every tick
+        mask = _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+        for directory in directories:
+            wd = libc.inotify_add_watch(fd, os.fsencode(directory), mask)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                os.close(fd)
+                raise OSError(errno, f"inotify_add_watch failed for {directory}")
+            self._directories[wd] = directory
+
+    def wait(self, timeout):
+        import select
+
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        paths = set()
+        offset = 0
+        while offset + _IN_EVENT.size <= len(data):
+            wd, mask, _, name_len = _IN_EVENT.unpack_from(data, offset)
+            offset += _IN_EVENT.size
+            name = data[offset:offset + name_len].rstrip(b"\0")
+            offset += name_len
+            if mask & _IN_Q_OVERFLOW:
+                # The kernel dropped events; only a full scan can tell what changed
+                return None
+            directory = self._directories.get(wd)
+            if directory is not None and name:
+                paths.add(os.path.join(directory, os.fsdecode(name)))
+        return paths
+
+    def close(self):
+        os.close(self._fd)
+
+
+class StateIndex:
+    """Persistent record of processed files: path -> (size, mtime_ns, error or None).
+
+    Kept as an append-only JSON-lines file, one line per result, so recording
+    a file costs one short write however many files are known. It is rewritten
+    without superseded lines when loaded.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+        lines = 0
+        try:
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self._entries[entry["path"]] = (entry["size"], entry["mtime_ns"], entry.get("error"))
+                    except (ValueError, KeyError, TypeError):
+                        # A torn last line, from a crash mid-write
+                        continue
+                    lines += 1
+        except FileNotFoundError:
+            pass
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if lines > len(self._entries):
+            self._compact()
+        self._file = open(path, "a")
+
+    def _compact(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            for path, entry in self._entries.items():
+                f.write(self._line(path, *entry))
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _line(path, size, mtime_ns, error):
+        entry = {"path": path, "size": size, "mtime_ns": mtime_ns}
+        if error:
+            entry["error"] = error
+        return json.dumps(entry) + "\n"
+
+    def seen(self, path, st):
+        """True if path was already processed (encrypted or failed) in its current version."""
+        entry = self._entries.get(path)
+        return entry is not None and entry[:2] == (st.st_size, st.st_mtime_ns)
+
+    def record(self, path, size, mtime_ns, error=None):
+        with self._lock:
+            self._entries[path] = (size, mtime_ns, error)
+            self._file.write(self._line(path, size, mtime_ns, error))
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class WatchFolder:
+    """Watches directories and encrypts new files on a worker pool; see the module docstring.
+
+    public_keys are parsed recipient keys. encrypt_options are passed on to
+    encrypt_file (e.g. chunk_size, compress, cipher). run() blocks until
+    stop() is called, e.g. from a signal handler.
+    """
+
+    def __init__(self, directories, public_keys, state_path, status_path=None, jobs=None,
+                 queue_size=DEFAULT_QUEUE_SIZE, settle=DEFAULT_SETTLE, poll_interval=None, **encrypt_options):
+        self.directories = [os.path.abspath(directory) for directory in directories]
+        for directory in self.directories:
+            if not os.path.isdir(directory):
+                raise ValueError(f"Not a directory: {directory}")
+        self.public_keys = public_keys
+        self.state = StateIndex(state_path)
+        self.status_path = status_path
+        self.jobs = jobs or os.cpu_count() or 1
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.encrypt_options = encrypt_options
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._pending = {}  # path -> (size, mtime_ns, monotonic time of the last change)
+        self._claimed = set()  # queued or being encrypted
+        self._active = 0
+        self._recent = deque()  # (monotonic time, bytes) of files finished within RATE_WINDOW
+        self._started = time.time()
+        self.processed = 0
+        self.failed = 0
+        self.bytes = 0
+        self.last_error = None
+        self.mode = None
+
+    def stop(self):
+        self._stop.set()
+
+    def _watcher(self):
+        if self.poll_interval is None and sys.platform.startswith("linux"):
+            try:
+                return _InotifyWatcher(self.directories)
+            except (OSError, AttributeError):
+                # No inotify (or out of watches): fall back to polling
+                pass
+        return _PollWatcher(self.directories, self.poll_interval or DEFAULT_POLL_INTERVAL)
+
+    def _scan(self):
+        for directory in self.directories:
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        yield entry.path
+            except OSError:
+                continue
+
+    def _consider(self, path, now):
+        """Start (or restart) the settle timer of path if it is a new or changed file."""
+        if not _wanted(os.path.basename(path)) or path in self._claimed:
+            return
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._pending.pop(path, None)
+            return
+        if not os.path.isfile(path) or self.state.seen(path, st):
+            self._pending.pop(path, None)
+            return
+        version = (st.st_size, st.st_mtime_ns)
+        pending = self._pending.get(path)
+        if pending is None or pending[:2] != version:
+            self._pending[path] = version + (now,)
+
+    def _enqueue_settled(self, now):
+        for path, (size, mtime_ns, changed) in list(self._pending.items()):
+            self._consider(path, now)
+            if path not in self._pending or self._pending[path][2] != changed:
+                continue
+            if now - changed < self.settle:
+                continue
+            try:
+                self._queue.put_nowait(path)
+            except queue.Full:
+                # Backpressure: it stays pending and is offered again on the next tick
+                return
+            del self._pending[path]
+            with self._lock:
+                self._claimed.add(path)
+
+    def _work(self):
+        while True:
+            try:
+                path = self._queue.get(timeout=TICK)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return
+                continue
+            if self._stop.is_set():
+                # Shutting down: queued files are picked up again on the next start
+                return
+            with self._lock:
+                self._active += 1
+            st = error = None
+            try:
+                st = os.stat(path)
+                encrypt_file(path, self.public_keys, workers=1, verbose=False, **self.encrypt_options)
+            except Exception as e:
+                error = str(e)
+            with self._lock:
+                self._active -= 1
+                self._claimed.discard(path)
+                if error is None:
+                    self.processed += 1
+                    self.bytes += st.st_size
+                    self._recent.append((time.monotonic(), st.st_size))
+                else:
+                    self.failed += 1
+                    self.last_error = f"{path}: {error}"
+                # Under the lock, so lines from different workers don't interleave
+                print(f"OK     {path}" if error is None else f"FAILED {path}: {error}", flush=True)
+            if st is not None:
+                self.state.record(path, st.st_size, st.st_mtime_ns, error)
+
+    def status(self):
+        """Return the current health and throughput figures (also written to the status file)."""
+        now = time.monotonic()
+        with self._lock:
+            while self._recent and now - self._recent[0][0] > RATE_WINDOW:
+                self._recent.popleft()
+            window = min(RATE_WINDOW, time.time() - self._started) or 1.0
+            return {
+                "pid": os.getpid(),
+                "mode": self.mode,
+                "directories": self.directories,
+                "started": self._started,
+                "heartbeat": time.time(),
+                "queue_depth": self._queue.qsize(),
+                "queue_capacity": self._queue.maxsize,
+                "settling": len(self._pending),
+                "active": self._active,
+                "workers": self.jobs,
+                "processed": self.processed,
+                "failed": self.failed,
+                "bytes": self.bytes,
+                "bytes_per_second": sum(nbytes for _, nbytes in self._recent) / window,
+                "files_per_minute": len(self._recent) * 60.0 / window,
+                "last_error": self.last_error,
+            }
+
+    def _write_status(self):
+        if self.status_path is None:
+            return
+        tmp_path = self.status_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.status(), f, indent=2)
+        os.replace(tmp_path, self.status_path)
+
+    def run(self):
+        """Watch and encrypt until stop() is called; returns the number of files that failed."""
+        watcher = self._watcher()
+        self.mode = watcher.mode
+        workers = [threading.Thread(target=self._work, name=f"watch-worker-{i}", daemon=True)
+                   for i in range(self.jobs)]
+        for worker in workers:
+            worker.start()
+        next_status = 0.0
+        try:
+            # Files that arrived while the daemon was down
+            changed = None
+            while not self._stop.is_set():
+                now = time.monotonic()
+                for path in (self._scan() if changed is None else changed):
+                    self._consider(path, now)
+                self._enqueue_settled(now)
+                if now >= next_status:
+                    self._write_status()
+                    next_status = now + STATUS_INTERVAL
+                changed = watcher.wait(TICK)
+        finally:
+            watcher.close()
+            self._stop.set()
+            for worker in workers:
+                worker.join()
+            self._write_status()
+            self.state.close()
+            session.clear_shared_secrets()
+        return self.failed
+
+
+def default_state_path():
+    import key_manager
+
+    return os.path.join(key_manager.KEY_DIR, "watch-state.jsonl")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Encrypt every file that appears in the watched directories.")
+    parser.add_argument("directories", nargs="+", help="spool directories to watch")
+    parser.add_argument("-r", "--recipient", required=True, action="append",
+                        help="base64 public key, PEM public key file or @contact (repeatable)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker threads (default: CPU count)")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE, help="files queued at most")
+    parser.add_argument("--settle", type=float, default=DEFAULT_SETTLE,
+                        help="seconds a file must stay unchanged before it is encrypted")
+    parser.add_argument("--poll", type=float, metavar="SECONDS", help="rescan every SECONDS instead of using inotify")
+    parser.add_argument("--state", help="processed-file index (default: KEY_DIR/watch-state.jsonl)")
+    parser.add_argument("--status", help="JSON status file, rewritten every few seconds")
+    parser.add_argument("--chunk-size", type=int, default=container.DEFAULT_CHUNK_SIZE, help="container chunk size in bytes")
+    parser.add_argument("-z", "--compress", choices=("zlib", "lzma"), help="compress each chunk before encrypting it")
+    parser.add_argument("--cipher", choices=list(engines.ENGINES) + [engines.AUTO],
+                        help="chunk cipher (default: aes-256-gcm; auto: fastest on this machine)")
+    parser.add_argument("--max-memory", type=pipeline.parse_size, metavar="SIZE",
+                        help="cap chunk buffers of all workers together, e.g. 256M (default: no cap)")
+    parser.add_argument("--fsync", choices=("file", "never"), default=output.DEFAULT_FSYNC,
+                        help="flush each .enc to disk before it appears (default) or leave it to the OS")
+    args = parser.parse_args(argv)
+
+    try:
+        public_keys = [load_public_key(read_recipient(recipient)) for recipient in args.recipient]
+    except Exception as e:
+        parser.error(f"Invalid recipient public key: {e}")
+
+    cipher = engines.select_engine() if args.cipher == engines.AUTO else args.cipher
+    pipeline.set_max_memory(args.max_memory)
+    try:
+        daemon = WatchFolder(args.directories, public_keys, args.state or default_state_path(), args.status,
+                             jobs=args.jobs, queue_size=args.queue_size, settle=args.settle,
+                             poll_interval=args.poll, chunk_size=args.chunk_size, compress=args.compress,
+                             cipher=cipher, fsync=args.fsync)
+    except (ValueError, OSError) as e:
+        parser.error(str(e))
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: daemon.stop())
+    print(f"Watching {', '.join(daemon.directories)}", flush=True)
+    failures = daemon.run()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())